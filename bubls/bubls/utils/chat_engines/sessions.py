@@ -0,0 +1,272 @@
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.chat_engine import CondensePlusContextChatEngine
+from llama_index.core.chat_engine.types import (
+    AgentChatResponse,
+    StreamingAgentChatResponse,
+)
+from llama_index.core.llms.llm import LLM
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.storage.chat_store import SimpleChatStore
+from llama_index.core.utils import get_tokenizer
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+import json
+import os
+import threading
+import time
+
+CHAT_SYSTEM_CONTENT = """
+    Here are the relevant documents for the context:
+    {context_str}
+    ----
+    Given the context information and not prior knowledge,
+    answer to the question, as briefly as possible.
+    Structure your response as a list of facts.
+"""
+
+
+class TokenCountingMemory(ChatMemoryBuffer):
+    """ChatMemoryBuffer tokenizing every message once.
+
+    ChatMemoryBuffer.get tokenizes the kept history again for every message
+    it drops, on every turn. Here the token count of each message is cached
+    when the message is first seen, and the history fitting token_limit is
+    found from cumulative sums of the cached counts. Messages are counted one
+    by one, so totals may differ by a few tokens from tokenizing the joined
+    history.
+    """
+
+    _token_counts: List[int] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "TokenCountingMemory"
+
+    def _message_token_counts(self, messages: List[ChatMessage]) -> List[int]:
+        if len(self._token_counts) > len(messages):
+            # History replaced or shortened outside of set and reset
+            self._token_counts = []
+        for message in messages[len(self._token_counts) :]:
+            self._token_counts.append(
+                len(self.tokenizer_fn(str(message.content)))
+            )
+        return self._token_counts
+
+    def token_count(self) -> int:
+        """Tokens of the whole history."""
+        return sum(self._message_token_counts(self.get_all()))
+
+    def get(
+        self,
+        input: Optional[str] = None,
+        initial_token_count: int = 0,
+        **kwargs: Any,
+    ) -> List[ChatMessage]:
+        """Latest messages fitting token_limit, as ChatMemoryBuffer.get."""
+        chat_history = self.get_all()
+        if initial_token_count > self.token_limit:
+            raise ValueError("Initial token count exceeds token limit")
+        n_messages = len(chat_history)
+        cumulative = [0] + list(
+            accumulate(self._message_token_counts(chat_history))
+        )
+
+        def tokens(message_count: int) -> int:
+            start = n_messages - message_count
+            return cumulative[-1] - cumulative[start] + initial_token_count
+
+        message_count = n_messages
+        token_count = tokens(message_count)
+        while token_count > self.token_limit and message_count > 1:
+            message_count -= 1
+            if chat_history[-message_count].role == MessageRole.TOOL:
+                # Tool messages follow the assistant message calling them
+                message_count -= 1
+            if chat_history[-message_count].role == MessageRole.ASSISTANT:
+                # History can't start with an assistant message
+                message_count -= 1
+            token_count = tokens(message_count)
+        if token_count > self.token_limit or message_count <= 0:
+            return []
+        return chat_history[-message_count:]
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        self._token_counts = []
+        super().set(messages)
+
+    def reset(self) -> None:
+        self._token_counts = []
+        super().reset()
+
+
+class ChatSessionManager:
+    """Chat engines of many sessions sharing one retriever.
+
+    Every session gets a condense_plus_context chat engine over the shared
+    retriever, with its own TokenCountingMemory kept under the session id in
+    a single SimpleChatStore, so a new session costs no index, retriever or
+    tokenizer. Sessions idle for more than ttl seconds, and the least
+    recently used ones beyond max_sessions, are evicted. With spill_dir their
+    history is written to a JSON file there and read back when the session
+    returns, otherwise it is dropped.
+
+    Args:
+        retriever (BaseRetriever): Retriever shared by the sessions, e.g.
+            index.as_retriever() or RAGBuildingBlocks.gen_retriever.
+        llm (Optional[LLM], optional): Chat model. Defaults to None
+            (Settings.llm).
+        context_prompt (str, optional): Prompt of the retrieved context.
+            Defaults to CHAT_SYSTEM_CONTENT.
+        token_limit (int, optional): Tokens of history given to the chat
+            model. Defaults to 3900.
+        max_sessions (int, optional): Sessions kept in memory.
+            Defaults to 1000.
+        ttl (Optional[float], optional): Seconds a session stays in memory
+            without messages, None for no expiry. Defaults to 3600.
+        spill_dir (Optional[str], optional): Directory of evicted sessions.
+            Defaults to None (evicted sessions are forgotten).
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        llm: Optional[LLM] = None,
+        context_prompt: str = CHAT_SYSTEM_CONTENT,
+        token_limit: int = 3900,
+        max_sessions: int = 1000,
+        ttl: Optional[float] = 3600,
+        spill_dir: Optional[str] = None,
+    ):
+        self.retriever = retriever
+        self.llm = llm
+        self.context_prompt = context_prompt
+        self.token_limit = token_limit
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.chat_store = SimpleChatStore()
+        self._tokenizer_fn = get_tokenizer()
+
+        # session id -> (chat engine, time of the last message)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "created": 0,
+            "restored": 0,
+            "expired": 0,
+            "evictions": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "sessions": len(self._sessions)}
+
+    def _spill_path(self, session_id: str) -> str:
+        file_name = f"{quote(session_id, safe='')}.json"
+        return os.path.join(self.spill_dir, file_name)
+
+    def _spill(self, session_id: str, messages: List[ChatMessage]):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(session_id), "w") as f:
+            json.dump([message.dict() for message in messages], f)
+
+    def _restore(self, session_id: str) -> List[ChatMessage]:
+        """History spilled for session_id, removed from spill_dir."""
+        if self.spill_dir is None:
+            return []
+        path = self._spill_path(session_id)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            messages = [ChatMessage.parse_obj(m) for m in json.load(f)]
+        os.remove(path)
+        self._stats["restored"] += 1
+        return messages
+
+    def _evict(self, session_id: str, reason: str):
+        del self._sessions[session_id]
+        messages = self.chat_store.delete_messages(session_id)
+        if self.spill_dir is not None and messages:
+            self._spill(session_id, messages)
+        self._stats[reason] += 1
+
+    def _evict_stale(self):
+        if self.ttl is not None:
+            now = time.time()
+            for session_id, (_, last_used) in list(self._sessions.items()):
+                if now - last_used <= self.ttl:
+                    # Sessions are ordered by last use
+                    break
+                self._evict(session_id, "expired")
+        while len(self._sessions) > self.max_sessions:
+            self._evict(next(iter(self._sessions)), "evictions")
+
+    def _new_engine(self, session_id: str) -> CondensePlusContextChatEngine:
+        history = self._restore(session_id)
+        if history:
+            self.chat_store.set_messages(session_id, history)
+        else:
+            self._stats["created"] += 1
+        memory = TokenCountingMemory(
+            token_limit=self.token_limit,
+            tokenizer_fn=self._tokenizer_fn,
+            chat_store=self.chat_store,
+            chat_store_key=session_id,
+        )
+        return CondensePlusContextChatEngine.from_defaults(
+            retriever=self.retriever,
+            llm=self.llm,
+            memory=memory,
+            context_prompt=self.context_prompt,
+            verbose=False,
+        )
+
+    def session(self, session_id: str) -> CondensePlusContextChatEngine:
+        """Chat engine of session_id, restored or created when needed."""
+        with self._lock:
+            if session_id in self._sessions:
+                chat_engine, _ = self._sessions[session_id]
+            else:
+                chat_engine = self._new_engine(session_id)
+            self._sessions[session_id] = (chat_engine, time.time())
+            self._sessions.move_to_end(session_id)
+            self._evict_stale()
+            return chat_engine
+
+    def chat(self, session_id: str, message: str) -> AgentChatResponse:
+        return self.session(session_id).chat(message)
+
+    async def achat(self, session_id: str, message: str) -> AgentChatResponse:
+        return await self.session(session_id).achat(message)
+
+    def stream_chat(
+        self, session_id: str, message: str
+    ) -> StreamingAgentChatResponse:
+        return self.session(session_id).stream_chat(message)
+
+    def chat_history(self, session_id: str) -> List[ChatMessage]:
+        return self.session(session_id).chat_history
+
+    def reset(self, session_id: str):
+        """Forget the history of session_id, in memory and in spill_dir."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self.chat_store.delete_messages(session_id)
+            if self.spill_dir is not None:
+                path = self._spill_path(session_id)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def spill_all(self):
+        """Write every session to spill_dir, e.g. before shutting down."""
+        if self.spill_dir is None:
+            raise ValueError("spill_dir is not set")
+        with self._lock:
+            for session_id in list(self._sessions):
+                self._evict(session_id, "evictions")
@@ -1,8 +1,10 @@
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core import StorageContext
 import os
 import chromadb
+from bubls.utils.embeddings.cache import with_embedding_cache
+from bubls.utils.indexing.streaming import stream_into_index
 
 
 class ConfigurableChromaIndex:
@@ -14,29 +16,41 @@ class ConfigurableChromaIndex:
     - Different configurations with the objective of testing performance
     """
 
-    def __init__(self, name_collection: str, path: str):
+    def __init__(
+        self, name_collection: str, path: str, streaming: bool = False
+    ):
         # create client and a new collection
         db = chromadb.PersistentClient(
             path=os.path.join(os.environ["WORKDIR"], "chroma_db")
         )
         chroma_collection = db.get_or_create_collection(name_collection)
 
-        # load documents
-        documents = SimpleDirectoryReader(
+        # documents are read lazily by the reader
+        reader = SimpleDirectoryReader(
             os.path.join(os.environ["WORKDIR"], path)
-        ).load_data()
+        )
 
         # set up ChromaVectorStore and load in data
         vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
         storage_context = StorageContext.from_defaults(
             vector_store=vector_store
         )
+        embed_model = with_embedding_cache(Settings.embed_model)
 
         # Create Index
-        self.index = VectorStoreIndex.from_documents(
-            documents,
-            storage_context=storage_context,
-        )
+        if streaming:
+            # Chroma keeps text and vectors, so memory stays constant while
+            # files are read, chunked and inserted in micro-batches
+            self.index = VectorStoreIndex(
+                [], storage_context=storage_context, embed_model=embed_model
+            )
+            stream_into_index(reader, self.index)
+        else:
+            self.index = VectorStoreIndex.from_documents(
+                reader.load_data(),
+                storage_context=storage_context,
+                embed_model=embed_model,
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+from tqdm.notebook import tqdm
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+import asyncio
+import time
+
+
+class AsyncRateLimiter:
+    """Token bucket limiting requests per minute and tokens per minute.
+
+    Both buckets start full and refill continuously, so short bursts up to the
+    limit are allowed and the long run average never exceeds it.
+
+    Args:
+        requests_per_minute (Optional[float], optional): Max requests per minute.
+            Defaults to None (no limit).
+        tokens_per_minute (Optional[float], optional): Max tokens per minute.
+            Defaults to None (no limit).
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.limits = {
+            k: v
+            for k, v in [
+                ("requests", requests_per_minute),
+                ("tokens", tokens_per_minute),
+            ]
+            if v
+        }
+        self._available = dict(self.limits)
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        for k, limit in self.limits.items():
+            self._available[k] = min(
+                limit, self._available[k] + elapsed * limit / 60
+            )
+
+    async def acquire(self, tokens: int = 0):
+        """Wait until one request using tokens fits in the limits."""
+        if not self.limits:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # A single request can't need more than a full bucket
+        needed = {
+            k: min(v, self.limits[k])
+            for k, v in [("requests", 1), ("tokens", tokens)]
+            if k in self.limits
+        }
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = max(
+                    (needed[k] - self._available[k]) * 60 / self.limits[k]
+                    for k in needed
+                )
+                if wait <= 0:
+                    for k in needed:
+                        self._available[k] -= needed[k]
+                    return
+                await asyncio.sleep(wait)
+
+
+async def amap_bounded(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Sequence[Any],
+    max_concurrency: int = 8,
+    rate_limiter: Optional[AsyncRateLimiter] = None,
+    count_tokens: Optional[Callable[[Any], int]] = None,
+    desc: Optional[str] = None,
+) -> Tuple[List[Any], List[float]]:
+    """Await func over every item with at most max_concurrency calls in flight.
+
+    Args:
+        func (Callable[[Any], Awaitable[Any]]): Coroutine function to call.
+        items (Sequence[Any]): Inputs, one call per item.
+        max_concurrency (int, optional): Calls in flight at the same time.
+            Defaults to 8.
+        rate_limiter (Optional[AsyncRateLimiter], optional): Limiter acquired
+            before every call. Defaults to None.
+        count_tokens (Optional[Callable[[Any], int]], optional): Tokens an item
+            consumes from the rate limiter. Defaults to None (0 tokens).
+        desc (Optional[str], optional): Progress bar description.
+
+    Returns:
+        Tuple[List[Any], List[float]]: Results and latencies in seconds, both
+            in the same order as items.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    latencies = [0.0] * len(items)
+    progress = tqdm(total=len(items), desc=desc)
+
+    async def run(i: int, item: Any) -> Any:
+        async with semaphore:
+            if rate_limiter is not None:
+                await rate_limiter.acquire(
+                    count_tokens(item) if count_tokens else 0
+                )
+            start = time.perf_counter()
+            result = await func(item)
+            latencies[i] = time.perf_counter() - start
+            progress.update(1)
+            return result
+
+    results = await asyncio.gather(
+        *(run(i, item) for i, item in enumerate(items))
+    )
+    progress.close()
+    return list(results), latencies
@@ -0,0 +1,126 @@
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import json_to_doc
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, List
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
+
+# Columns that can be loaded on their own, without rebuilding the nodes
+NODE_COLUMNS = ["id_", "text", "metadata", "relationships"]
+JSON_COLUMNS = ["metadata", "relationships", "node"]
+
+
+def save_nodes(nodes: List[BaseNode], path: str):
+    """Store nodes as a parquet file with one column per node field.
+
+    id_, text, metadata and relationships get their own columns, the remaining
+    fields are kept as json in the node column so nodes can be rebuilt exactly.
+
+    Args:
+        nodes (List[BaseNode]): Nodes to store.
+        path (str): Destination parquet file.
+    """
+    columns = {c: [] for c in NODE_COLUMNS + ["node_type", "node"]}
+    for node in nodes:
+        node_dict = node.to_dict()
+        node_dict.pop("embedding", None)
+        for column in NODE_COLUMNS:
+            value = node_dict.pop(column, None)
+            columns[column].append(
+                json.dumps(value) if column in JSON_COLUMNS else value
+            )
+        columns["node_type"].append(str(node.get_type().value))
+        columns["node"].append(json.dumps(node_dict))
+    pq.write_table(pa.table(columns), path)
+
+
+def load_node_column(path: str, column: str) -> List[Any]:
+    """Load a single column of a parquet file written by save_nodes.
+
+    Args:
+        path (str): Parquet file.
+        column (str): One of NODE_COLUMNS.
+
+    Returns:
+        List[Any]: Column values, json columns already decoded.
+    """
+    values = (
+        pq.read_table(path, columns=[column], memory_map=True)
+        .column(column)
+        .to_pylist()
+    )
+    if column in JSON_COLUMNS:
+        return [json.loads(value) for value in values]
+    return values
+
+
+def load_nodes(path: str) -> List[BaseNode]:
+    """Rebuild the nodes stored in a parquet file written by save_nodes."""
+    table = pq.read_table(path, memory_map=True)
+    nodes = []
+    for row in table.to_pylist():
+        node_dict = json.loads(row["node"])
+        for column in NODE_COLUMNS:
+            value = row[column]
+            node_dict[column] = (
+                json.loads(value) if column in JSON_COLUMNS else value
+            )
+        nodes.append(
+            json_to_doc({"__data__": node_dict, "__type__": row["node_type"]})
+        )
+    return nodes
+
+
+def save_questions(questions: List[str], path: str):
+    """Store eval questions as a single column parquet file."""
+    pq.write_table(pa.table({"question": questions}), path)
+
+
+def load_questions(path: str) -> List[str]:
+    return (
+        pq.read_table(path, memory_map=True).column("question").to_pylist()
+    )
+
+
+class LazySplits(MutableMapping):
+    """Mapping of split name to data that is only loaded on first access.
+
+    Args:
+        loader (Callable[[str], Any]): Loads the data of a split given its name.
+        splits (Iterable[str]): Available splits.
+    """
+
+    def __init__(self, loader: Callable[[str], Any], splits: Iterable[str]):
+        self._loader = loader
+        self._splits = list(splits)
+        self._loaded: Dict[str, Any] = {}
+
+    def __getitem__(self, split: str) -> Any:
+        if split not in self._splits:
+            raise KeyError(split)
+        if split not in self._loaded:
+            self._loaded[split] = self._loader(split)
+        return self._loaded[split]
+
+    def __setitem__(self, split: str, value: Any):
+        if split not in self._splits:
+            self._splits.append(split)
+        self._loaded[split] = value
+
+    def __delitem__(self, split: str):
+        self._splits.remove(split)
+        self._loaded.pop(split, None)
+
+    def __iter__(self):
+        return iter(self._splits)
+
+    def __len__(self) -> int:
+        return len(self._splits)
+
+    def __repr__(self) -> str:
+        loaded = ", ".join(
+            f"{s}{'' if s in self._loaded else ' (not loaded)'}"
+            for s in self._splits
+        )
+        return f"LazySplits({loaded})"
@@ -1,5 +1,6 @@
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.node_parser import SentenceSplitter
+from bubls.utils.indexing.streaming import iter_node_batches
 import random
 
 
@@ -25,3 +26,21 @@ def load_corpus(files, pct_sample: float = 1.0, verbose=True):
         print(f"Parsed {len(nodes)} nodes")
 
     return nodes
+
+
+def iter_corpus(files, batch_size: int = 256, verbose=True):
+    """Same parsing as load_corpus, but reading one file at a time and
+    yielding nodes in batches, so memory doesn't grow with the corpus."""
+    if verbose:
+        print(f"Streaming files {files}")
+
+    reader = SimpleDirectoryReader(input_files=files)
+    n_nodes = 0
+    for nodes in iter_node_batches(
+        reader, [SentenceSplitter()], batch_size, show_progress=verbose
+    ):
+        n_nodes += len(nodes)
+        yield nodes
+
+    if verbose:
+        print(f"Parsed {n_nodes} nodes")
@@ -0,0 +1,321 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.embeddings.utils import resolve_embed_model
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from array import array
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Keep well below SQLite's limit of variables per statement
+_SQL_BATCH_SIZE = 500
+
+
+# Fields that don't change the embeddings a model produces
+_NAMESPACE_EXCLUDED_FIELDS = [
+    "api_key",
+    "callback_manager",
+    "embed_batch_size",
+    "num_workers",
+    "timeout",
+    "max_retries",
+]
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _default_namespace(embed_model: BaseEmbedding) -> str:
+    """Model name plus a hash of the model config and, for adapter models,
+    of the adapter weights, so different models never share entries."""
+    config = {
+        k: v
+        for k, v in embed_model.to_dict().items()
+        if k not in _NAMESPACE_EXCLUDED_FIELDS
+    }
+    digest = hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    )
+    adapter = getattr(embed_model, "_adapter", None)
+    if hasattr(adapter, "state_dict"):
+        for param in adapter.state_dict().values():
+            digest.update(param.detach().cpu().numpy().tobytes())
+    return f"{embed_model.model_name}:{digest.hexdigest()[:16]}"
+
+
+class EmbeddingCache:
+    """SQLite backed embedding cache keyed by (model name, text hash).
+
+    Embeddings are stored as float32 blobs. When the cache holds more than
+    max_entries, the least recently used entries are evicted.
+
+    Args:
+        path (str): SQLite file, created if it doesn't exist.
+        max_entries (int, optional): Size cap. Defaults to 1_000_000.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS last_access_idx "
+            "ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._n_entries = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_batch(
+        self, model: str, texts: List[str]
+    ) -> List[Optional[Embedding]]:
+        """Cached embeddings of texts, None for the ones not in the cache."""
+        hashes = [_text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), _SQL_BATCH_SIZE):
+                batch = list(set(hashes[i : i + _SQL_BATCH_SIZE]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT text_hash, embedding FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? "
+                    "WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            n_hits = sum(h in found for h in hashes)
+            self.hits += n_hits
+            self.misses += len(hashes) - n_hits
+
+        return [
+            array("f", found[h]).tolist() if h in found else None
+            for h in hashes
+        ]
+
+    def put_batch(
+        self, model: str, texts: List[str], embeddings: List[Embedding]
+    ):
+        now = time.time()
+        rows = [
+            (model, _text_hash(text), array("f", embedding).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            # A text cached meanwhile, e.g. by another thread, already has
+            # the same embedding, so only new rows are written and counted
+            changes = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self._n_entries += self._conn.total_changes - changes
+            if self._n_entries > self.max_entries:
+                self._evict(self._n_entries - self.max_entries)
+
+    def _evict(self, n: int):
+        deleted = self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN ("
+            "SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+            (n,),
+        ).rowcount
+        self._conn.commit()
+        self._n_entries -= deleted
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "entries": self._n_entries,
+        }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model that looks every text and query up in an EmbeddingCache
+    before calling the wrapped model, which only embeds the misses.
+
+    Args:
+        embed_model (BaseEmbedding): Model to wrap.
+        cache_path (Optional[str], optional): SQLite file of the cache. Defaults
+            to PERSIST_DIR/embedding_cache.sqlite, resolved on first use.
+        max_entries (int, optional): Size cap of the cache.
+            Defaults to 1_000_000.
+        namespace (Optional[str], optional): Name the embeddings are cached
+            under. Defaults to the wrapped model_name plus a hash of its config
+            and adapter weights.
+    """
+
+    cache_path: Optional[str] = Field(
+        default=None, description="SQLite file of the cache."
+    )
+    max_entries: int = Field(
+        default=1_000_000, description="Size cap of the cache."
+    )
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: Optional[EmbeddingCache] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        cache_path: Optional[str] = None,
+        max_entries: int = 1_000_000,
+        namespace: Optional[str] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            model_name=namespace or _default_namespace(embed_model),
+            embed_batch_size=embed_model.embed_batch_size,
+            cache_path=cache_path,
+            max_entries=max_entries,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._cache = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        if self._cache is None:
+            self._cache = EmbeddingCache(
+                self.cache_path
+                or os.path.join(
+                    os.environ["PERSIST_DIR"], "embedding_cache.sqlite"
+                ),
+                max_entries=self.max_entries,
+            )
+        return self._cache
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+    def _cached(self, kind: str, texts: List[str], embed_misses):
+        model = f"{self.model_name}:{kind}"
+        embeddings = self.cache.get_batch(model, texts)
+        misses = [i for i, e in enumerate(embeddings) if e is None]
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            new_embeddings = embed_misses(miss_texts)
+            self.cache.put_batch(model, miss_texts, new_embeddings)
+            for i, embedding in zip(misses, new_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
+    async def _acached(self, kind: str, texts: List[str], aembed_misses):
+        model = f"{self.model_name}:{kind}"
+        embeddings = self.cache.get_batch(model, texts)
+        misses = [i for i, e in enumerate(embeddings) if e is None]
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            new_embeddings = await aembed_misses(miss_texts)
+            self.cache.put_batch(model, miss_texts, new_embeddings)
+            for i, embedding in zip(misses, new_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._cached(
+            "query",
+            [query],
+            lambda q: [self._embed_model.get_query_embedding(q[0])],
+        )[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        async def aembed(q: List[str]) -> List[Embedding]:
+            return [await self._embed_model.aget_query_embedding(q[0])]
+
+        return (await self._acached("query", [query], aembed))[0]
+
+    async def aget_query_embedding_batch(
+        self,
+        queries: List[str],
+        aembed_misses: Optional[
+            Callable[[List[str]], Awaitable[List[Embedding]]]
+        ] = None,
+    ) -> List[Embedding]:
+        """Query embeddings of queries, looked up in the cache at once.
+
+        Args:
+            queries (List[str]): Query strings.
+            aembed_misses (Optional[Callable], optional): Embeds the queries
+                missing from the cache with the wrapped model. Defaults to one
+                aget_query_embedding per query, all in flight at once.
+
+        Returns:
+            List[Embedding]: Embedding of every query.
+        """
+
+        async def aembed(q: List[str]) -> List[Embedding]:
+            return list(
+                await asyncio.gather(
+                    *map(self._embed_model.aget_query_embedding, q)
+                )
+            )
+
+        return await self._acached("query", queries, aembed_misses or aembed)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._cached(
+            "text", texts, self._embed_model.get_text_embedding_batch
+        )
+
+    async def _aget_text_embeddings(
+        self, texts: List[str]
+    ) -> List[Embedding]:
+        return await self._acached(
+            "text", texts, self._embed_model.aget_text_embedding_batch
+        )
+
+
+def with_embedding_cache(embed_model: Any, **kwargs: Any) -> CachedEmbedding:
+    """Wrap embed_model in a CachedEmbedding unless it already is one.
+
+    Args:
+        embed_model (Any): BaseEmbedding or anything accepted by
+            llama_index's resolve_embed_model, e.g. "local:BAAI/bge-small-en".
+        kwargs: Passed to CachedEmbedding.
+    """
+    if isinstance(embed_model, CachedEmbedding):
+        return embed_model
+    return CachedEmbedding(resolve_embed_model(embed_model), **kwargs)
@@ -3,18 +3,68 @@ from llama_index.core.llama_dataset.legacy.embedding import (
 )
 from llama_index.core import VectorStoreIndex
 from llama_index.core.schema import TextNode
+from bubls.utils.embeddings.cache import with_embedding_cache
+from bubls.utils.evaluation.retrieval_metrics import (
+    DEFAULT_KS,
+    id_matrices,
+    retrieval_metrics,
+)
+from bubls.utils.retrieval.batch import aembed_queries, retrieve_batch
+from bubls.utils.vector_stores.numpy_store import batch_top_k, normalize_rows
 from tqdm.notebook import tqdm
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 from sentence_transformers.evaluation import InformationRetrievalEvaluator
 from sentence_transformers import SentenceTransformer
 from pathlib import Path
 import pandas as pd
+import numpy as np
+import asyncio
+import nest_asyncio
+
+nest_asyncio.apply()
+
+# Bytes of similarity scores held at once by rank_corpus
+DEFAULT_MEMORY_BUDGET = 1 << 28
+
+
+def _eval_results(
+    dataset: EmbeddingQAFinetuneDataset,
+    retrieved: Dict[str, List[str]],
+    ks: List[int] = DEFAULT_KS,
+    top_k: Optional[int] = None,
+) -> pd.DataFrame:
+    """Hit, reciprocal rank and retrieval_metrics at ks of the ids retrieved
+    for every query, against all its relevant docs. Hit, reciprocal rank and
+    the retrieved column only count the first top_k ids, all by default."""
+    query_ids = list(retrieved)
+    expected = [dataset.relevant_docs[query_id] for query_id in query_ids]
+    retrieved_codes, relevant_codes = id_matrices(
+        [retrieved[query_id] for query_id in query_ids], expected
+    )
+    metrics = retrieval_metrics(retrieved_codes, relevant_codes, ks)
+    top_k = top_k or retrieved_codes.shape[1]
+    mrr = retrieval_metrics(retrieved_codes[:, :top_k], relevant_codes, [])
+    eval_results = pd.DataFrame(
+        {
+            "is_hit": mrr["mrr"] > 0,
+            "mrr": mrr["mrr"],
+            "retrieved": [
+                retrieved[query_id][:top_k] for query_id in query_ids
+            ],
+            "expected": expected,
+            "query": query_ids,
+        }
+    )
+    return pd.concat([eval_results, metrics.drop(columns="mrr")], axis=1)
 
 
 def evaluate_retriever(
     dataset: EmbeddingQAFinetuneDataset,
     retriever,
     verbose: bool = False,
+    batch: bool = True,
+    max_concurrency: int = 8,
+    ks: List[int] = DEFAULT_KS,
 ) -> pd.DataFrame:
     """Dataset contains
     - queries
@@ -22,47 +72,114 @@ def evaluate_retriever(
     - all nodes in dataset
 
     For all queries,
-    we get the top k retrieved nodes from the retriever. Then we check if the
-    relevant node is in the retrieved ones.
+    we get the top k retrieved nodes from the retriever. Then we check which
+    relevant nodes are in the retrieved ones.
 
     Args:
         dataset (EmbeddingQAFinetuneDataset): Dataset to evaluate generated from
             EmbeddingQAFinetuneDataset.
         retriever (_type_):
         verbose (bool, optional): Show progress. Defaults to False.
+        batch (bool, optional): Retrieve every query at once with
+            retrieve_batch instead of one retrieve call per query.
+            Defaults to True.
+        max_concurrency (int, optional): Requests in flight when batching.
+            Defaults to 8.
+        ks (List[int], optional): Cutoffs of the hit@k, recall@k,
+            precision@k and ndcg@k columns, see retrieval_metrics.
+            Defaults to [1, 3, 5, 10].
 
     Returns:
-        pd.DataFrame: Each row has information of a query and if
-            it was a hit or not
+        pd.DataFrame: Each row has information of a query, if it was a hit
+            or not and its metrics at every k
     """
-    corpus = dataset.corpus
     queries = dataset.queries
-    relevant_docs = dataset.relevant_docs
 
-    eval_results = []
-    for query_id, query in tqdm(queries.items()):
-        retrieved_nodes = retriever.retrieve(query)
-        retrieved_ids = [node.node.node_id for node in retrieved_nodes]
-        expected_id = relevant_docs[query_id][0]
-
-        rank = None
-        for idx, id in enumerate(retrieved_ids):
-            if id == expected_id:
-                rank = idx + 1
-                break
-
-        is_hit = rank is not None  # assume 1 relevant doc
-        mrr = 0 if rank is None else 1 / rank
-
-        eval_result = {
-            "is_hit": is_hit,
-            "mrr": mrr,
-            "retrieved": retrieved_ids,
-            "expected": expected_id,
-            "query": query_id,
-        }
-        eval_results.append(eval_result)
-    return pd.DataFrame(eval_results)
+    query_ids = list(queries)
+    if batch:
+        retrieved_nodes = retrieve_batch(
+            retriever,
+            [queries[query_id] for query_id in query_ids],
+            max_concurrency=max_concurrency,
+        )
+    else:
+        retrieved_nodes = [
+            retriever.retrieve(queries[query_id])
+            for query_id in tqdm(query_ids)
+        ]
+    return _eval_results(
+        dataset,
+        {
+            query_id: [node.node.node_id for node in nodes]
+            for query_id, nodes in zip(query_ids, retrieved_nodes)
+        },
+        ks,
+    )
+
+
+def embed_dataset(
+    dataset: EmbeddingQAFinetuneDataset,
+    embed_model,
+    verbose: bool = False,
+    max_concurrency: int = 8,
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Normalized embeddings of the corpus and of the queries of dataset,
+    going through the persistent embedding cache.
+
+    Args:
+        dataset (EmbeddingQAFinetuneDataset): Dataset to embed.
+        embed_model (_type_): Model to be used for creating embeddings
+        verbose (bool, optional): Show progress. Defaults to False.
+        max_concurrency (int, optional): Query embedding requests in flight.
+            Defaults to 8.
+
+    Returns:
+        Tuple[List[str], np.ndarray, np.ndarray]: Corpus ids, corpus matrix
+            in the same order and query matrix in the order of
+            dataset.queries.
+    """
+    embed_model = with_embedding_cache(embed_model)
+    corpus_ids = list(dataset.corpus)
+    corpus_embeddings = embed_model.get_text_embedding_batch(
+        [dataset.corpus[id_] for id_ in corpus_ids], show_progress=verbose
+    )
+    query_embeddings = asyncio.run(
+        aembed_queries(
+            embed_model, list(dataset.queries.values()), max_concurrency
+        )
+    )
+    return (
+        corpus_ids,
+        normalize_rows(corpus_embeddings),
+        normalize_rows(query_embeddings),
+    )
+
+
+def rank_corpus(
+    query_matrix: np.ndarray,
+    corpus_matrix: np.ndarray,
+    k: int,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+) -> np.ndarray:
+    """Positions of the k corpus rows most similar to every query, best first.
+
+    The query x corpus similarity matrix is computed by blocks of queries
+    holding at most memory_budget bytes of scores, and every block is ranked
+    with a single partial sort, so rankings at any smaller k are prefixes.
+
+    Args:
+        query_matrix (np.ndarray): Normalized query embeddings.
+        corpus_matrix (np.ndarray): Normalized corpus embeddings.
+        k (int): Deepest rank needed.
+        memory_budget (int, optional): Bytes of scores per block.
+            Defaults to 256 MiB.
+    """
+    block = max(1, memory_budget // (4 * max(len(corpus_matrix), 1)))
+    ranked = np.empty((len(query_matrix), min(k, len(corpus_matrix))), int)
+    for start in range(0, len(query_matrix), block):
+        scores = query_matrix[start : start + block] @ corpus_matrix.T
+        ranked[start : start + block] = batch_top_k(scores, k)
+    return ranked
 
 
 def evaluate_embed_model(
@@ -70,15 +187,20 @@ def evaluate_embed_model(
     embed_model,
     top_k: int = 5,
     verbose: bool = False,
+    batch: bool = True,
+    ks: List[int] = DEFAULT_KS,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
 ) -> pd.DataFrame:
     """Dataset contains
     - queries
     - relevant node for each query
     - all nodes in dataset
 
-    We first create an index from the embed model. Then, for all queries,
-    we get the top k retrieved nodes from the model. Then we check if the
-    relevant node is in the retrieved ones.
+    We first embed the corpus and the queries with the embed model, going
+    through the persistent embedding cache. Then we rank the corpus for all
+    queries from their cosine similarity matrix, see rank_corpus, without
+    building an index. Then we check which relevant nodes are in the top k
+    ones, and compute the metrics at every k of ks from the same ranking.
 
     Args:
         dataset (EmbeddingQAFinetuneDataset): Dataset to evaluate generated from
@@ -86,45 +208,75 @@ def evaluate_embed_model(
         embed_model (_type_): Model to be used for creating embeddings
         top_k (int, optional): How many nodes to retrieve. Defaults to 5.
         verbose (bool, optional): Show progress. Defaults to False.
+        batch (bool, optional): Rank from the similarity matrix. False builds
+            a VectorStoreIndex and retrieves one query at a time.
+            Defaults to True.
+        ks (List[int], optional): Cutoffs of the hit@k, recall@k,
+            precision@k and ndcg@k columns. Defaults to [1, 3, 5, 10].
+        memory_budget (int, optional): Bytes of similarity scores held at
+            once. Defaults to 256 MiB.
 
     Returns:
-        pd.DataFrame: Each row has information of a query and if
-            it was a hit or not
+        pd.DataFrame: Each row has information of a query, if it was a hit
+            or not and its metrics at every k
     """
-    corpus = dataset.corpus
-    queries = dataset.queries
-    relevant_docs = dataset.relevant_docs
+    if not batch:
+        nodes = [
+            TextNode(id_=id_, text=text)
+            for id_, text in dataset.corpus.items()
+        ]
+        index = VectorStoreIndex(
+            nodes,
+            embed_model=with_embedding_cache(embed_model),
+            show_progress=verbose,
+        )
+        retriever = index.as_retriever(
+            similarity_top_k=max([top_k, *ks])
+        )
+        eval_results = evaluate_retriever(
+            dataset, retriever, verbose, batch=False, ks=[]
+        )
+        return _eval_results(
+            dataset,
+            dict(zip(eval_results["query"], eval_results["retrieved"])),
+            ks,
+            top_k,
+        )
 
-    nodes = [TextNode(id_=id_, text=text) for id_, text in corpus.items()]
-    index = VectorStoreIndex(
-        nodes, embed_model=embed_model, show_progress=verbose
+    corpus_ids, corpus_matrix, query_matrix = embed_dataset(
+        dataset, embed_model, verbose
+    )
+    ranked = rank_corpus(
+        query_matrix, corpus_matrix, max([top_k, *ks]), memory_budget
+    )
+    corpus_ids = np.array(corpus_ids, dtype=object)
+    return _eval_results(
+        dataset,
+        {
+            query_id: corpus_ids[rows].tolist()
+            for query_id, rows in zip(dataset.queries, ranked)
+        },
+        ks,
+        top_k,
     )
-    retriever = index.as_retriever(similarity_top_k=top_k)
-
-    eval_results = []
-    for query_id, query in tqdm(queries.items()):
-        retrieved_nodes = retriever.retrieve(query)
-        retrieved_ids = [node.node.node_id for node in retrieved_nodes]
-        expected_id = relevant_docs[query_id][0]
-
-        rank = None
-        for idx, id in enumerate(retrieved_ids):
-            if id == expected_id:
-                rank = idx + 1
-                break
-
-        is_hit = rank is not None  # assume 1 relevant doc
-        mrr = 0 if rank is None else 1 / rank
-
-        eval_result = {
-            "is_hit": is_hit,
-            "mrr": mrr,
-            "retrieved": retrieved_ids,
-            "expected": expected_id,
-            "query": query_id,
+
+
+def compare_embed_models(
+    dataset: EmbeddingQAFinetuneDataset,
+    embed_models: Dict[str, Any],
+    top_k: int = 5,
+    ks: List[int] = DEFAULT_KS,
+) -> pd.DataFrame:
+    """Mean metrics of several embed models on dataset, e.g. a base model and
+    its fine-tuned adapter, one row per model, see evaluate_embed_model."""
+    return pd.DataFrame(
+        {
+            name: evaluate_embed_model(
+                dataset, embed_model, top_k=top_k, ks=ks
+            ).mean(numeric_only=True)
+            for name, embed_model in embed_models.items()
         }
-        eval_results.append(eval_result)
-    return pd.DataFrame(eval_results)
+    ).T
 
 
 def sentence_transformer_ir_evaluator(
@@ -3,15 +3,234 @@ from llama_index.core.evaluation import (
     RelevancyEvaluator,
 )
 from llama_index.core import Settings
+from llama_index.core.base.response.schema import (
+    AsyncStreamingResponse,
+    Response,
+    StreamingResponse,
+)
+from bubls.utils.concurrency import amap_bounded
+from bubls.utils.evaluation.judges import aevaluate_with_judges
+from bubls.utils.timing import format_latency_summary, latency_summary
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+import asyncio
+import nest_asyncio
 import time
 from tqdm.notebook import tqdm
 
+nest_asyncio.apply()
+
+
+def _consume_stream(
+    response: StreamingResponse, start: float
+) -> Tuple[Optional[float], Response]:
+    """Time to first token of a synchronous stream, and its full response."""
+    ttft, tokens = None, []
+    for token in response.response_gen:
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        tokens.append(token)
+    return ttft, Response(
+        "".join(tokens), response.source_nodes, response.metadata
+    )
+
+
+async def _timed_query(
+    query_engine, question: str, start: Optional[float] = None
+) -> Dict[str, Any]:
+    """Response of question with its latency and, for streaming query
+    engines, its time to first token, both counted from start."""
+    start = time.perf_counter() if start is None else start
+    ttft, error = None, None
+    try:
+        response = await query_engine.aquery(question)
+        if isinstance(response, AsyncStreamingResponse):
+            tokens = []
+            async for token in response.async_response_gen():
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                tokens.append(token)
+            response = Response(
+                "".join(tokens), response.source_nodes, response.metadata
+            )
+        elif isinstance(response, StreamingResponse):
+            # Don't block the other requests while reading the stream
+            ttft, response = await asyncio.to_thread(
+                _consume_stream, response, start
+            )
+    except Exception as e:
+        response, error = None, repr(e)
+    return {
+        "question": question,
+        "response": response,
+        "latency": time.perf_counter() - start,
+        "ttft": ttft,
+        "error": error,
+    }
 
-def evaluate_llm_performance(questions, query_engine):
+
+async def aload_test(
+    questions: List[str],
+    query_engine,
+    qps: Optional[float] = None,
+    concurrency: Optional[int] = 8,
+    n_requests: Optional[int] = None,
+) -> pd.DataFrame:
+    """Replay questions against query_engine under concurrent load.
+
+    With qps, requests arrive at a fixed rate whatever the engine's speed
+    (open loop), and their latency counts from the scheduled arrival, so time
+    spent queued behind slow requests is included. Without qps, concurrency
+    clients send a new request as soon as their previous one returns (closed
+    loop). Streaming query engines, e.g. as_query_engine(streaming=True), also
+    report the time to first token. No judge is called, see
+    ajudge_load_test.
+
+    Args:
+        questions (List[str]): Questions replayed in order, cycling when
+            n_requests is larger.
+        query_engine (_type_): Query engine under test.
+        qps (Optional[float], optional): Target requests per second.
+            Defaults to None (closed loop).
+        concurrency (Optional[int], optional): Requests in flight at most,
+            None for no cap in open loop. Defaults to 8.
+        n_requests (Optional[int], optional): Requests sent.
+            Defaults to len(questions).
+
+    Returns:
+        pd.DataFrame: One row per request with question, response, latency,
+            ttft (seconds) and error. Throughput, latency and ttft percentiles
+            are stored in attrs["performance"].
+    """
+    n_requests = n_requests or len(questions)
+    requests = [questions[i % len(questions)] for i in range(n_requests)]
+    start = time.perf_counter()
+    if qps is None:
+        results, _ = await amap_bounded(
+            lambda question: _timed_query(query_engine, question),
+            requests,
+            max_concurrency=concurrency or n_requests,
+            desc="Load test",
+        )
+    else:
+        semaphore = asyncio.Semaphore(concurrency or n_requests)
+        progress = tqdm(total=n_requests, desc="Load test")
+
+        async def arrive(i: int, question: str) -> Dict[str, Any]:
+            arrival = start + i / qps
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            async with semaphore:
+                result = await _timed_query(query_engine, question, arrival)
+            progress.update(1)
+            return result
+
+        results = await asyncio.gather(
+            *(arrive(i, question) for i, question in enumerate(requests))
+        )
+        progress.close()
+    elapsed = time.perf_counter() - start
+
+    df = pd.DataFrame(results)
+    ok = df[df["error"].isna()]
+    summary = latency_summary(ok["latency"].tolist())
+    df.attrs["performance"] = {
+        "target_qps": qps,
+        "concurrency": concurrency,
+        "queries_per_second": len(df) / elapsed if elapsed else 0.0,
+        "errors": int(df["error"].notna().sum()),
+        **summary,
+        "ttft": latency_summary(ok["ttft"].dropna().tolist()),
+    }
+    print(
+        f"{df.attrs['performance']['queries_per_second']:.2f} queries/s, "
+        f"{df.attrs['performance']['errors']} errors, "
+        + format_latency_summary(summary)
+    )
+    if df.attrs["performance"]["ttft"]["count"]:
+        print(
+            "time to first token: "
+            + format_latency_summary(df.attrs["performance"]["ttft"])
+        )
+    return df
+
+
+async def ajudge_load_test(
+    df: pd.DataFrame, judges: Optional[Dict[str, Any]] = None, **kwargs: Any
+) -> pd.DataFrame:
+    """Pass or fail of every judge on the responses of aload_test, judged in
+    one batched phase after the load test, see aevaluate_with_judges.
+
+    Args:
+        df (pd.DataFrame): Output of aload_test.
+        judges (Optional[Dict[str, Any]], optional): Judges by column name.
+            Defaults to faithfulness and relevancy with Settings.llm.
+        kwargs: Passed to aevaluate_with_judges, e.g. max_concurrency.
+    """
+    judges = judges or {
+        "faithfulness": FaithfulnessEvaluator(llm=Settings.llm),
+        "relevancy": RelevancyEvaluator(llm=Settings.llm),
+    }
+    answered = df[df["error"].isna()]
+    eval_df = pd.DataFrame(
+        {
+            "query": answered["question"],
+            "response": answered["response"].map(str),
+            "contexts": answered["response"].map(
+                lambda response: [
+                    node.get_content() for node in response.source_nodes
+                ]
+            ),
+            "reference": None,
+        }
+    )
+    return await aevaluate_with_judges(
+        eval_df, judges, value="passing", **kwargs
+    )
+
+
+def evaluate_llm_performance(
+    questions,
+    query_engine,
+    load_test: bool = False,
+    qps: Optional[float] = None,
+    concurrency: Optional[int] = 8,
+    n_requests: Optional[int] = None,
+    judge: bool = True,
+):
     """
     Evaluate the average response time, faithfulness, and relevancy of
     responses generated by GPT-3.5-turbo for a given chunk size.
+
+    With load_test, questions are replayed concurrently by aload_test, at qps
+    or with concurrency requests in flight, and the responses are judged
+    afterwards by ajudge_load_test (unless judge is False). Latency and time
+    to first token percentiles are added to the results.
     """
+    if load_test:
+        df = asyncio.run(
+            aload_test(questions, query_engine, qps, concurrency, n_requests)
+        )
+        performance = df.attrs["performance"]
+        results = {
+            "response_time": performance.get("mean"),
+            "queries_per_second": performance["queries_per_second"],
+            "errors": performance["errors"],
+            **{
+                f"latency_{k}": performance[k]
+                for k in ["p50", "p90", "p99"]
+                if k in performance
+            },
+            **{
+                f"ttft_{k}": performance["ttft"][k]
+                for k in ["p50", "p90", "p99"]
+                if k in performance["ttft"]
+            },
+        }
+        if judge:
+            verdicts = asyncio.run(ajudge_load_test(df))
+            results.update(verdicts.astype(float).mean().to_dict())
+        return results
+
     # Define Faithfulness and Relevancy Evaluators
     faithfulness_gpt4 = FaithfulnessEvaluator(llm=Settings.llm)
     relevancy_gpt4 = RelevancyEvaluator(llm=Settings.llm)
@@ -0,0 +1,245 @@
+from llama_index.core.llama_dataset.legacy.embedding import (
+    EmbeddingQAFinetuneDataset,
+)
+from llama_index.core import Settings, StorageContext, VectorStoreIndex
+from llama_index.core.schema import QueryBundle
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from bubls.utils.embeddings.cache import with_embedding_cache
+from bubls.utils.evaluation.evaluate_embeddings import evaluate_retriever
+from bubls.utils.indexing import embedded_nodes, indexed_node_ids, load_index
+from bubls.utils.retrieval.batch import aembed_queries
+from bubls.utils.timing import latency_summary
+from bubls.utils.vector_stores import make_vector_store
+from typing import Any, Dict, List
+import asyncio
+import nest_asyncio
+import multiprocessing
+import pandas as pd
+import time
+
+nest_asyncio.apply()
+
+
+def _index_with_store(index: VectorStoreIndex, nodes, spec) -> VectorStoreIndex:
+    """Index of nodes, which are already embedded, in the store of spec."""
+    return VectorStoreIndex(
+        nodes,
+        storage_context=StorageContext.from_defaults(
+            vector_store=make_vector_store(spec)
+        ),
+        embed_model=index._embed_model,
+    )
+
+
+def evaluate_vector_stores(
+    dataset: EmbeddingQAFinetuneDataset,
+    index: VectorStoreIndex,
+    vector_stores: Dict[str, Any],
+    top_k: int = 5,
+) -> pd.DataFrame:
+    """Recall@k against memory of several vector stores over the nodes of
+    index, to choose how much to compress the vectors of a component.
+
+    The embeddings stored in index are reused, nothing is embedded again
+    besides the queries. Every store is evaluated with evaluate_retriever, and
+    compared to exact float32 search ("float32" row).
+
+    Args:
+        dataset (EmbeddingQAFinetuneDataset): Queries whose relevant nodes are
+            in index, e.g. qa_pairs[c_id]["train"].
+        index (VectorStoreIndex): Index with the nodes and embeddings.
+        vector_stores (Dict[str, Any]): Name of each option and its
+            vector_store value for gen_index, e.g. {"int8": "int8",
+            "pq_16": {"type": "pq", "subvector_dim": 16}}.
+        top_k (int, optional): How many nodes to retrieve. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: One row per store with hit_rate and mrr on dataset,
+            recall_vs_exact (share of the exact top_k retrieved), the bytes
+            scanned per query and the compression against float32.
+    """
+    nodes = embedded_nodes(index)
+    results = {}
+    for name, spec in {"float32": "numpy", **vector_stores}.items():
+        store_index = _index_with_store(index, nodes, spec)
+        eval_df = evaluate_retriever(
+            dataset, store_index.as_retriever(similarity_top_k=top_k)
+        )
+        results[name] = (eval_df, store_index.vector_store.memory_bytes())
+
+    exact_df, exact_bytes = results["float32"]
+    rows = []
+    for name, (eval_df, memory_bytes) in results.items():
+        recall_vs_exact = [
+            len(set(retrieved) & set(exact)) / len(exact) if exact else 1.0
+            for retrieved, exact in zip(
+                eval_df["retrieved"], exact_df["retrieved"]
+            )
+        ]
+        rows.append(
+            {
+                "vector_store": name,
+                "hit_rate": eval_df["is_hit"].mean(),
+                "mrr": eval_df["mrr"].mean(),
+                "recall_vs_exact": sum(recall_vs_exact) / len(eval_df),
+                "memory_bytes": memory_bytes,
+                "bytes_per_vector": memory_bytes / max(len(nodes), 1),
+                "compression": exact_bytes / memory_bytes
+                if memory_bytes
+                else None,
+            }
+        )
+    return pd.DataFrame(rows).set_index("vector_store")
+
+
+def benchmark_vector_stores(
+    qa_pairs: Dict[str, EmbeddingQAFinetuneDataset],
+    index: VectorStoreIndex,
+    vector_stores: Dict[str, Any],
+    top_k: int = 5,
+) -> pd.DataFrame:
+    """Search latency and recall of approximate vector stores against exact
+    search, over the nodes of index and the queries of every qa_pairs split.
+
+    Query embeddings are computed once, so latencies only measure the search
+    in the vector store. Queries carry the node ids of index, as the
+    retrievers of gen_retriever and gen_query_engine pass them, so latencies
+    include restricting the search to them.
+
+    Args:
+        qa_pairs (Dict[str, EmbeddingQAFinetuneDataset]): Queries per split,
+            e.g. RAGBuildingBlocks.qa_pairs[c_id].
+        index (VectorStoreIndex): Index with the nodes and embeddings.
+        vector_stores (Dict[str, Any]): Name of each option and its
+            vector_store value for gen_index, e.g. {"hnsw": {"type": "hnsw",
+            "M": 32}, "ivf": {"type": "ivf", "nprobe": 4}}.
+        top_k (int, optional): How many nodes to retrieve. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: One row per split and store with recall_vs_exact,
+            hit_rate (only meaningful for the split the index was built on),
+            latency percentiles in ms, speedup over exact search, build time
+            and memory.
+    """
+    nodes = embedded_nodes(index)
+    node_ids = indexed_node_ids(index)
+    stores, build_seconds = {}, {}
+    for name, spec in {"exact": "numpy", **vector_stores}.items():
+        start = time.perf_counter()
+        store = _index_with_store(index, nodes, spec).vector_store
+        store.memory_bytes()  # builds the search structures
+        build_seconds[name] = time.perf_counter() - start
+        stores[name] = store
+
+    rows = []
+    for split, dataset in qa_pairs.items():
+        query_ids = list(dataset.queries)
+        query_embeddings = asyncio.run(
+            aembed_queries(
+                index._embed_model,
+                [dataset.queries[query_id] for query_id in query_ids],
+            )
+        )
+        retrieved, latencies = {}, {}
+        for name, store in stores.items():
+            retrieved[name], latencies[name] = [], []
+            for query_embedding in query_embeddings:
+                start = time.perf_counter()
+                result = store.query(
+                    VectorStoreQuery(
+                        query_embedding=query_embedding,
+                        similarity_top_k=top_k,
+                        node_ids=node_ids,
+                    )
+                )
+                latencies[name].append(time.perf_counter() - start)
+                retrieved[name].append(result.ids)
+
+        exact_latency = latency_summary(latencies["exact"])
+        for name, store in stores.items():
+            recall = [
+                len(set(ids) & set(exact)) / len(exact) if exact else 1.0
+                for ids, exact in zip(retrieved[name], retrieved["exact"])
+            ]
+            hits = [
+                bool(set(ids) & set(dataset.relevant_docs[query_id]))
+                for ids, query_id in zip(retrieved[name], query_ids)
+            ]
+            latency = latency_summary(latencies[name])
+            rows.append(
+                {
+                    "split": split,
+                    "vector_store": name,
+                    "recall_vs_exact": sum(recall) / max(len(recall), 1),
+                    "hit_rate": sum(hits) / max(len(hits), 1),
+                    "p50_ms": latency.get("p50", 0.0) * 1000,
+                    "p99_ms": latency.get("p99", 0.0) * 1000,
+                    "speedup": exact_latency["mean"] / latency["mean"]
+                    if latency.get("mean")
+                    else None,
+                    "build_seconds": build_seconds[name],
+                    "memory_bytes": store.memory_bytes(),
+                }
+            )
+    return pd.DataFrame(rows).set_index(["split", "vector_store"])
+
+
+def _cold_start(
+    persist_dir: str, query: str, query_embedding: List[float], top_k: int
+) -> Dict[str, float]:
+    start = time.perf_counter()
+    # The query embedding is given, no embedding model is needed
+    Settings.embed_model = None
+    index = load_index(persist_dir)
+    loaded = time.perf_counter()
+    retrieved = index.as_retriever(similarity_top_k=top_k).retrieve(
+        QueryBundle(query, embedding=query_embedding)
+    )
+    for node in retrieved:
+        node.node.get_content()
+    end = time.perf_counter()
+    return {
+        "load_seconds": loaded - start,
+        "first_query_seconds": end - loaded,
+        "time_to_first_query": end - start,
+    }
+
+
+def benchmark_cold_start(
+    persist_dirs: Dict[str, str],
+    query: str,
+    top_k: int = 3,
+    repeat: int = 3,
+) -> pd.DataFrame:
+    """Time to first query of persisted indexes, each one loaded in a new
+    process as a service would at startup.
+
+    Timings start after imports and include loading the index, retrieving
+    query and reading the text of the retrieved nodes. Files are likely in the
+    OS page cache after the first repeat. Processes are spawned, so scripts
+    must call it under if __name__ == "__main__".
+
+    Args:
+        persist_dirs (Dict[str, str]): Name and persist dir of every index,
+            e.g. a default index and its snapshot_index.
+        query (str): Query, embedded once with Settings.embed_model.
+        top_k (int, optional): Nodes retrieved. Defaults to 3.
+        repeat (int, optional): Processes started per index. Defaults to 3.
+
+    Returns:
+        pd.DataFrame: Median load_seconds, first_query_seconds and
+            time_to_first_query of every index.
+    """
+    query_embedding = with_embedding_cache(
+        Settings.embed_model
+    ).get_query_embedding(query)
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for name, persist_dir in persist_dirs.items():
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                timings = pool.apply(
+                    _cold_start, (persist_dir, query, query_embedding, top_k)
+                )
+            rows.append({"index": name, **timings})
+    return pd.DataFrame(rows).groupby("index").median()
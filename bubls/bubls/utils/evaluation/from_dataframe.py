@@ -1,5 +1,9 @@
+from bubls.utils.evaluation.retrieval_metrics import (
+    DEFAULT_KS,
+    retrieval_metrics,
+)
 import pandas as pd
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 
 def is_hit(row):
@@ -13,6 +17,32 @@ def reciprocal_ranking(row):
         return 0
 
 
+def with_retrieval_metrics(
+    df: pd.DataFrame,
+    ks: List[int] = DEFAULT_KS,
+    retrieved: str = "contexts_ids",
+    relevant: str = "reference_id",
+) -> pd.DataFrame:
+    """Eval table with is_hit, reciprocal_ranking and the retrieval_metrics of
+    every row, computed for the whole table at once instead of with apply.
+
+    Args:
+        df (pd.DataFrame): Eval table, e.g. from
+            RAGBuildingBlocks.gen_eval_data.
+        ks (List[int], optional): Cutoffs. Defaults to [1, 3, 5, 10].
+        retrieved (str, optional): Column of retrieved ids, best first.
+            Defaults to "contexts_ids".
+        relevant (str, optional): Column of relevant ids, one id or a list
+            per row. Defaults to "reference_id".
+    """
+    metrics = retrieval_metrics(df[retrieved], df[relevant], ks)
+    metrics.index = df.index
+    df = df.assign(
+        is_hit=metrics["mrr"] > 0, reciprocal_ranking=metrics["mrr"]
+    )
+    return pd.concat([df, metrics.drop(columns="mrr")], axis=1)
+
+
 def evaluate_with_judge(row, judge):
     f = judge.evaluate(
         query=row["query"],
@@ -0,0 +1,286 @@
+from llama_index.core import Settings
+from llama_index.core.evaluation import BaseEvaluator, EvaluationResult
+from bubls.utils.concurrency import AsyncRateLimiter, amap_bounded
+from typing import Any, Dict, List, Optional
+import pandas as pd
+import asyncio
+import nest_asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+nest_asyncio.apply()
+
+# Keep well below SQLite's limit of variables per statement
+_SQL_BATCH_SIZE = 500
+
+# Fields of the judge LLM that don't change its verdicts
+_NAMESPACE_EXCLUDED_FIELDS = [
+    "api_key",
+    "api_base",
+    "callback_manager",
+    "timeout",
+    "max_retries",
+    "reuse_client",
+]
+
+
+def judge_namespace(judge: BaseEvaluator) -> str:
+    """Judge type plus a hash of its LLM config, prompts and settings, so
+    verdicts of different judges are never shared."""
+    llm = getattr(judge, "_llm", None) or getattr(judge, "model", None)
+    if hasattr(llm, "to_dict"):
+        llm = {
+            k: v
+            for k, v in llm.to_dict().items()
+            if k not in _NAMESPACE_EXCLUDED_FIELDS
+        }
+    config = {
+        "llm": llm,
+        "prompts": {
+            name: getattr(prompt, "template", str(prompt))
+            for name, prompt in (
+                judge.get_prompts() if hasattr(judge, "get_prompts") else {}
+            ).items()
+        },
+        "settings": {
+            k: v
+            for k, v in vars(judge).items()
+            if isinstance(v, (str, int, float, bool))
+        },
+    }
+    digest = hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    )
+    return f"{type(judge).__name__}:{digest.hexdigest()[:16]}"
+
+
+def _is_missing(value: Any) -> bool:
+    return not isinstance(value, str) and pd.isna(value)
+
+
+def _verdict_key(
+    namespace: str,
+    query: str,
+    response: str,
+    contexts: List[str],
+    reference: Optional[str],
+) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            [namespace, query, response, list(contexts), reference]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+class VerdictCache:
+    """SQLite backed cache of judge verdicts keyed by a hash of the judge
+    namespace, query, response, contexts and reference.
+
+    Args:
+        path (str): SQLite file, created if it doesn't exist.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS verdicts (
+                key TEXT PRIMARY KEY,
+                judge TEXT NOT NULL,
+                verdict TEXT NOT NULL,
+                created REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get_batch(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Cached verdicts of keys, None for the ones not in the cache."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = list(set(keys[i : i + _SQL_BATCH_SIZE]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT key, verdict FROM verdicts "
+                    f"WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+        verdicts = [
+            json.loads(found[key]) if key in found else None for key in keys
+        ]
+        n_hits = sum(v is not None for v in verdicts)
+        self.hits += n_hits
+        self.misses += len(verdicts) - n_hits
+        return verdicts
+
+    def put(self, key: str, judge: str, verdict: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                (key, judge, json.dumps(verdict), time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+def _verdict(result: EvaluationResult) -> Dict[str, Any]:
+    return {
+        "score": result.score,
+        "passing": result.passing,
+        "feedback": result.feedback,
+    }
+
+
+async def aevaluate_with_judges(
+    df: pd.DataFrame,
+    judges: Dict[str, BaseEvaluator],
+    max_concurrency: int = 8,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    cache_path: Optional[str] = None,
+    value: str = "score",
+) -> pd.DataFrame:
+    """Verdicts of every judge on every row of an eval table, as
+    df.apply(evaluators_df, judges=judges, axis=1) returns them.
+
+    All (row, judge) pairs are evaluated concurrently with aevaluate, up to
+    max_concurrency at a time and within the rate limits. Identical pairs are
+    judged once, and verdicts are cached on disk, so evaluating the same rows
+    with the same judges again makes no LLM call. A pair whose judge fails is
+    reported and left empty.
+
+    Args:
+        df (pd.DataFrame): Eval table with "query", "response", "contexts"
+            and "reference" columns, e.g. from RAGBuildingBlocks.gen_eval_data.
+        judges (Dict[str, BaseEvaluator]): Judges by column name.
+        max_concurrency (int, optional): Judge calls in flight. Defaults to 8.
+        requests_per_minute (Optional[float], optional): Rate limit of judge
+            calls. Defaults to None.
+        tokens_per_minute (Optional[float], optional): Rate limit of the
+            tokens sent to the judges. Defaults to None.
+        cache_path (Optional[str], optional): SQLite file of the verdicts.
+            Defaults to PERSIST_DIR/judge_cache.sqlite.
+        value (str, optional): Field of the verdicts returned, "score",
+            "passing" or "feedback". Defaults to "score".
+
+    Returns:
+        pd.DataFrame: One column per judge, with the index of df. Cache
+            statistics are stored in attrs["cache"].
+    """
+    cache = VerdictCache(
+        cache_path
+        or os.path.join(os.environ["PERSIST_DIR"], "judge_cache.sqlite")
+    )
+    namespaces = {
+        name: judge_namespace(judge) for name, judge in judges.items()
+    }
+    # itertuples turns missing references into NaN
+    rows = [
+        row._replace(reference=None) if _is_missing(row.reference) else row
+        for row in df[
+            ["query", "response", "contexts", "reference"]
+        ].itertuples()
+    ]
+    pairs = [(row, name) for row in rows for name in judges]
+    keys = [
+        _verdict_key(
+            namespaces[name],
+            row.query,
+            row.response,
+            row.contexts,
+            row.reference,
+        )
+        for row, name in pairs
+    ]
+    verdicts = cache.get_batch(keys)
+    # Pairs sharing a key, e.g. repeated questions of a load test, are
+    # judged once
+    misses = {}
+    for i, verdict in enumerate(verdicts):
+        if verdict is None:
+            misses.setdefault(keys[i], []).append(i)
+    to_judge = [positions[0] for positions in misses.values()]
+
+    async def judge_pair(i: int) -> Optional[Dict[str, Any]]:
+        row, name = pairs[i]
+        try:
+            result = await judges[name].aevaluate(
+                query=row.query,
+                response=row.response,
+                contexts=row.contexts,
+                reference=row.reference,
+            )
+        except Exception as e:
+            print(f"Judge {name} failed on row {row.Index}: {e!r}")
+            return None
+        verdict = _verdict(result)
+        cache.put(keys[i], namespaces[name], verdict)
+        return verdict
+
+    def count_tokens(i: int) -> int:
+        row, _ = pairs[i]
+        text = " ".join(
+            [
+                str(row.query),
+                str(row.response),
+                *map(str, row.contexts),
+                row.reference or "",
+            ]
+        )
+        return len(Settings.tokenizer(text))
+
+    new_verdicts, _ = await amap_bounded(
+        judge_pair,
+        to_judge,
+        max_concurrency=max_concurrency,
+        rate_limiter=AsyncRateLimiter(requests_per_minute, tokens_per_minute),
+        count_tokens=count_tokens if tokens_per_minute is not None else None,
+        desc="Judging",
+    )
+    for i, verdict in zip(to_judge, new_verdicts):
+        for position in misses[keys[i]]:
+            verdicts[position] = verdict
+
+    # Pairs are ordered by row, then by judge
+    results = pd.DataFrame(
+        [
+            [
+                None if verdict is None else verdict[value]
+                for verdict in verdicts[i : i + len(judges)]
+            ]
+            for i in range(0, len(pairs), len(judges))
+        ],
+        index=df.index,
+        columns=list(judges),
+    )
+    results.attrs["cache"] = cache.stats()
+    n_missing = sum(len(positions) for positions in misses.values())
+    print(
+        f"{len(pairs) - n_missing} cached verdicts, "
+        f"{len(to_judge)} judge calls"
+    )
+    return results
+
+
+def evaluate_with_judges(
+    df: pd.DataFrame, judges: Dict[str, BaseEvaluator], **kwargs: Any
+) -> pd.DataFrame:
+    """Synchronous aevaluate_with_judges."""
+    return asyncio.run(aevaluate_with_judges(df, judges, **kwargs))
@@ -0,0 +1,149 @@
+from itertools import chain
+from typing import List, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+
+DEFAULT_KS = [1, 3, 5, 10]
+
+IdLists = Sequence[Union[str, Sequence[str]]]
+
+
+def _flatten(id_lists: IdLists) -> Tuple[List[str], np.ndarray]:
+    """Ids of all rows one after the other, and the number of ids of every
+    row. A column of single ids stands for lists of one id."""
+    id_lists = list(id_lists)
+    if all(isinstance(ids, str) for ids in id_lists):
+        return id_lists, np.ones(len(id_lists), dtype=np.int64)
+    id_lists = [
+        [] if ids is None else [ids] if isinstance(ids, str) else ids
+        for ids in id_lists
+    ]
+    lengths = np.fromiter(map(len, id_lists), dtype=np.int64)
+    return list(chain.from_iterable(id_lists)), lengths
+
+
+def _pad(codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Rows of codes of the given lengths, padded with -1."""
+    width = max(lengths.max(initial=0), 1)
+    if len(codes) == len(lengths) * width:
+        # Every row is full, e.g. top_k ids retrieved for every query
+        return codes.reshape(len(lengths), width)
+    matrix = np.full((len(lengths), width), -1, dtype=codes.dtype)
+    matrix[np.arange(width) < lengths[:, None]] = codes
+    return matrix
+
+
+def id_matrices(
+    retrieved: IdLists, relevant: IdLists
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer code matrices of retrieved and relevant ids, padded with -1.
+
+    Both columns share the same codes, so a retrieved id is relevant when its
+    code is in the relevant row.
+
+    Args:
+        retrieved (IdLists): Retrieved ids of every query, best first, e.g.
+            the contexts_ids or retrieved column of an eval table.
+        relevant (IdLists): Relevant ids of every query, or a single id per
+            query, e.g. the reference_id column.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (n_queries, max retrieved) and
+            (n_queries, max relevant) matrices.
+    """
+    retrieved_ids, retrieved_lengths = _flatten(retrieved)
+    relevant_ids, relevant_lengths = _flatten(relevant)
+    if len(retrieved_lengths) != len(relevant_lengths):
+        raise ValueError("retrieved and relevant must have the same length")
+    codes, _ = pd.factorize(
+        np.array(retrieved_ids + relevant_ids, dtype=object)
+    )
+    codes = codes.astype(np.int32)
+    return (
+        _pad(codes[: len(retrieved_ids)], retrieved_lengths),
+        _pad(codes[len(retrieved_ids) :], relevant_lengths),
+    )
+
+
+def relevance_matrix(
+    retrieved_codes: np.ndarray, relevant_codes: np.ndarray
+) -> np.ndarray:
+    """Whether every retrieved id is relevant, from id_matrices. An id
+    retrieved several times for a query is only relevant at its first rank.
+    """
+    relevance = np.zeros(retrieved_codes.shape, dtype=bool)
+    for column in relevant_codes.T:
+        relevance |= (retrieved_codes == column[:, None]) & (
+            column[:, None] >= 0
+        )
+    if relevance.shape[1] > 1:
+        # Stable sorting puts the first rank of an id before its repeats
+        order = np.argsort(retrieved_codes, axis=1, kind="stable")
+        codes = np.take_along_axis(retrieved_codes, order, axis=1)
+        repeated = np.zeros(relevance.shape, dtype=bool)
+        np.put_along_axis(
+            repeated, order[:, 1:], codes[:, 1:] == codes[:, :-1], axis=1
+        )
+        relevance &= ~repeated
+    return relevance
+
+
+def retrieval_metrics(
+    retrieved: Union[IdLists, np.ndarray],
+    relevant: Union[IdLists, np.ndarray],
+    ks: List[int] = DEFAULT_KS,
+) -> pd.DataFrame:
+    """Hit rate, MRR, recall, precision and nDCG at every k of every query.
+
+    Ids are turned into padded code matrices once (see id_matrices), then all
+    metrics of all queries come from cumulative sums of the relevance matrix,
+    without a Python loop over queries. Queries may have several relevant
+    ids, with binary relevance for nDCG.
+
+    Args:
+        retrieved (Union[IdLists, np.ndarray]): Retrieved ids of every query,
+            best first, or the retrieved codes of id_matrices.
+        relevant (Union[IdLists, np.ndarray]): Relevant ids of every query,
+            or the relevant codes of id_matrices.
+        ks (List[int], optional): Cutoffs. Defaults to [1, 3, 5, 10].
+
+    Returns:
+        pd.DataFrame: One row per query with "mrr" over all retrieved ids and
+            "hit@k" (1.0 or 0.0), "recall@k", "precision@k" and "ndcg@k"
+            for every k.
+    """
+    if isinstance(retrieved, np.ndarray) and isinstance(relevant, np.ndarray):
+        retrieved_codes, relevant_codes = retrieved, relevant
+    else:
+        retrieved_codes, relevant_codes = id_matrices(retrieved, relevant)
+    # Ranks by queries, so cumulative sums run over contiguous rows
+    relevance = np.ascontiguousarray(
+        relevance_matrix(retrieved_codes, relevant_codes).T
+    )
+    n_relevant = (relevant_codes >= 0).sum(axis=1)
+    depth, n_queries = relevance.shape
+
+    columns = ["mrr"] + [
+        f"{metric}@{k}"
+        for k in ks
+        for metric in ["hit", "recall", "precision", "ndcg"]
+    ]
+    # Metrics by queries, so the frame wraps its transpose as a single block
+    values = np.zeros((len(columns), n_queries))
+    first = relevance.argmax(axis=0)
+    np.divide(1, first + 1, out=values[0], where=relevance.any(axis=0))
+    hits = np.cumsum(relevance, axis=0, dtype=np.float64)
+    n_discounts = max(depth, n_relevant.max(initial=0))
+    discounts = 1 / np.log2(np.arange(2, n_discounts + 2))
+    dcg = np.cumsum(relevance * discounts[:depth, None], axis=0)
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+
+    ks = np.array(ks, dtype=np.int64)[:, None]
+    cutoffs = np.minimum(ks[:, 0], depth) - 1
+    hits_k = hits[cutoffs]
+    ideal_k = ideal[np.minimum(n_relevant, ks)]
+    values[1::4] = hits_k > 0
+    np.divide(hits_k, n_relevant, out=values[2::4], where=n_relevant > 0)
+    values[3::4] = hits_k / ks
+    np.divide(dcg[cutoffs], ideal_k, out=values[4::4], where=ideal_k > 0)
+    return pd.DataFrame(values.T, columns=columns, copy=False)
@@ -4,16 +4,97 @@ from llama_index.core import (
     VectorStoreIndex,
     StorageContext,
     load_index_from_storage,
+    Settings,
 )
 from llama_index.core.indices.vector_store.base import VectorStoreIndex
-from typing import Optional, Dict
+from llama_index.core.ingestion import run_transformations
+from typing import Any, Dict, List, Optional
 from llama_index.core.readers.base import BaseReader
+from bubls.utils.embeddings.cache import with_embedding_cache
+from bubls.utils.indexing.embedding import embed_nodes_parallel
+from bubls.utils.indexing.streaming import stream_into_index
+from bubls.utils.vector_stores import load_vector_store, make_vector_store
+from bubls.utils.vector_stores.numpy_store import NumpyVectorStore
+from bubls.utils.vector_stores.snapshot import SnapshotVectorStore
+
+
+def load_index(persist_dir: str, embed_model: Any = None) -> VectorStoreIndex:
+    """Load the index persisted in persist_dir, with its vector store.
+
+    Indexes whose vector store keeps the nodes, e.g. a SnapshotVectorStore,
+    are served from the vector store without parsing the JSON docstore and
+    index store.
+
+    Args:
+        persist_dir (str): Where the index is persisted.
+        embed_model (Any, optional): Embedding model of the index.
+            Defaults to None (Settings.embed_model).
+    """
+    vector_store = load_vector_store(persist_dir)
+    if vector_store is not None and vector_store.stores_text:
+        return VectorStoreIndex.from_vector_store(
+            vector_store, embed_model=embed_model
+        )
+    storage_context = StorageContext.from_defaults(
+        persist_dir=persist_dir, vector_store=vector_store
+    )
+    return load_index_from_storage(storage_context, embed_model=embed_model)
+
+
+def indexed_node_ids(index: VectorStoreIndex) -> List[str]:
+    """Ids of the nodes of index, without reading the nodes."""
+    vector_store = index.vector_store
+    if vector_store.stores_text and isinstance(vector_store, NumpyVectorStore):
+        return [str(i) for i in vector_store.ids[vector_store.alive]]
+    return list(index.index_struct.nodes_dict.values())
+
+
+def indexed_nodes(index: VectorStoreIndex) -> List:
+    """Nodes of index, from its docstore or from a vector store keeping them."""
+    if index.vector_store.stores_text:
+        return index.vector_store.get_nodes()
+    return index.docstore.get_nodes(
+        list(index.index_struct.nodes_dict.values())
+    )
+
+
+def embedded_nodes(index: VectorStoreIndex) -> List:
+    """Copies of the nodes of index with the embeddings of its vector store."""
+    copies = []
+    for node in indexed_nodes(index):
+        node = node.copy()
+        node.embedding = index.vector_store.get(node.node_id)
+        copies.append(node)
+    return copies
+
+
+def snapshot_index(
+    index: VectorStoreIndex, persist_dir: str
+) -> VectorStoreIndex:
+    """Persist the nodes and embeddings of index in persist_dir as a
+    SnapshotVectorStore, without embedding them again.
+
+    Returns:
+        VectorStoreIndex: Index served from the snapshot.
+    """
+    vector_store = SnapshotVectorStore()
+    vector_store.add(embedded_nodes(index))
+    snapshot = VectorStoreIndex.from_vector_store(
+        vector_store, embed_model=index._embed_model
+    )
+    snapshot.storage_context.persist(persist_dir=persist_dir)
+    return snapshot
 
 
 def create_index_from_path(
     persist_dir: str,
     data_dir: Optional[str] = None,
     file_extractor: Optional[Dict[str, BaseReader]] = None,
+    embed_num_workers: Optional[int] = None,
+    embed_batch_size: int = 100,
+    streaming: bool = False,
+    stream_batch_size: int = 256,
+    vector_store: Optional[str] = None,
 ) -> VectorStoreIndex:
     """Create an index with the provided parameters.
 
@@ -25,6 +106,20 @@ def create_index_from_path(
         file_extractor (Optional[Dict[str, BaseReader]], optional): A mapping of file
             extension to a BaseReader class that specifies how to convert that file
             to text. If not specified, use default from DEFAULT_FILE_READER_CLS
+        embed_num_workers (Optional[int], optional): When set, nodes are embedded
+            in batches across this many workers before building the index.
+            Defaults to None (embedding done by VectorStoreIndex).
+        embed_batch_size (int, optional): Nodes per embedding request when
+            embed_num_workers is set. Defaults to 100.
+        streaming (bool, optional): Read, chunk, embed and insert files in
+            micro-batches instead of loading every document first.
+            Defaults to False.
+        stream_batch_size (int, optional): Nodes per micro-batch when streaming.
+            Defaults to 256.
+        vector_store (Optional[str], optional): Vector store of a new index,
+            e.g. "numpy" for a memory-mapped NumpyVectorStore or "snapshot" to
+            also keep the nodes in it for a fast cold start. Defaults to None
+            (SimpleVectorStore). Existing indexes are loaded with their store.
 
     Returns:
         VectorStoreIndex: Index created from the provided directoryand file_extractor.
@@ -35,17 +130,49 @@ def create_index_from_path(
             raise ValueError(
                 "If creating a new index data_dir must be provided."
             )
-        # load the documents and create the index
-        documents = SimpleDirectoryReader(
-            data_dir, file_extractor=file_extractor
-        ).load_data()
-        index = VectorStoreIndex.from_documents(documents)
+        embed_model = with_embedding_cache(Settings.embed_model)
+        reader = SimpleDirectoryReader(data_dir, file_extractor=file_extractor)
+        storage_context = StorageContext.from_defaults(
+            vector_store=make_vector_store(vector_store)
+        )
+        if streaming:
+            index = VectorStoreIndex(
+                [], embed_model=embed_model, storage_context=storage_context
+            )
+            stream_into_index(
+                reader,
+                index,
+                batch_size=stream_batch_size,
+                embed_num_workers=embed_num_workers,
+                embed_batch_size=embed_batch_size,
+            )
+        elif embed_num_workers:
+            nodes = run_transformations(
+                reader.load_data(), Settings.transformations
+            )
+            embed_nodes_parallel(
+                nodes,
+                embed_model,
+                batch_size=embed_batch_size,
+                num_workers=embed_num_workers,
+            )
+            index = VectorStoreIndex(
+                nodes, embed_model=embed_model, storage_context=storage_context
+            )
+        else:
+            # load the documents and create the index
+            index = VectorStoreIndex.from_documents(
+                reader.load_data(),
+                embed_model=embed_model,
+                storage_context=storage_context,
+            )
         # store it for later
         index.storage_context.persist(persist_dir=persist_dir)
     else:
         print("Loading Index")
         # load the existing index
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-        index = load_index_from_storage(storage_context)
+        index = load_index(
+            persist_dir, embed_model=with_embedding_cache(Settings.embed_model)
+        )
 
     return index
@@ -0,0 +1,83 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode
+from bubls.utils.timing import (
+    format_latency_histogram,
+    format_latency_summary,
+    latency_histogram,
+    latency_summary,
+)
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence
+import time
+
+
+def embed_nodes_parallel(
+    nodes: Sequence[BaseNode],
+    embed_model: BaseEmbedding,
+    batch_size: int = 100,
+    num_workers: int = 4,
+    max_pending: Optional[int] = None,
+    verbose: bool = True,
+) -> Dict[str, Any]:
+    """Embed nodes in batches across a pool of workers, setting node.embedding
+    in place. Nodes that already have an embedding are skipped, so the result
+    can be passed to VectorStoreIndex without embedding anything again.
+
+    Args:
+        nodes (Sequence[BaseNode]): Nodes to embed.
+        embed_model (BaseEmbedding): Model used to embed the nodes.
+        batch_size (int, optional): Nodes per embedding request. Defaults to 100.
+        num_workers (int, optional): Requests in flight. Defaults to 4.
+        max_pending (Optional[int], optional): Batches submitted but not finished
+            before new ones have to wait, which bounds memory when the model is
+            slower than batching. Defaults to 2 * num_workers.
+        verbose (bool, optional): Print throughput and the batch latency
+            histogram. Defaults to True.
+
+    Returns:
+        Dict[str, Any]: nodes, seconds, nodes_per_second, batch latency summary
+            and histogram.
+    """
+    max_pending = max_pending or 2 * num_workers
+    to_embed = [node for node in nodes if node.embedding is None]
+    batches = [
+        to_embed[i : i + batch_size]
+        for i in range(0, len(to_embed), batch_size)
+    ]
+    batch_latencies = []
+
+    def embed_batch(batch: List[BaseNode]) -> float:
+        start = time.perf_counter()
+        embeddings = embed_model.get_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+        )
+        for node, embedding in zip(batch, embeddings):
+            node.embedding = embedding
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = set()
+        for batch in batches:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                batch_latencies.extend(future.result() for future in done)
+            pending.add(pool.submit(embed_batch, batch))
+        batch_latencies.extend(future.result() for future in pending)
+    elapsed = time.perf_counter() - start
+
+    stats = {
+        "nodes": len(to_embed),
+        "seconds": elapsed,
+        "nodes_per_second": len(to_embed) / elapsed if elapsed else 0.0,
+        "batch_latency": latency_summary(batch_latencies),
+        "batch_latency_histogram": latency_histogram(batch_latencies),
+    }
+    if verbose:
+        print(
+            f"Embedded {stats['nodes']} nodes in {len(batches)} batches, "
+            f"{stats['nodes_per_second']:.1f} nodes/s\n"
+            f"Batch latency: {format_latency_summary(stats['batch_latency'])}\n"
+            + format_latency_histogram(stats["batch_latency_histogram"])
+        )
+    return stats
@@ -0,0 +1,214 @@
+from llama_index.core.ingestion import IngestionCache, run_transformations
+from llama_index.core.ingestion.pipeline import remove_unstable_values
+from llama_index.core.schema import (
+    BaseNode,
+    Document,
+    MetadataMode,
+    NodeRelationship,
+    TransformComponent,
+)
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from hashlib import sha256
+import json
+import os
+
+
+# Metadata SimpleDirectoryReader reads from the file system, which changes
+# when files are moved or read again while their content doesn't
+_FILE_METADATA_KEYS = [
+    "file_path",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+]
+
+# Transformations of the worker process, sent once when the worker starts
+_worker_transformations: List[TransformComponent] = []
+
+
+def _init_worker(transformations: List[TransformComponent]):
+    global _worker_transformations
+    _worker_transformations = transformations
+
+
+def _run_remaining(
+    nodes: List[BaseNode],
+    start: int,
+    transformations: Optional[List[TransformComponent]] = None,
+) -> List[List[BaseNode]]:
+    """Output of every transformation from start on, each one applied to the
+    output of the previous one."""
+    transformations = transformations or _worker_transformations
+    outputs = []
+    for transformation in transformations[start:]:
+        nodes = run_transformations(nodes, [transformation])
+        outputs.append(nodes)
+    return outputs
+
+
+class CachedIngestionPipeline:
+    """Ingestion pipeline caching the output of every transformation for every
+    document, so reruns only compute what changed.
+
+    The cache key of a document after transformation i hashes the document
+    text, its metadata except the file system ones of readers, and
+    transformations 0..i, so moved or reread files hit the cache. Adding a
+    transformation at the end of the list only runs that transformation, and
+    a new document only runs the whole chain for that document. Documents
+    that still need work can be processed across several processes.
+
+    Args:
+        transformations (List[TransformComponent]): Transformations to apply.
+        cache_dir (Optional[str], optional): Where the cache is persisted.
+            Defaults to None (in-memory cache only).
+        num_workers (Optional[int], optional): Processes used for documents
+            that aren't fully cached; transformations must be picklable.
+            Defaults to None (run in this process).
+        deduplicate (bool, optional): Skip documents whose hash was already
+            ingested by this pipeline, e.g. the same document in two splits.
+            Defaults to True.
+    """
+
+    cache_file_name = "cache.json"
+
+    def __init__(
+        self,
+        transformations: List[TransformComponent],
+        cache_dir: Optional[str] = None,
+        num_workers: Optional[int] = None,
+        deduplicate: bool = True,
+    ):
+        self.transformations = transformations
+        self.cache_dir = cache_dir
+        self.num_workers = num_workers
+        self.deduplicate = deduplicate
+        self.docstore = SimpleDocumentStore()
+        self.hits = 0
+        self.misses = 0
+
+        cache_path = self._cache_path()
+        if cache_path and os.path.exists(cache_path):
+            self.cache = IngestionCache.from_persist_path(cache_path)
+        else:
+            self.cache = IngestionCache()
+
+        self._transformation_hashes = [
+            sha256(
+                remove_unstable_values(str(t.to_dict())).encode("utf-8")
+            ).hexdigest()
+            for t in transformations
+        ]
+
+    def _cache_path(self) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, self.cache_file_name)
+
+    def _keys(self, document: Document) -> List[str]:
+        metadata = {
+            k: v
+            for k, v in document.metadata.items()
+            if k not in _FILE_METADATA_KEYS
+        }
+        text = document.get_content(metadata_mode=MetadataMode.NONE)
+        key = sha256(
+            json.dumps([text, metadata], sort_keys=True, default=str).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+        keys = []
+        for transformation_hash in self._transformation_hashes:
+            key = sha256((key + transformation_hash).encode("utf-8")).hexdigest()
+            keys.append(key)
+        return keys
+
+    def _cached_prefix(
+        self, keys: List[str]
+    ) -> Tuple[int, Optional[List[BaseNode]]]:
+        """Number of transformations already cached and their output."""
+        for i in range(len(keys), 0, -1):
+            nodes = self.cache.get(keys[i - 1])
+            if nodes is not None:
+                return i, nodes
+        return 0, None
+
+    def _new_documents(self, documents: List[Document]) -> List[Document]:
+        if not self.deduplicate:
+            return documents
+        existing_hashes = set(self.docstore.get_all_document_hashes())
+        new_documents = []
+        for document in documents:
+            if document.hash in existing_hashes:
+                continue
+            existing_hashes.add(document.hash)
+            self.docstore.set_document_hash(document.id_, document.hash)
+            new_documents.append(document)
+        return new_documents
+
+    def run(self, documents: List[Document]) -> List[BaseNode]:
+        """Transform documents into nodes, using cached steps when possible.
+
+        Returns:
+            List[BaseNode]: Nodes in the same document order.
+        """
+        documents = self._new_documents(documents)
+
+        outputs, pending = {}, []
+        for d, document in enumerate(documents):
+            keys = self._keys(document)
+            n_cached, nodes = self._cached_prefix(keys)
+            self.hits += n_cached
+            self.misses += len(keys) - n_cached
+            if n_cached == len(keys):
+                outputs[d] = nodes if keys else [document]
+            else:
+                pending.append((d, keys, n_cached, nodes or [document]))
+
+        if self.num_workers and len(pending) > 1:
+            with ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_init_worker,
+                initargs=(self.transformations,),
+            ) as pool:
+                results = list(
+                    pool.map(
+                        _run_remaining,
+                        [nodes for _, _, _, nodes in pending],
+                        [n_cached for _, _, n_cached, _ in pending],
+                    )
+                )
+        else:
+            results = [
+                _run_remaining(nodes, n_cached, self.transformations)
+                for _, _, n_cached, nodes in pending
+            ]
+
+        for (d, keys, n_cached, _), step_outputs in zip(pending, results):
+            for key, nodes in zip(keys[n_cached:], step_outputs):
+                self.cache.put(key, nodes)
+            outputs[d] = step_outputs[-1] if step_outputs else []
+
+        all_nodes = []
+        for d, document in enumerate(documents):
+            for node in outputs[d]:
+                # Cached nodes point to the document id of a previous load
+                source = node.relationships.get(NodeRelationship.SOURCE)
+                if source is not None and source.node_id != document.id_:
+                    node.relationships[
+                        NodeRelationship.SOURCE
+                    ] = document.as_related_node_info()
+                    # and to its file metadata, left out of the cache key
+                    for k in _FILE_METADATA_KEYS:
+                        if k in node.metadata and k in document.metadata:
+                            node.metadata[k] = document.metadata[k]
+                all_nodes.append(node)
+        return all_nodes
+
+    def persist(self):
+        cache_path = self._cache_path()
+        if cache_path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.cache.persist(cache_path)
@@ -0,0 +1,102 @@
+from llama_index.core import SimpleDirectoryReader, Settings
+from llama_index.core.indices.vector_store.base import VectorStoreIndex
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, TransformComponent
+from bubls.utils.indexing.embedding import embed_nodes_parallel
+from typing import Any, Dict, Generator, List, Optional
+import time
+
+
+def iter_node_batches(
+    reader: SimpleDirectoryReader,
+    transformations: Optional[List[TransformComponent]] = None,
+    batch_size: int = 256,
+    show_progress: bool = False,
+) -> Generator[List[BaseNode], None, None]:
+    """Read files one at a time and yield their nodes in micro-batches.
+
+    Only the documents of the file being read and less than two batches of
+    nodes are held in memory at any time, whatever the size of the directory.
+
+    Args:
+        reader (SimpleDirectoryReader): Reader over the files to ingest.
+        transformations (Optional[List[TransformComponent]], optional):
+            Transformations turning documents into nodes. Defaults to
+            Settings.transformations.
+        batch_size (int, optional): Nodes per batch. Defaults to 256.
+        show_progress (bool, optional): Show file progress. Defaults to False.
+
+    Yields:
+        List[BaseNode]: Batches of at most batch_size nodes.
+    """
+    transformations = transformations or Settings.transformations
+    buffer = []
+    for documents in reader.iter_data(show_progress=show_progress):
+        buffer.extend(run_transformations(documents, transformations))
+        while len(buffer) >= batch_size:
+            yield buffer[:batch_size]
+            buffer = buffer[batch_size:]
+    if buffer:
+        yield buffer
+
+
+def stream_into_index(
+    reader: SimpleDirectoryReader,
+    index: VectorStoreIndex,
+    transformations: Optional[List[TransformComponent]] = None,
+    batch_size: int = 256,
+    embed_num_workers: Optional[int] = None,
+    embed_batch_size: int = 100,
+    show_progress: bool = False,
+) -> Dict[str, Any]:
+    """Chunk, embed and insert the files of reader into index as they are read.
+
+    Index entries become available after the first micro-batch instead of
+    after loading the whole corpus. Memory used by ingestion is constant in
+    the corpus size; the index itself grows unless its vector store and
+    docstore live outside the process (e.g. Chroma).
+
+    Args:
+        reader (SimpleDirectoryReader): Reader over the files to ingest.
+        index (VectorStoreIndex): Index the nodes are inserted into.
+        transformations (Optional[List[TransformComponent]], optional):
+            Transformations turning documents into nodes. Defaults to
+            Settings.transformations.
+        batch_size (int, optional): Nodes per insert. Defaults to 256.
+        embed_num_workers (Optional[int], optional): When set, every micro-batch
+            is embedded across this many workers. Defaults to None.
+        embed_batch_size (int, optional): Nodes per embedding request when
+            embed_num_workers is set. Defaults to 100.
+        show_progress (bool, optional): Show file progress. Defaults to False.
+
+    Returns:
+        Dict[str, Any]: Number of batches and nodes, seconds and nodes/s.
+    """
+    n_batches, n_nodes = 0, 0
+    start = time.perf_counter()
+    for batch in iter_node_batches(
+        reader, transformations, batch_size, show_progress
+    ):
+        if embed_num_workers:
+            embed_nodes_parallel(
+                batch,
+                index._embed_model,
+                batch_size=embed_batch_size,
+                num_workers=embed_num_workers,
+                verbose=False,
+            )
+        index.insert_nodes(batch)
+        n_batches += 1
+        n_nodes += len(batch)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Ingested {n_nodes} nodes in {n_batches} batches, "
+        f"{n_nodes / elapsed if elapsed else 0.0:.1f} nodes/s"
+    )
+    return {
+        "batches": n_batches,
+        "nodes": n_nodes,
+        "seconds": elapsed,
+        "nodes_per_second": n_nodes / elapsed if elapsed else 0.0,
+    }
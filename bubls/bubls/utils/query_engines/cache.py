@@ -0,0 +1,231 @@
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import (
+    RESPONSE_TYPE,
+    AsyncStreamingResponse,
+    StreamingResponse,
+)
+from llama_index.core.schema import QueryBundle
+from llama_index.core import Settings, VectorStoreIndex
+from bubls.utils.embeddings.cache import with_embedding_cache
+from bubls.utils.vector_stores.numpy_store import (
+    NumpyVectorStore,
+    normalize_rows,
+)
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import re
+import threading
+import time
+
+
+def normalize_query(query: str) -> str:
+    """Lower case words of query, so case, punctuation and spacing don't
+    change the cache key."""
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def index_fingerprint(index: VectorStoreIndex) -> Tuple:
+    """Cheap value that changes when nodes are inserted in or deleted from
+    index, used to drop cached responses computed on older content."""
+    nodes_dict = index.index_struct.nodes_dict
+    fingerprint = (len(nodes_dict), next(reversed(nodes_dict), None))
+    vector_store = index.vector_store
+    if isinstance(vector_store, NumpyVectorStore):
+        ids = vector_store.ids
+        fingerprint += (
+            len(ids),
+            str(ids[-1]) if len(ids) else None,
+            int(vector_store.alive.sum()),
+        )
+    return fingerprint
+
+
+class CachedQueryEngine(BaseQueryEngine):
+    """Query engine answering repeated questions from a cache before calling
+    the wrapped query engine.
+
+    A query is first looked up by its normalized text, then, when
+    similarity_threshold is set, by the cosine similarity of its embedding to
+    the embeddings of the cached queries. Entries expire after ttl seconds,
+    the least recently used ones are evicted beyond max_entries, and the whole
+    cache is dropped when the fingerprint of index changes. Streaming
+    responses can only be read once, so they are never cached.
+
+    Args:
+        query_engine (BaseQueryEngine): Query engine to wrap.
+        index (Optional[VectorStoreIndex], optional): Index the engine queries,
+            watched for changes. Defaults to None (call invalidate instead).
+        embed_model (Any, optional): Model embedding the queries for semantic
+            matches. Defaults to the embed model of index, or
+            Settings.embed_model.
+        similarity_threshold (Optional[float], optional): Minimum similarity of
+            a semantic match, None for exact matches only. Keep it close to 1,
+            questions differing only in a year or a name can be very similar.
+            Defaults to None.
+        ttl (Optional[float], optional): Seconds an entry stays valid, None
+            for no expiry. Defaults to 3600.
+        max_entries (int, optional): Size cap. Defaults to 1000.
+    """
+
+    def __init__(
+        self,
+        query_engine: BaseQueryEngine,
+        index: Optional[VectorStoreIndex] = None,
+        embed_model: Any = None,
+        similarity_threshold: Optional[float] = None,
+        ttl: Optional[float] = 3600,
+        max_entries: int = 1000,
+    ):
+        super().__init__(callback_manager=query_engine.callback_manager)
+        self.query_engine = query_engine
+        self.index = index
+        if embed_model is None:
+            embed_model = (
+                Settings.embed_model if index is None else index._embed_model
+            )
+        self.embed_model = with_embedding_cache(embed_model)
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # key -> (response, creation time, normalized query embedding)
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._fingerprint = self._index_fingerprint()
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    @property
+    def retriever(self):
+        return self.query_engine.retriever
+
+    def _get_prompt_modules(self) -> Dict[str, Any]:
+        return {}
+
+    def _index_fingerprint(self) -> Optional[Tuple]:
+        return None if self.index is None else index_fingerprint(self.index)
+
+    def invalidate(self):
+        """Drop every cached response."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        requests = (
+            self._stats["exact_hits"]
+            + self._stats["semantic_hits"]
+            + self._stats["misses"]
+        )
+        hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "hit_rate": hits / requests if requests else 0.0,
+        }
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _check_index(self):
+        fingerprint = self._index_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.invalidate()
+
+    def _semantic_match(self, embedding: np.ndarray) -> Optional[str]:
+        """Key of the most similar cached query above the threshold."""
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries)
+            self._matrix = (
+                np.stack([self._entries[k][2] for k in self._matrix_keys])
+                if self._entries
+                else None
+            )
+        if self._matrix is None:
+            return None
+        similarities = self._matrix @ embedding
+        best = int(similarities.argmax())
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return self._matrix_keys[best]
+
+    def _lookup(
+        self, key: str, embedding: Optional[np.ndarray]
+    ) -> Optional[RESPONSE_TYPE]:
+        with self._lock:
+            kind = "exact_hits"
+            if key not in self._entries and embedding is not None:
+                key, kind = self._semantic_match(embedding), "semantic_hits"
+            if key is None or key not in self._entries:
+                self._stats["misses"] += 1
+                return None
+            response, created, _ = self._entries[key]
+            if self._expired(created):
+                del self._entries[key]
+                self._matrix = None
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats[kind] += 1
+            return response
+
+    def _store(
+        self,
+        key: str,
+        response: RESPONSE_TYPE,
+        embedding: Optional[np.ndarray],
+    ):
+        if isinstance(response, (StreamingResponse, AsyncStreamingResponse)):
+            return
+        with self._lock:
+            if embedding is None:
+                embedding = np.zeros(0, dtype=np.float32)
+            self._entries[key] = (response, time.time(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._matrix = None
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        self._check_index()
+        key = normalize_query(query_bundle.query_str)
+        embedding = None
+        if self.similarity_threshold is not None:
+            # Not set on query_bundle, the retriever may use another model
+            embedding = normalize_rows(
+                self.embed_model.get_query_embedding(query_bundle.query_str)
+            )
+        response = self._lookup(key, embedding)
+        if response is None:
+            response = self.query_engine.query(query_bundle)
+            self._store(key, response, embedding)
+        return response
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        self._check_index()
+        key = normalize_query(query_bundle.query_str)
+        embedding = None
+        if self.similarity_threshold is not None:
+            embedding = normalize_rows(
+                await self.embed_model.aget_query_embedding(
+                    query_bundle.query_str
+                )
+            )
+        response = self._lookup(key, embedding)
+        if response is None:
+            response = await self.query_engine.aquery(query_bundle)
+            self._store(key, response, embedding)
+        return response
@@ -0,0 +1,177 @@
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.response.schema import RESPONSE_TYPE
+from llama_index.core.response_synthesizers import (
+    BaseSynthesizer,
+    get_response_synthesizer,
+)
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.tools import QueryEngineTool
+from bubls.utils.retrieval.hybrid import fuse_weighted_scores
+from typing import Any, Dict, List, Optional, Tuple, Union
+import asyncio
+import nest_asyncio
+import time
+
+nest_asyncio.apply()
+
+FUSIONS = ["rrf", "score"]
+
+
+def fuse_ranked_nodes(
+    results: Dict[str, List[NodeWithScore]],
+    top_k: int,
+    fusion: str = "rrf",
+    rrf_k: int = 60,
+) -> List[NodeWithScore]:
+    """Merge the nodes retrieved by several engines.
+
+    Args:
+        results (Dict[str, List[NodeWithScore]]): Nodes of every engine, best
+            first.
+        top_k (int): Nodes kept.
+        fusion (str, optional): "rrf" for reciprocal rank fusion, which only
+            uses the rank in every engine, or "score" to average the min-max
+            normalized scores of every engine, as engines score on different
+            scales. Defaults to "rrf".
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion.
+            Defaults to 60.
+
+    Returns:
+        List[NodeWithScore]: Best top_k nodes, with the fused scores.
+    """
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSIONS}")
+    nodes, weighted_scores = {}, []
+    for engine_nodes in results.values():
+        scores = {}
+        for node in engine_nodes:
+            nodes.setdefault(node.node.node_id, node.node)
+            scores.setdefault(node.node.node_id, node.score or 0.0)
+        weighted_scores.append((1 / len(results), scores))
+    fused = fuse_weighted_scores(
+        weighted_scores, "rrf" if fusion == "rrf" else "alpha", rrf_k
+    )
+    return [
+        NodeWithScore(node=nodes[node_id], score=score)
+        for node_id, score in list(fused.items())[:top_k]
+    ]
+
+
+class FanOutQueryEngine(BaseQueryEngine):
+    """Query engine retrieving from several component engines at once and
+    answering with a single synthesis over their fused nodes.
+
+    The retrievers of the engines run concurrently, each one with its own
+    timeout, so retrieval takes about as long as the slowest engine. Engines
+    timing out or failing are left out of the answer and reported in the
+    response metadata under "engines".
+
+    Args:
+        query_engine_tools (List[QueryEngineTool]): Tools of the components,
+            e.g. RAGBuildingBlocks.query_engine_tools. Their query engines must
+            expose a retriever, as RetrieverQueryEngine does.
+        tool_names (Optional[List[str]], optional): Names of the tools queried.
+            Defaults to None (every tool).
+        similarity_top_k (int, optional): Fused nodes given to the synthesis.
+            Defaults to 5.
+        fusion (str, optional): "rrf" or "score", see fuse_ranked_nodes.
+            Defaults to "rrf".
+        timeout (Union[float, Dict[str, float]], optional): Seconds allowed to
+            every retriever, or per tool name. Defaults to 30.
+        response_synthesizer (Optional[BaseSynthesizer], optional): Synthesis
+            of the answer. Defaults to get_response_synthesizer().
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion.
+            Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        query_engine_tools: List[QueryEngineTool],
+        tool_names: Optional[List[str]] = None,
+        similarity_top_k: int = 5,
+        fusion: str = "rrf",
+        timeout: Union[float, Dict[str, float]] = 30,
+        response_synthesizer: Optional[BaseSynthesizer] = None,
+        rrf_k: int = 60,
+    ):
+        tools = {tool.metadata.name: tool for tool in query_engine_tools}
+        unknown = set(tool_names or []) - set(tools)
+        if unknown:
+            raise ValueError(f"Unknown query engine tools {sorted(unknown)}")
+        self.retrievers: Dict[str, BaseRetriever] = {
+            name: tool.query_engine.retriever
+            for name, tool in tools.items()
+            if tool_names is None or name in tool_names
+        }
+        self.similarity_top_k = similarity_top_k
+        self.fusion = fusion
+        self.timeout = timeout
+        self.rrf_k = rrf_k
+        self.response_synthesizer = (
+            response_synthesizer or get_response_synthesizer()
+        )
+        super().__init__(
+            callback_manager=self.response_synthesizer.callback_manager
+        )
+
+    def _get_prompt_modules(self) -> Dict[str, Any]:
+        return {"response_synthesizer": self.response_synthesizer}
+
+    def _timeout(self, name: str) -> Optional[float]:
+        if isinstance(self.timeout, dict):
+            return self.timeout.get(name)
+        return self.timeout
+
+    async def _aretrieve_one(
+        self, name: str, query_bundle: QueryBundle
+    ) -> Tuple[List[NodeWithScore], Dict[str, Any]]:
+        start = time.perf_counter()
+        nodes, status = [], "ok"
+        try:
+            nodes = await asyncio.wait_for(
+                self.retrievers[name].aretrieve(
+                    # Engines may use other embedding models
+                    QueryBundle(query_bundle.query_str)
+                ),
+                timeout=self._timeout(name),
+            )
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except Exception as e:
+            print(f"Retrieval failed for {name}: {e!r}")
+            status = "error"
+        return nodes, {
+            "status": status,
+            "seconds": time.perf_counter() - start,
+            "n_nodes": len(nodes),
+        }
+
+    async def aretrieve(
+        self, query_bundle: QueryBundle
+    ) -> Tuple[List[NodeWithScore], Dict[str, Dict[str, Any]]]:
+        """Fused nodes of every engine and the status of every engine."""
+        names = list(self.retrievers)
+        outcomes = await asyncio.gather(
+            *(self._aretrieve_one(name, query_bundle) for name in names)
+        )
+        results = {name: nodes for name, (nodes, _) in zip(names, outcomes)}
+        engines = {name: info for name, (_, info) in zip(names, outcomes)}
+        nodes = fuse_ranked_nodes(
+            results, self.similarity_top_k, self.fusion, self.rrf_k
+        )
+        return nodes, engines
+
+    def retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return asyncio.run(self.aretrieve(query_bundle))[0]
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        nodes, engines = await self.aretrieve(query_bundle)
+        response = await self.response_synthesizer.asynthesize(
+            query_bundle, nodes
+        )
+        response.metadata = {**(response.metadata or {}), "engines": engines}
+        return response
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        return asyncio.run(self._aquery(query_bundle))
@@ -1,9 +1,50 @@
+from bubls.utils.chat_engines.sessions import (
+    CHAT_SYSTEM_CONTENT,
+    ChatSessionManager,
+    TokenCountingMemory,
+)
+from bubls.utils.data.columnar import (
+    LazySplits,
+    load_nodes,
+    load_questions,
+    save_nodes,
+    save_questions,
+)
 from bubls.utils.data.download import download_file_from_url
+from bubls.utils.embeddings.cache import with_embedding_cache
+from bubls.utils.evaluation.evaluate_vector_stores import (
+    benchmark_vector_stores,
+)
+from bubls.utils.evaluation.retrieval_metrics import retrieval_metrics
+from bubls.utils.indexing import load_index
+from bubls.utils.indexing.embedding import embed_nodes_parallel
+from bubls.utils.indexing.pipeline import CachedIngestionPipeline
+from bubls.utils.query_engines.cache import CachedQueryEngine
+from bubls.utils.query_engines.fan_out import FanOutQueryEngine
+from bubls.utils.retrieval.batch import retrieve_batch
+from bubls.utils.retrieval.bm25 import BM25Index
+from bubls.utils.retrieval.hybrid import HybridRetriever
+from bubls.utils.concurrency import AsyncRateLimiter, amap_bounded
+from bubls.utils.timing import format_latency_summary, latency_summary
+from bubls.utils.vector_stores import make_vector_store
+from bubls.utils.vector_stores.metadata_index import make_metadata_filters
+from bubls.utils.rag_design.sweep import (
+    SWEEP_MAX_WORKERS,
+    Grid,
+    apply_overrides,
+    check_overrides,
+    expand_grid,
+    span_relevant_ids,
+)
+from bubls.utils.rag_design.stage_cache import (
+    StageManifest,
+    hash_config,
+    hash_files,
+)
 from llama_index.core import (
     SimpleDirectoryReader,
     VectorStoreIndex,
     StorageContext,
-    load_index_from_storage,
     Settings,
 )
 from llama_index.core.evaluation import (
@@ -13,15 +54,26 @@ from llama_index.core.evaluation import (
 from llama_index.llms.openai import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import MetadataMode
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.finetuning import generate_qa_embedding_pairs
 from llama_index.readers.wikipedia import WikipediaReader
-from typing import Any, Dict
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from collections import Counter
+from typing import Any, Dict, List, Optional
 import pandas as pd
 import pickle
+import asyncio
+import hashlib
+import json
 import random
+import shutil
+import time
 import os
 import nest_asyncio
 from tqdm.notebook import tqdm
@@ -29,13 +81,70 @@ from tqdm.notebook import tqdm
 
 nest_asyncio.apply()
 Settings.llm = OpenAI(temperature=0.2, model="gpt-3.5-turbo")
-Settings.embed_model = OpenAIEmbedding(name="text-embedding-ada-002")
+Settings.embed_model = with_embedding_cache(
+    OpenAIEmbedding(name="text-embedding-ada-002")
+)
+
+
+# gen_index options handled here instead of being passed to VectorStoreIndex
+INDEX_OPTIONS = [
+    "incremental",
+    "embed_batch_size",
+    "embed_num_workers",
+    "vector_store",
+]
+# gen_index options that don't change the index, left out of its stage key
+RUNTIME_INDEX_OPTIONS = ["incremental", "embed_batch_size", "embed_num_workers"]
+
+
+def _index_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in cfg.items() if k not in RUNTIME_INDEX_OPTIONS}
+
+
+def _doc_hash(doc) -> str:
+    """Hash of the text of a document. Unlike doc.hash it doesn't cover the
+    reader metadata, which includes the file path and dates."""
+    return hashlib.sha256(doc.text.encode("utf-8")).hexdigest()
+
+
+def _embed_hash(node) -> str:
+    """Hash of the content node is embedded from. Unlike node.hash it
+    doesn't cover metadata hidden from the embedding, e.g. dates."""
+    content = node.get_content(metadata_mode=MetadataMode.EMBED)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _index_kwargs(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = {k: v for k, v in cfg.items() if k not in INDEX_OPTIONS}
+    if "embed_model" in kwargs:
+        kwargs["embed_model"] = with_embedding_cache(kwargs["embed_model"])
+    if cfg.get("vector_store"):
+        kwargs["storage_context"] = StorageContext.from_defaults(
+            vector_store=make_vector_store(cfg["vector_store"])
+        )
+    return kwargs
+
+
+def _pre_embed_nodes(nodes, cfg: Dict[str, Any]):
+    """Embed copies of nodes in parallel batches when gen_index sets
+    embed_num_workers, otherwise let VectorStoreIndex embed them."""
+    if not cfg.get("embed_num_workers"):
+        return nodes
+    nodes = [node.copy() for node in nodes]
+    embed_nodes_parallel(
+        nodes,
+        with_embedding_cache(cfg.get("embed_model", Settings.embed_model)),
+        batch_size=cfg.get("embed_batch_size", 100),
+        num_workers=cfg["embed_num_workers"],
+    )
+    return nodes
 
 
 class RAGBuildingBlocks:
     def __init__(self, components_cfg: dict):
         self.components_cfg = components_cfg
         self.documents = {}
+        self.split_docs = {}
         self.llm_eval_data = {}
         self.nodes = {}
         self.qa_pairs = {}
@@ -45,27 +154,116 @@ class RAGBuildingBlocks:
         self.chat_engine = {}
         self.query_engine_tools = []
         self.eval_data = {}
+        self.timings = {}
+        self.manifests = {}
+        self.stage_keys = {}
+        self.stale_stages = {}
+
+    def _stage_keys(self, c_id: str) -> Dict[str, str]:
+        """Key of every stage: a hash of its config plus the keys of the stages
+        it consumes. Changing any knob changes the key of that stage and of
+        every stage downstream of it."""
+        component_cfg = self.components_cfg[c_id]
+        keys = {}
+        keys["download"] = hash_config(component_cfg.get("download_data"))
+        load_cfg = component_cfg.get("load_data", {})
+        keys["load"] = hash_config(
+            load_cfg,
+            keys["download"],
+            hash_files(os.path.join(os.environ["DATA_DIR"], c_id))
+            if load_cfg.get("source") == "local"
+            else None,
+        )
+        keys["split"] = hash_config(self._split_cfg(c_id), keys["load"])
+        keys["nodes"] = hash_config(
+            component_cfg.get("gen_nodes", {}), keys["split"]
+        )
+        keys["llm_eval_data"] = hash_config(
+            component_cfg.get("gen_llm_eval_data", {}), keys["nodes"]
+        )
+        keys["qa_pairs"] = hash_config(
+            component_cfg.get("gen_qa_pairs", {}), keys["nodes"]
+        )
+        keys["index"] = hash_config(
+            _index_config(component_cfg.get("gen_index", {})), keys["nodes"]
+        )
+        eval_data_inputs = [
+            component_cfg.get("gen_query_engine", {}),
+            keys["index"],
+            keys["qa_pairs"],
+        ]
+        if "gen_retriever" in component_cfg:
+            # The query engine answers with the retriever of gen_retriever
+            eval_data_inputs.append(component_cfg["gen_retriever"])
+        keys["eval_data"] = hash_config(*eval_data_inputs)
+        return keys
+
+    def _stage_artifacts(self, c_id: str) -> Dict[str, list]:
+        download_cfg = self.components_cfg[c_id].get("download_data") or {}
+        return {
+            "download": [
+                os.path.join(os.environ["DATA_DIR"], c_id, file_name)
+                for file_name in download_cfg.get("file_names", [])
+            ],
+            "load": [],
+            "split": ["split_docs.json"],
+            "nodes": ["nodes"],
+            "llm_eval_data": ["llm_eval_data"],
+            "qa_pairs": ["qa_pairs"],
+            "index": [os.path.join("indexes", "baseline")],
+            "eval_data": ["eval_data"],
+        }
 
     def _ingest_data(self, c_id: str):
         component_cfg = self.components_cfg[c_id]
 
-        # Nodes is the main output, check if exists
-        nodes_data_path = os.path.join(
-            os.environ["PERSIST_DIR"], c_id, "nodes"
-        )
-        if not os.path.exists(nodes_data_path):
-            print(f"Generating data artifacts for {c_id}")
-            self._download_data(c_id, component_cfg.get("download_data"))
+        # Download skips files that already exist, so it is cheap to rerun and
+        # local files are needed to compute the load key.
+        self._download_data(c_id, component_cfg.get("download_data"))
+
+        manifest = StageManifest(os.path.join(os.environ["PERSIST_DIR"], c_id))
+        keys = self._stage_keys(c_id)
+        artifacts = self._stage_artifacts(c_id)
+        if not manifest.exists:
+            # Dirs written before split_docs.json existed can't adopt the
+            # split, so every stage from the split on is regenerated once
+            manifest.adopt(keys, artifacts)
+        stale = manifest.stale_stages(keys)
+        self.manifests[c_id] = manifest
+        self.stage_keys[c_id] = keys
+        self.stale_stages[c_id] = stale
+        print(f"Stale stages for {c_id}: {sorted(stale) or 'none'}")
+
+        manifest.update("download", keys["download"], artifacts["download"])
+        if stale & {"split", "nodes"}:
             self._load_data(c_id, component_cfg.get("load_data"))
+            manifest.update("load", keys["load"])
+            if "split" in stale:
+                self._gen_split_docs(c_id, self._split_cfg(c_id))
+                manifest.update("split", keys["split"], artifacts["split"])
+            else:
+                self._get_split_docs(c_id)
+
+        if "nodes" in stale:
+            self._gen_nodes(c_id, component_cfg.get("gen_nodes", {}))
+            manifest.update("nodes", keys["nodes"], artifacts["nodes"])
+        else:
+            self._get_nodes(c_id)
+
+        if "llm_eval_data" in stale:
             self._gen_llm_eval_data(
                 c_id, component_cfg.get("gen_llm_eval_data", {})
             )
-            self._gen_nodes(c_id, component_cfg.get("gen_nodes", {}))
-            self._gen_qa_pairs(c_id, component_cfg.get("gen_qa_pairs", {}))
+            manifest.update(
+                "llm_eval_data", keys["llm_eval_data"], artifacts["llm_eval_data"]
+            )
         else:
-            print(f"Loading data artifacts for {c_id}")
             self._get_llm_eval_data(c_id)
-            self._get_nodes(c_id)
+
+        if "qa_pairs" in stale:
+            self._gen_qa_pairs(c_id, component_cfg.get("gen_qa_pairs", {}))
+            manifest.update("qa_pairs", keys["qa_pairs"], artifacts["qa_pairs"])
+        else:
             self.get_qa_pairs(c_id)
 
     def _download_data(self, c_id: str, cfg: Dict[str, Any]):
@@ -102,30 +300,112 @@ class RAGBuildingBlocks:
         reader = WikipediaReader()
         self.documents[c_id] = reader.load_data(pages=cfg["pages"])
 
-    def _gen_llm_eval_data(self, c_id: str, cfg: Dict[str, Any]):
-        persist_dir = os.path.join(
-            os.environ["PERSIST_DIR"], c_id, "llm_eval_data"
-        )
-        os.makedirs(persist_dir, exist_ok=True)
-        self.llm_eval_data[c_id] = {}
+    def _split_cfg(self, c_id: str) -> Dict[str, Any]:
+        component_cfg = self.components_cfg[c_id]
+        if "split_docs" in component_cfg:
+            return component_cfg["split_docs"]
+        # Older configs set the split in gen_nodes
+        return {
+            "docs_pct_split": component_cfg.get("gen_nodes", {}).get(
+                "docs_pct_split", [0.5, 0.3, 0.2]
+            )
+        }
+
+    def _gen_split_docs(self, c_id: str, cfg: Dict[str, Any]):
+        """Assign documents to train/val/test once per component with a seeded
+        shuffle. Documents are identified by the hash of their text, as reader
+        doc ids change on every load."""
         docs_pct_split = cfg.get("docs_pct_split", [0.5, 0.3, 0.2])
         if sum(docs_pct_split) > 1:
             raise ValueError(
                 f" Sum of docs_pct_split elements can't be higher than 1"
             )
-        docs_n_split = [
-            int(pct * len(self.documents[c_id])) for pct in docs_pct_split
-        ]
-        random_docs = random.sample(
-            self.documents[c_id], len(self.documents[c_id])
-        )
+        # Sort first so the split doesn't depend on the loading order
+        doc_hashes = sorted(_doc_hash(doc) for doc in self.documents[c_id])
+        random.Random(cfg.get("seed", 42)).shuffle(doc_hashes)
+        docs_n_split = [int(pct * len(doc_hashes)) for pct in docs_pct_split]
+
+        split_manifest = {}
         i = 0
         for s, split in enumerate(["train", "val", "test"]):
-            print(f"Generating LLM Eval Data for {c_id}, {split}")
-            split_docs = random_docs[i : i + docs_n_split[s]]
+            split_manifest[split] = doc_hashes[i : i + docs_n_split[s]]
             i += docs_n_split[s]
-            data_generator = DatasetGenerator.from_documents(
-                split_docs,
+
+        data_path = os.path.join(
+            os.environ["PERSIST_DIR"], c_id, "split_docs.json"
+        )
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        with open(data_path, "w") as file:
+            json.dump(split_manifest, file)
+        self._apply_split_docs(c_id, split_manifest)
+
+    def _get_split_docs(self, c_id: str, regenerate: bool = True):
+        """Load the split docs of c_id. When they don't match its documents,
+        regenerate them and every stage downstream of the split, or raise a
+        ValueError if regenerate is False."""
+        print(f"Loading split docs for {c_id}")
+        data_path = os.path.join(
+            os.environ["PERSIST_DIR"], c_id, "split_docs.json"
+        )
+        with open(data_path, "r") as file:
+            split_manifest = json.load(file)
+        if self._apply_split_docs(c_id, split_manifest):
+            return
+        if not regenerate:
+            raise ValueError(
+                f"Split docs of {c_id} don't match its documents, "
+                "ingest its data again"
+            )
+        print(f"Split docs of {c_id} don't match its documents, regenerating")
+        self._gen_split_docs(c_id, self._split_cfg(c_id))
+        if c_id in self.manifests:
+            # Nodes and everything built from them hold the old split
+            manifest = self.manifests[c_id]
+            manifest.update(
+                "split",
+                self.stage_keys[c_id]["split"],
+                self._stage_artifacts(c_id)["split"],
+            )
+            self.stale_stages[c_id] |= manifest.invalidate_downstream("split")
+
+    def _apply_split_docs(
+        self, c_id: str, split_manifest: Dict[str, list]
+    ) -> bool:
+        """Set the split docs from a split manifest, False when some of its
+        documents are not loaded."""
+        manifest_hashes = Counter(
+            doc_hash
+            for doc_hashes in split_manifest.values()
+            for doc_hash in doc_hashes
+        )
+        # Manifests written before text hashes use doc.hash
+        for hash_doc in [_doc_hash, lambda doc: doc.hash]:
+            docs_by_hash = {}
+            for doc in self.documents[c_id]:
+                docs_by_hash.setdefault(hash_doc(doc), []).append(doc)
+            doc_counts = Counter(
+                {doc_hash: len(docs) for doc_hash, docs in docs_by_hash.items()}
+            )
+            if manifest_hashes <= doc_counts:
+                self.split_docs[c_id] = {
+                    split: [docs_by_hash[doc_hash].pop() for doc_hash in hashes]
+                    for split, hashes in split_manifest.items()
+                }
+                return True
+        return False
+
+    def _gen_llm_eval_data(self, c_id: str, cfg: Dict[str, Any]):
+        persist_dir = os.path.join(
+            os.environ["PERSIST_DIR"], c_id, "llm_eval_data"
+        )
+        os.makedirs(persist_dir, exist_ok=True)
+        self.llm_eval_data[c_id] = {}
+        for split in ["train", "val", "test"]:
+            print(f"Generating LLM Eval Data for {c_id}, {split}")
+            # Generate from the nodes already produced for the split instead
+            # of parsing and chunking the documents again
+            data_generator = DatasetGenerator(
+                self.nodes[c_id][split],
                 num_questions_per_chunk=cfg.get("num_questions_per_chunk", 2),
             )
 
@@ -133,20 +413,35 @@ class RAGBuildingBlocks:
                 split
             ] = data_generator.generate_questions_from_nodes()
 
-            data_path = os.path.join(persist_dir, f"llm_eval_data_{split}.pkl")
-            with open(data_path, "wb") as file:
-                pickle.dump(self.llm_eval_data[c_id][split], file)
+            data_path = os.path.join(
+                persist_dir, f"llm_eval_data_{split}.parquet"
+            )
+            save_questions(self.llm_eval_data[c_id][split], data_path)
+
+    @staticmethod
+    def _load_split(data_path: str, load_columnar):
+        """Load a split persisted as parquet, falling back to the pickle files
+        written by older versions."""
+        if os.path.exists(data_path):
+            return load_columnar(data_path)
+        with open(data_path.replace(".parquet", ".pkl"), "rb") as file:
+            return pickle.load(file)
 
     def _get_llm_eval_data(self, c_id: str):
-        self.llm_eval_data[c_id] = {}
         persist_dir = os.path.join(
             os.environ["PERSIST_DIR"], c_id, "llm_eval_data"
         )
-        for split in ["train", "val", "test"]:
-            data_path = os.path.join(persist_dir, f"llm_eval_data_{split}.pkl")
+
+        def load_split(split: str):
             print(f"Loading LLM eval data for {c_id}, {split}")
-            with open(data_path, "rb") as file:
-                self.llm_eval_data[c_id][split] = pickle.load(file)
+            data_path = os.path.join(
+                persist_dir, f"llm_eval_data_{split}.parquet"
+            )
+            return self._load_split(data_path, load_questions)
+
+        self.llm_eval_data[c_id] = LazySplits(
+            load_split, ["train", "val", "test"]
+        )
 
     def _gen_nodes(self, c_id: str, cfg: Dict[str, Any]):
         persist_dir = os.path.join(os.environ["PERSIST_DIR"], c_id, "nodes")
@@ -160,38 +455,66 @@ class RAGBuildingBlocks:
         # )
 
         ## Using transformation pipeline
-        transformations = cfg.get("transformations", [SentenceSplitter()])
-        pipeline = IngestionPipeline(transformations=transformations)
+        pipeline = self._nodes_pipeline(c_id, cfg)
 
-        docs_pct_split = cfg.get("docs_pct_split", [0.5, 0.3, 0.2])
-        if sum(docs_pct_split) > 1:
-            raise ValueError(
-                f" Sum of docs_pct_split elements can't be higher than 1"
-            )
-        docs_n_split = [
-            int(pct * len(self.documents[c_id])) for pct in docs_pct_split
-        ]
-        random_docs = random.sample(
-            self.documents[c_id], len(self.documents[c_id])
-        )
-        i = 0
-        for s, split in enumerate(["train", "val", "test"]):
+        for split in ["train", "val", "test"]:
             print(f"Generating Nodes for {c_id}, {split}")
-            split_docs = random_docs[i : i + docs_n_split[s]]
-            self.nodes[c_id][split] = pipeline.run(documents=split_docs)
-            i += docs_n_split[s]
-            data_path = os.path.join(persist_dir, f"nodes_{split}.pkl")
-            with open(data_path, "wb") as file:
-                pickle.dump(self.nodes[c_id][split], file)
+            self.nodes[c_id][split] = pipeline.run(self.split_docs[c_id][split])
+            data_path = os.path.join(persist_dir, f"nodes_{split}.parquet")
+            save_nodes(self.nodes[c_id][split], data_path)
+        pipeline.persist()
+        print(
+            f"Pipeline cache for {c_id}: {pipeline.hits} hits, "
+            f"{pipeline.misses} misses"
+        )
+
+    @staticmethod
+    def _nodes_pipeline(
+        c_id: str, cfg: Dict[str, Any]
+    ) -> CachedIngestionPipeline:
+        """Pipeline of gen_nodes. "chunk_size" and "chunk_overlap" override
+        those of the SentenceSplitter of the transformations."""
+        transformations = cfg.get("transformations", [SentenceSplitter()])
+        chunking = {
+            k: cfg[k] for k in ["chunk_size", "chunk_overlap"] if k in cfg
+        }
+        if chunking:
+            splitters = [
+                t for t in transformations if isinstance(t, SentenceSplitter)
+            ]
+            if not splitters:
+                raise ValueError(
+                    "chunk_size and chunk_overlap need a SentenceSplitter in "
+                    "the transformations of gen_nodes"
+                )
+            transformations = [
+                (
+                    type(t).from_dict({**t.to_dict(), **chunking})
+                    if isinstance(t, SentenceSplitter)
+                    else t
+                )
+                for t in transformations
+            ]
+        # Every transformation output is cached per document, so changing or
+        # adding a transformation only recomputes what depends on it
+        return CachedIngestionPipeline(
+            transformations,
+            cache_dir=os.path.join(
+                os.environ["PERSIST_DIR"], c_id, "pipeline_cache"
+            ),
+            num_workers=cfg.get("num_workers"),
+            deduplicate=cfg.get("deduplicate", True),
+        )
 
     def _get_nodes(self, c_id: str):
-        self.nodes[c_id] = {}
         persist_dir = os.path.join(os.environ["PERSIST_DIR"], c_id, "nodes")
-        for split in ["train", "val", "test"]:
-            print(f"Generating Nodes for {c_id}, {split}")
-            data_path = os.path.join(persist_dir, f"nodes_{split}.pkl")
-            with open(data_path, "rb") as file:
-                self.nodes[c_id][split] = pickle.load(file)
+
+        def load_split(split: str):
+            print(f"Loading Nodes for {c_id}, {split}")
+            data_path = os.path.join(persist_dir, f"nodes_{split}.parquet")
+            return self._load_split(data_path, load_nodes)
+
+        self.nodes[c_id] = LazySplits(load_split, ["train", "val", "test"])
 
     def _gen_qa_pairs(self, c_id: str, cfg: Dict[str, Any]):
         persist_dir = os.path.join(os.environ["PERSIST_DIR"], c_id, "qa_pairs")
@@ -217,31 +540,67 @@ class RAGBuildingBlocks:
                 data_path
             )
 
+    def _all_nodes(self, c_id: str) -> list:
+        """Nodes of every split. Reads the lazily loaded splits, so only call
+        it when the index is generated, updated or swept."""
+        return (
+            self.nodes[c_id]["train"]
+            + self.nodes[c_id]["val"]
+            + self.nodes[c_id]["test"]
+        )
+
     def _set_engines(self, c_id: str):
         component_cfg = self.components_cfg[c_id]
-
-        # Index is the main output, check if exists
-        index_data_path = os.path.join(
+        index_cfg = component_cfg.get("gen_index", {})
+        index_config_key = hash_config(_index_config(index_cfg))
+        manifest = self.manifests[c_id]
+        index_persist_dir = os.path.join(
             os.environ["PERSIST_DIR"], c_id, "indexes", "baseline"
         )
-        if not os.path.exists(index_data_path):
-            print(f"Generating engines for {c_id}")
-            self.index[c_id] = self.gen_index(
-                c_id,
-                "baseline",
-                self.nodes[c_id]["train"]
-                + self.nodes[c_id]["val"]
-                + self.nodes[c_id]["test"],
-                component_cfg.get("gen_index", {}),
-            )
 
-        else:
+        if "index" not in self.stale_stages[c_id]:
             print(f"Loading engines for {c_id}")
             self.index[c_id] = self.get_index(c_id, "baseline")
+        elif (
+            index_cfg.get("incremental", True)
+            and os.path.exists(index_persist_dir)
+            and manifest.config_key("index") == index_config_key
+        ):
+            # Only the nodes changed, embed just the difference
+            print(f"Updating engines for {c_id}")
+            self.index[c_id] = self.update_index(
+                c_id, "baseline", self._all_nodes(c_id), index_cfg
+            )
+        else:
+            print(f"Generating engines for {c_id}")
+            self.index[c_id] = self.gen_index(
+                c_id, "baseline", self._all_nodes(c_id), index_cfg
+            )
+        if "index" in self.stale_stages[c_id]:
+            manifest.update(
+                "index",
+                self.stage_keys[c_id]["index"],
+                self._stage_artifacts(c_id)["index"],
+                config_key=index_config_key,
+            )
 
+        if "gen_retriever" in component_cfg:
+            self.retriever[c_id] = self.gen_retriever(
+                c_id, self.index[c_id], component_cfg["gen_retriever"]
+            )
         self.query_engine[c_id] = self.gen_query_engine(
-            c_id, self.index[c_id], component_cfg.get("gen_query_engine", {})
+            c_id,
+            self.index[c_id],
+            component_cfg.get("gen_query_engine", {}),
+            retriever=self.retriever.get(c_id),
         )
+        if "gen_chat_engine" in component_cfg:
+            self.chat_engine[c_id] = self.gen_chat_session_manager(
+                c_id,
+                self.index[c_id],
+                component_cfg["gen_chat_engine"],
+                retriever=self.retriever.get(c_id),
+            )
         self.query_engine_tools.append(
             self.gen_query_engine_tool(
                 c_id,
@@ -256,7 +615,10 @@ class RAGBuildingBlocks:
         persist_dir = os.path.join(
             os.environ["PERSIST_DIR"], c_id, "indexes", index_name
         )
-        os.makedirs(persist_dir)
+        # Files of a previous index, e.g. another vector store, would be
+        # loaded along with the new one
+        shutil.rmtree(persist_dir, ignore_errors=True)
+        os.makedirs(persist_dir, exist_ok=True)
 
         ## From documents
         # self.index[c] = VectorStoreIndex.from_documents(
@@ -284,39 +646,179 @@ class RAGBuildingBlocks:
         # )
 
         ## From nodes
-        index = VectorStoreIndex(nodes, **cfg)
+        index = VectorStoreIndex(
+            _pre_embed_nodes(nodes, cfg), **_index_kwargs(cfg)
+        )
 
         ## Persist index to avoid constructing it again
         index.storage_context.persist(persist_dir)
 
         return index
 
+    @staticmethod
+    def update_index(
+        c_id: str, index_name: str, nodes, cfg: Dict[str, Any] = {}
+    ):
+        """Sync a persisted index with nodes, matching them by the hash of the
+        content they are embedded from.
+
+        Only nodes whose content is not in the index are embedded. Nodes whose
+        content is already indexed under another id, or with other metadata,
+        e.g. new file dates, are re-inserted with the stored embedding, so ids
+        and metadata keep matching the current nodes and qa_pairs. Indexed
+        nodes that are no longer present are deleted.
+        """
+        index = RAGBuildingBlocks.get_index(c_id, index_name)
+        persist_dir = os.path.join(
+            os.environ["PERSIST_DIR"], c_id, "indexes", index_name
+        )
+
+        # Vector stores keeping the nodes, e.g. snapshots, have no docstore
+        nodes_in_store = index.vector_store.stores_text
+        if nodes_in_store:
+            indexed_nodes = index.vector_store.get_nodes()
+        else:
+            indexed_nodes = index.docstore.get_nodes(
+                list(index.index_struct.nodes_dict.values())
+            )
+        indexed_ids = [node.node_id for node in indexed_nodes]
+        ids_by_hash = {}
+        for node in indexed_nodes:
+            ids_by_hash.setdefault(_embed_hash(node), []).append(node.node_id)
+        hashes_by_id = {node.node_id: node.hash for node in indexed_nodes}
+
+        keep_ids, to_insert = set(), []
+        n_reused = 0
+        for node in nodes:
+            matching_ids = ids_by_hash.get(_embed_hash(node))
+            if not matching_ids:
+                to_insert.append(node)
+                continue
+            node_id = (
+                node.node_id
+                if node.node_id in matching_ids
+                else matching_ids[0]
+            )
+            matching_ids.remove(node_id)
+            if node_id == node.node_id and hashes_by_id[node_id] == node.hash:
+                keep_ids.add(node_id)
+                continue
+            try:
+                embedding = index.vector_store.get(node_id)
+            except (NotImplementedError, KeyError):
+                embedding = None
+            node = node.copy()
+            node.embedding = embedding
+            to_insert.append(node)
+            n_reused += embedding is not None
+
+        to_delete = [n_id for n_id in indexed_ids if n_id not in keep_ids]
+        print(
+            f"Updating Index for {c_id}, {index_name}: "
+            f"{len(to_insert) - n_reused} to embed, {n_reused} reused, "
+            f"{len(to_delete)} to delete, {len(keep_ids)} unchanged"
+        )
+        if to_delete:
+            index.delete_nodes(to_delete, delete_from_docstore=True)
+        if to_delete and not nodes_in_store:
+            for node_id in to_delete:
+                index.index_struct.delete(node_id)
+            index.storage_context.index_store.add_index_struct(
+                index.index_struct
+            )
+        if to_insert:
+            index.insert_nodes(_pre_embed_nodes(to_insert, cfg))
+
+        index.storage_context.persist(persist_dir)
+        return index
+
     @staticmethod
     def get_index(c_id: str, index_name: str):
         print(f"Loading Index for {c_id}, {index_name}")
         persist_dir = os.path.join(
             os.environ["PERSIST_DIR"], c_id, "indexes", index_name
         )
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-        index = load_index_from_storage(storage_context)
+        index = load_index(persist_dir)
         return index
 
     @staticmethod
-    def gen_retriever(c_id: str, index, cfg: Dict[str, Any] = {}):
+    def gen_retriever(
+        c_id: str,
+        index,
+        cfg: Dict[str, Any] = {},
+        bm25_dir: Optional[str] = None,
+    ):
+        """Vector retriever of index, or with "mode": "hybrid" a retriever
+        fusing it with BM25 keyword search.
+
+        The BM25 index is persisted in bm25_dir, by default next to the
+        baseline index of c_id, and built again when the nodes of index
+        change. Hybrid options are
+        "fusion" ("alpha" or "rrf"), "alpha" (weight of the vector scores),
+        "candidate_k" (candidates of each retriever), "rrf_k", "k1" and "b".
+
+        "filters" restricts retrieval to nodes whose metadata matches, e.g.
+        {"file_name": ["a.pdf", "b.pdf"]}, see make_metadata_filters. With a
+        NumpyVectorStore, filters on its metadata_fields select the rows from
+        posting lists before scoring.
+        """
         print(f"Generating Retriever for {c_id}")
+        similarity_top_k = cfg.get("similarity_top_k", 3)
+        hybrid = cfg.get("mode", "vector") == "hybrid"
+        candidate_k = cfg.get("candidate_k", 4 * similarity_top_k)
+        filters = make_metadata_filters(cfg.get("filters"))
         retriever = index.as_retriever(
-            similarity_top_k=cfg.get("similarity_top_k", 3),
-            ## You can set here  parameters for vector store and alpha
+            similarity_top_k=candidate_k if hybrid else similarity_top_k,
+            filters=filters,
+            vector_store_kwargs=cfg.get("vector_store_kwargs", {}),
             # https://docs.llamaindex.ai/en/stable/api_reference/retrievers/vector/
         )
+        if hybrid:
+            bm25 = BM25Index.load_or_build(
+                bm25_dir
+                or os.path.join(
+                    os.environ["PERSIST_DIR"],
+                    c_id,
+                    "indexes",
+                    "baseline",
+                    BM25Index.dir_name,
+                ),
+                index,
+                k1=cfg.get("k1", 1.5),
+                b=cfg.get("b", 0.75),
+            )
+            retriever = HybridRetriever(
+                retriever,
+                bm25,
+                index,
+                similarity_top_k=similarity_top_k,
+                candidate_k=candidate_k,
+                fusion=cfg.get("fusion", "alpha"),
+                alpha=cfg.get("alpha", 0.5),
+                rrf_k=cfg.get("rrf_k", 60),
+                filters=filters,
+            )
         return retriever
 
     @staticmethod
-    def gen_query_engine(c_id: str, index, cfg: Dict[str, Any] = {}):
+    def gen_query_engine(
+        c_id: str, index, cfg: Dict[str, Any] = {}, retriever=None
+    ):
         print(f"Generating Query Engine for {c_id}")
-        query_engine = index.as_query_engine(
-            similarity_top_k=cfg.get("similarity_top_k", 3)
-        )
+        if retriever is not None:
+            # e.g. a hybrid retriever from gen_retriever
+            query_engine = RetrieverQueryEngine.from_args(retriever)
+        else:
+            query_engine = index.as_query_engine(
+                similarity_top_k=cfg.get("similarity_top_k", 3),
+                filters=make_metadata_filters(cfg.get("filters")),
+            )
+        if cfg.get("cache"):
+            # True for the defaults or a dict of CachedQueryEngine arguments
+            cache_cfg = cfg["cache"] if isinstance(cfg["cache"], dict) else {}
+            query_engine = CachedQueryEngine(
+                query_engine, index=index, **cache_cfg
+            )
         return query_engine
 
     @staticmethod
@@ -333,18 +835,27 @@ class RAGBuildingBlocks:
             ),
         )
 
+    def gen_fan_out_query_engine(
+        self, c_ids: Optional[List[str]] = None, cfg: Dict[str, Any] = {}
+    ) -> FanOutQueryEngine:
+        """Query engine retrieving from the engines of several components
+        concurrently and synthesizing one answer from their fused nodes.
+
+        Args:
+            c_ids (Optional[List[str]], optional): Components queried, their
+                engines must be set. Defaults to None (every component).
+            cfg (Dict[str, Any], optional): FanOutQueryEngine arguments, e.g.
+                {"similarity_top_k": 5, "fusion": "rrf", "timeout": 10}.
+        """
+        print(f"Generating Fan-Out Query Engine for {c_ids or 'all'}")
+        return FanOutQueryEngine(
+            self.query_engine_tools, tool_names=c_ids, **cfg
+        )
+
     @staticmethod
     def gen_chat_engine(c_id: str, index, cfg: Dict[str, Any] = {}):
-        print(f"Generating Retriever for {c_id}")
-        CHAT_SYSTEM_CONTENT = """
-            Here are the relevant documents for the context:
-            {context_str}
-            ----
-            Given the context information and not prior knowledge,
-            answer to the question, as briefly as possible.
-            Structure your response as a list of facts.
-        """
-        memory = ChatMemoryBuffer.from_defaults(token_limit=3900)
+        print(f"Generating Chat Engine for {c_id}")
+        memory = TokenCountingMemory.from_defaults(token_limit=3900)
 
         chat_engine = index.as_chat_engine(
             similarity_top_k=cfg.get("similarity_top_k", 3),
@@ -356,24 +867,339 @@ class RAGBuildingBlocks:
         )
         return chat_engine
 
+    @staticmethod
+    def gen_chat_session_manager(
+        c_id: str, index, cfg: Dict[str, Any] = {}, retriever=None
+    ) -> ChatSessionManager:
+        """Chat engines of many sessions sharing one retriever of index.
+
+        Options are "similarity_top_k" (when no retriever is given),
+        "token_limit", "max_sessions", "ttl" and "spill", True to write
+        evicted sessions under PERSIST_DIR/c_id/chat_sessions, see
+        ChatSessionManager.
+        """
+        print(f"Generating Chat Session Manager for {c_id}")
+        if retriever is None:
+            retriever = index.as_retriever(
+                similarity_top_k=cfg.get("similarity_top_k", 3)
+            )
+        spill_dir = None
+        if cfg.get("spill"):
+            spill_dir = os.path.join(
+                os.environ["PERSIST_DIR"], c_id, "chat_sessions"
+            )
+        return ChatSessionManager(
+            retriever,
+            token_limit=cfg.get("token_limit", 3900),
+            max_sessions=cfg.get("max_sessions", 1000),
+            ttl=cfg.get("ttl", 3600),
+            spill_dir=spill_dir,
+        )
+
+    def benchmark_index(
+        self,
+        c_id: str,
+        vector_stores: Dict[str, Any],
+        top_k: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Compare the latency and recall of vector_stores, e.g. ANN options
+        of gen_index, with exact search over the nodes of the baseline index,
+        on every qa_pairs split of c_id.
+
+        Args:
+            c_id (str): Component id, its engines must be set.
+            vector_stores (Dict[str, Any]): Name of each option and its
+                vector_store value for gen_index.
+            top_k (Optional[int], optional): Nodes retrieved per query.
+                Defaults to the similarity_top_k of gen_query_engine.
+        """
+        print(f"Benchmarking vector stores for {c_id}")
+        if top_k is None:
+            top_k = (
+                self.components_cfg[c_id]
+                .get("gen_query_engine", {})
+                .get("similarity_top_k", 3)
+            )
+        return benchmark_vector_stores(
+            self.qa_pairs[c_id], self.index[c_id], vector_stores, top_k
+        )
+
+    def _sweep_nodes(self, c_id: str, cfg: Dict[str, Any]) -> list:
+        """Nodes of every split for a gen_nodes config, without persisting
+        them. Chunks already seen come from the pipeline cache."""
+        print(f"Generating sweep Nodes for {c_id}")
+        pipeline = self._nodes_pipeline(c_id, cfg)
+        nodes = []
+        for split in ["train", "val", "test"]:
+            nodes += pipeline.run(self.split_docs[c_id][split])
+        pipeline.persist()
+        return nodes
+
+    @staticmethod
+    def _sweep_retriever_cfg(cfg: Dict[str, Any]):
+        """gen_retriever config of a component config without its top_k, and
+        the top_k, which may come from gen_query_engine."""
+        if "gen_retriever" in cfg:
+            retriever_cfg = dict(cfg["gen_retriever"])
+        else:
+            query_engine_cfg = cfg.get("gen_query_engine", {})
+            retriever_cfg = {
+                "similarity_top_k": query_engine_cfg.get("similarity_top_k", 3),
+                "filters": query_engine_cfg.get("filters"),
+            }
+        top_k = retriever_cfg.pop("similarity_top_k", 3)
+        if retriever_cfg.get("mode") == "hybrid":
+            # Candidates depend on top_k unless they are set
+            retriever_cfg.setdefault("candidate_k", 4 * top_k)
+        return retriever_cfg, top_k
+
+    def sweep(
+        self,
+        c_id: str,
+        grid: Grid,
+        split: str = "val",
+        max_workers: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Retrieval metrics of every combination of config overrides of a
+        component, e.g. chunk sizes and top_k.
+
+        Combinations share every artifact their overrides don't change.
+        Documents are loaded once. Nodes are generated once per gen_nodes
+        config, from the pipeline cache. Indexes are built once per gen_nodes
+        and gen_index config, in memory and in parallel, with cached
+        embeddings so chunks shared by several configs are embedded once.
+        Queries are retrieved once per retriever config at the largest top_k,
+        smaller top_k being prefixes of it.
+
+        The questions are the qa_pairs of split. With other gen_nodes than the
+        component, a node is relevant when it covers a relevant node of the
+        component, see span_relevant_ids.
+
+        Args:
+            c_id (str): Component id, its data must be ingested and its
+                engines set.
+            grid (Grid): Values of every "stage.option", see expand_grid,
+                e.g. {"gen_nodes.chunk_size": [256, 512, 1024],
+                "gen_query_engine.similarity_top_k": [3, 5, 10]}. Stages are
+                gen_nodes, gen_index, gen_retriever and, for components
+                without gen_retriever, the similarity_top_k and filters of
+                gen_query_engine. Other overrides raise a ValueError.
+            split (str, optional): Split of the questions. Defaults to "val".
+            max_workers (Optional[int], optional): Indexes built at the same
+                time. Defaults to SWEEP_MAX_WORKERS.
+
+        Returns:
+            pd.DataFrame: One row per combination with its overrides, n_nodes,
+                top_k, hit_rate, mrr, recall, precision and ndcg at top_k, and
+                the seconds spent generating its nodes, building its index and
+                retrieving, which are shared with other combinations. It is
+                also written to PERSIST_DIR/c_id/sweeps.
+        """
+        component_cfg = self.components_cfg[c_id]
+        combinations = [
+            (overrides, apply_overrides(component_cfg, overrides))
+            for overrides in expand_grid(grid)
+        ]
+        for overrides, cfg in combinations:
+            check_overrides(cfg, overrides)
+        print(f"Sweeping {len(combinations)} configs for {c_id}")
+        dataset = self.qa_pairs[c_id][split]
+        query_ids = list(dataset.queries)
+        queries = [dataset.queries[query_id] for query_id in query_ids]
+        base_nodes = self._all_nodes(c_id)
+        base_nodes_key = hash_config(component_cfg.get("gen_nodes", {}))
+        base_index_key = hash_config(
+            base_nodes_key, component_cfg.get("gen_index", {})
+        )
+
+        # Group combinations by the artifacts they share: nodes key -> index
+        # key -> retriever key -> (combination, top_k)
+        groups = {}
+        nodes_cfgs, index_cfgs, retriever_cfgs = {}, {}, {}
+        for i, (_, cfg) in enumerate(combinations):
+            nodes_key = hash_config(cfg.get("gen_nodes", {}))
+            index_key = hash_config(nodes_key, cfg.get("gen_index", {}))
+            retriever_cfg, top_k = self._sweep_retriever_cfg(cfg)
+            retriever_key = hash_config(index_key, retriever_cfg)
+            nodes_cfgs[nodes_key] = cfg.get("gen_nodes", {})
+            index_cfgs[index_key] = cfg.get("gen_index", {})
+            retriever_cfgs[retriever_key] = retriever_cfg
+            groups.setdefault(nodes_key, {}).setdefault(
+                index_key, {}
+            ).setdefault(retriever_key, []).append((i, top_k))
+
+        nodes, relevant, nodes_seconds = {}, {}, {}
+        referenced = {
+            node_id
+            for query_id in query_ids
+            for node_id in dataset.relevant_docs[query_id]
+        }
+        for nodes_key in groups:
+            start = time.perf_counter()
+            if nodes_key == base_nodes_key:
+                nodes[nodes_key] = base_nodes
+                relevant[nodes_key] = [
+                    dataset.relevant_docs[query_id] for query_id in query_ids
+                ]
+            else:
+                if c_id not in self.split_docs:
+                    self._load_data(c_id, component_cfg.get("load_data"))
+                    # base_nodes and the questions hold the persisted split
+                    self._get_split_docs(c_id, regenerate=False)
+                nodes[nodes_key] = self._sweep_nodes(
+                    c_id, nodes_cfgs[nodes_key]
+                )
+                covering = span_relevant_ids(
+                    [n for n in base_nodes if n.node_id in referenced],
+                    nodes[nodes_key],
+                )
+                relevant[nodes_key] = [
+                    sorted(
+                        {
+                            node_id
+                            for ref_id in dataset.relevant_docs[query_id]
+                            for node_id in covering.get(ref_id, [])
+                        }
+                    )
+                    for query_id in query_ids
+                ]
+            nodes_seconds[nodes_key] = time.perf_counter() - start
+
+        def run_index(nodes_key: str, index_key: str) -> list:
+            index_cfg = index_cfgs[index_key]
+            start = time.perf_counter()
+            if index_key == base_index_key and c_id in self.index:
+                index = self.index[c_id]
+                bm25_dir = None
+            else:
+                # Cached embeddings, so chunks of other configs are reused
+                index_cfg = {
+                    **index_cfg,
+                    "embed_model": index_cfg.get(
+                        "embed_model", Settings.embed_model
+                    ),
+                }
+                index = VectorStoreIndex(
+                    _pre_embed_nodes(nodes[nodes_key], index_cfg),
+                    **_index_kwargs(index_cfg),
+                )
+                bm25_dir = os.path.join(
+                    os.environ["PERSIST_DIR"],
+                    c_id,
+                    "sweeps",
+                    "indexes",
+                    index_key[:12],
+                    BM25Index.dir_name,
+                )
+            index_seconds = time.perf_counter() - start
+
+            rows = []
+            for retriever_key, members in groups[nodes_key][index_key].items():
+                depth = max(top_k for _, top_k in members)
+                start = time.perf_counter()
+                retriever = self.gen_retriever(
+                    c_id,
+                    index,
+                    {
+                        **retriever_cfgs[retriever_key],
+                        "similarity_top_k": depth,
+                    },
+                    bm25_dir=bm25_dir,
+                )
+                retrieved = [
+                    [node.node.node_id for node in query_nodes]
+                    for query_nodes in retrieve_batch(retriever, queries)
+                ]
+                retrieval_seconds = time.perf_counter() - start
+                for i, top_k in members:
+                    metrics = retrieval_metrics(
+                        [ids[:top_k] for ids in retrieved],
+                        relevant[nodes_key],
+                        ks=[top_k],
+                    ).mean()
+                    rows.append(
+                        {
+                            **combinations[i][0],
+                            "n_nodes": len(nodes[nodes_key]),
+                            "top_k": top_k,
+                            "hit_rate": metrics[f"hit@{top_k}"],
+                            "mrr": metrics["mrr"],
+                            "recall": metrics[f"recall@{top_k}"],
+                            "precision": metrics[f"precision@{top_k}"],
+                            "ndcg": metrics[f"ndcg@{top_k}"],
+                            "nodes_seconds": nodes_seconds[nodes_key],
+                            "index_seconds": index_seconds,
+                            "retrieval_seconds": retrieval_seconds,
+                            "combination": i,
+                        }
+                    )
+            return rows
+
+        index_keys = [
+            (nodes_key, index_key)
+            for nodes_key, index_groups in groups.items()
+            for index_key in index_groups
+        ]
+        rows = []
+        with ThreadPoolExecutor(
+            max_workers=max_workers or min(len(index_keys), SWEEP_MAX_WORKERS)
+        ) as pool:
+            for index_rows in pool.map(
+                lambda keys: run_index(*keys), index_keys
+            ):
+                rows += index_rows
+
+        df = (
+            pd.DataFrame(rows)
+            .sort_values("combination")
+            .drop(columns="combination")
+            .reset_index(drop=True)
+        )
+        data_path = os.path.join(
+            os.environ["PERSIST_DIR"],
+            c_id,
+            "sweeps",
+            f"sweep_{split}_{hash_config(grid)[:12]}.csv",
+        )
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        df.to_csv(data_path, index=False)
+        print(f"Sweep results for {c_id} available at {data_path}")
+        return df
+
     def _eval_data(self, c_id: str):
-        # Index is the main output, check if exists
         persist_dir = os.path.join(
             os.environ["PERSIST_DIR"], c_id, "eval_data"
         )
         self.eval_data[c_id] = {}
-        if not os.path.exists(persist_dir):
+        if "eval_data" in self.stale_stages[c_id]:
             os.makedirs(persist_dir, exist_ok=True)
-            corpus = self.get_corpus(self.index[c_id])
+            corpus = self.get_corpus_from_index(self.index[c_id])
+            cfg = dict(self.components_cfg[c_id].get("gen_eval_data", {}))
+            use_async = cfg.pop("async", False)
             for split in ["train", "val", "test"]:
                 print(f"Generating eval data for {c_id}, {split}")
-                self.eval_data[c_id][split] = self.gen_eval_data(
-                    self.query_engine[c_id],
-                    self.qa_pairs[c_id][split],
-                    corpus,
-                )
+                if use_async:
+                    self.eval_data[c_id][split] = asyncio.run(
+                        self.agen_eval_data(
+                            self.query_engine[c_id],
+                            self.qa_pairs[c_id][split],
+                            corpus,
+                            **cfg,
+                        )
+                    )
+                else:
+                    self.eval_data[c_id][split] = self.gen_eval_data(
+                        self.query_engine[c_id],
+                        self.qa_pairs[c_id][split],
+                        corpus,
+                    )
                 data_path = os.path.join(persist_dir, f"eval_data_{split}.pkl")
                 self.eval_data[c_id][split].to_pickle(data_path)
+            self.manifests[c_id].update(
+                "eval_data",
+                self.stage_keys[c_id]["eval_data"],
+                self._stage_artifacts(c_id)["eval_data"],
+            )
 
         else:
             for split in ["train", "val", "test"]:
@@ -383,27 +1209,30 @@ class RAGBuildingBlocks:
 
     @staticmethod
     def get_corpus_from_index(index):
+        if index.vector_store.stores_text:
+            return {
+                node.id_: node.text
+                for node in index.vector_store.get_nodes()
+            }
         return {dd.id_: dd.text for dd in index.docstore.docs.values()}
 
     @staticmethod
-    def gen_eval_data(query_engine, qa_pairs, corpus):
-        df_eval_dict = {}
-        for q_id, query in tqdm(qa_pairs.queries.items()):
-            reference_id = qa_pairs.relevant_docs[q_id][0]
-            reference = qa_pairs.corpus[reference_id]  # can use corpus too
-
-            response = query_engine.query(query)
-            contexts_ids = [sn.id_ for sn in response.source_nodes]
-            contexts = [corpus[n_id] for n_id in contexts_ids]
-            df_eval_dict[q_id] = [
-                query,
-                reference_id,
-                reference,
-                contexts_ids,
-                contexts,
-                str(response),
-            ]
+    def _eval_row(query, qa_pairs, q_id, response, corpus):
+        reference_id = qa_pairs.relevant_docs[q_id][0]
+        reference = qa_pairs.corpus[reference_id]  # can use corpus too
+        contexts_ids = [sn.id_ for sn in response.source_nodes]
+        contexts = [corpus[n_id] for n_id in contexts_ids]
+        return [
+            query,
+            reference_id,
+            reference,
+            contexts_ids,
+            contexts,
+            str(response),
+        ]
 
+    @staticmethod
+    def _eval_df(df_eval_dict):
         return pd.DataFrame.from_dict(
             df_eval_dict,
             orient="index",
@@ -417,8 +1246,184 @@ class RAGBuildingBlocks:
             ],
         )
 
-    def execute(self):
-        for c_id, _ in self.components_cfg.items():
-            self._ingest_data(c_id)
-            self._set_engines(c_id)
-            self._eval_data(c_id)
+    @staticmethod
+    def gen_eval_data(query_engine, qa_pairs, corpus):
+        df_eval_dict = {}
+        for q_id, query in tqdm(qa_pairs.queries.items()):
+            response = query_engine.query(query)
+            df_eval_dict[q_id] = RAGBuildingBlocks._eval_row(
+                query, qa_pairs, q_id, response, corpus
+            )
+
+        return RAGBuildingBlocks._eval_df(df_eval_dict)
+
+    @staticmethod
+    async def agen_eval_data(
+        query_engine,
+        qa_pairs,
+        corpus,
+        max_concurrency: int = 8,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        tokens_per_query: int = 1000,
+    ) -> pd.DataFrame:
+        """Same as gen_eval_data but running queries concurrently with aquery.
+
+        Args:
+            max_concurrency (int, optional): Queries in flight. Defaults to 8.
+            requests_per_minute (Optional[float], optional): Rate limit of
+                queries. Defaults to None.
+            tokens_per_minute (Optional[float], optional): Rate limit of tokens.
+                Defaults to None.
+            tokens_per_query (int, optional): Tokens counted for each query on
+                top of the query itself (retrieved context and answer).
+                Defaults to 1000.
+
+        Returns:
+            pd.DataFrame: Eval data, rows in qa_pairs order. Throughput and
+                latency percentiles are stored in df.attrs["performance"].
+        """
+        rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        q_ids = list(qa_pairs.queries.keys())
+
+        async def run_query(q_id):
+            return await query_engine.aquery(qa_pairs.queries[q_id])
+
+        start = time.perf_counter()
+        responses, latencies = await amap_bounded(
+            run_query,
+            q_ids,
+            max_concurrency=max_concurrency,
+            rate_limiter=rate_limiter,
+            count_tokens=lambda q_id: tokens_per_query
+            + len(Settings.tokenizer(qa_pairs.queries[q_id])),
+        )
+        elapsed = time.perf_counter() - start
+
+        df = RAGBuildingBlocks._eval_df(
+            {
+                q_id: RAGBuildingBlocks._eval_row(
+                    qa_pairs.queries[q_id], qa_pairs, q_id, response, corpus
+                )
+                for q_id, response in zip(q_ids, responses)
+            }
+        )
+        summary = latency_summary(latencies)
+        df.attrs["performance"] = {
+            "queries_per_second": len(q_ids) / elapsed if elapsed else 0.0,
+            **summary,
+        }
+        print(
+            f"{df.attrs['performance']['queries_per_second']:.2f} queries/s, "
+            + format_latency_summary(summary)
+        )
+        return df
+
+    def _execute_component(self, c_id: str):
+        timings = {}
+        for stage, run_stage in [
+            ("ingest_data", self._ingest_data),
+            ("set_engines", self._set_engines),
+            ("eval_data", self._eval_data),
+        ]:
+            start = time.perf_counter()
+            run_stage(c_id)
+            timings[stage] = time.perf_counter() - start
+        timings["total"] = sum(timings.values())
+        self.timings[c_id] = timings
+
+    def _sort_by_components(self):
+        """Merge per component outputs back in components_cfg order, so results
+        don't depend on which worker finished first."""
+        order = list(self.components_cfg.keys())
+        for attr in [
+            "documents",
+            "split_docs",
+            "llm_eval_data",
+            "nodes",
+            "qa_pairs",
+            "index",
+            "query_engine",
+            "retriever",
+            "chat_engine",
+            "eval_data",
+            "timings",
+        ]:
+            outputs = getattr(self, attr)
+            sorted_outputs = {c: outputs[c] for c in order if c in outputs}
+            setattr(self, attr, sorted_outputs)
+        self.query_engine_tools.sort(
+            key=lambda tool: order.index(tool.metadata.name)
+        )
+
+    def _print_timings(self):
+        for c_id, timings in self.timings.items():
+            stages = ", ".join(f"{k}={v:.1f}s" for k, v in timings.items())
+            print(f"Timings for {c_id}: {stages}")
+
+    def execute(
+        self,
+        parallel: bool = False,
+        max_workers: Optional[int] = None,
+        executor: str = "thread",
+    ):
+        """Ingest data, set engines and generate eval data for every component.
+
+        Args:
+            parallel (bool, optional): Run independent components at the same time.
+                Defaults to False.
+            max_workers (Optional[int], optional): Size of the worker pool. Defaults
+                to one worker per component.
+            executor (str, optional): "thread" or "process". Threads share the
+                in-memory outputs directly. Processes generate and persist each
+                component's artifacts, which are then loaded from PERSIST_DIR, so
+                components_cfg must be picklable. Defaults to "thread".
+        """
+        if not parallel:
+            for c_id, _ in self.components_cfg.items():
+                self._execute_component(c_id)
+            self._print_timings()
+            return
+
+        max_workers = max_workers or len(self.components_cfg)
+        if executor == "thread":
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(self._execute_component, c_id): c_id
+                    for c_id in self.components_cfg
+                }
+                for future in as_completed(futures):
+                    future.result()
+                    print(f"Finished {futures[future]}")
+        elif executor == "process":
+            worker_timings = {}
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(
+                        _execute_component_in_process, self.components_cfg, c_id
+                    ): c_id
+                    for c_id in self.components_cfg
+                }
+                for future in as_completed(futures):
+                    worker_timings[futures[future]] = future.result()
+                    print(f"Finished {futures[future]}")
+            # Everything is persisted by now, so this only loads artifacts
+            for c_id in self.components_cfg:
+                self._execute_component(c_id)
+                self.timings[c_id] = {
+                    **worker_timings[c_id],
+                    "load": self.timings[c_id]["total"],
+                }
+        else:
+            raise ValueError(f"{executor} executor not supported.")
+
+        self._sort_by_components()
+        self._print_timings()
+
+
+def _execute_component_in_process(
+    components_cfg: Dict[str, Dict[str, Any]], c_id: str
+) -> Dict[str, float]:
+    rag = RAGBuildingBlocks({c_id: components_cfg[c_id]})
+    rag._execute_component(c_id)
+    return rag.timings[c_id]
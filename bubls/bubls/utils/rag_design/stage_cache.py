@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+
+# Stages of a RAGBuildingBlocks component and the stages each one consumes
+STAGE_DEPENDENCIES = {
+    "download": [],
+    "load": ["download"],
+    "split": ["load"],
+    "nodes": ["split"],
+    "llm_eval_data": ["nodes"],
+    "qa_pairs": ["nodes"],
+    "index": ["nodes"],
+    "eval_data": ["index", "qa_pairs"],
+}
+
+
+def _to_serializable(obj: Any) -> Any:
+    """Stable representation of config values that json can't encode."""
+    if hasattr(obj, "to_dict"):
+        # llama_index components (node parsers, extractors, readers, ...)
+        return obj.to_dict()
+    if callable(obj) and hasattr(obj, "__qualname__"):
+        return f"{obj.__module__}.{obj.__qualname__}"
+    if hasattr(obj, "__dict__"):
+        return {
+            "class_name": type(obj).__qualname__,
+            **{k: v for k, v in vars(obj).items() if not k.startswith("_")},
+        }
+    # Avoid repr(), it usually contains a memory address
+    return type(obj).__qualname__
+
+
+def hash_config(*values: Any) -> str:
+    """Hash config values and/or upstream hashes into a single key.
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    payload = json.dumps(
+        values, sort_keys=True, default=_to_serializable, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hash_files(path: str) -> str:
+    """Hash the relative paths and contents of every file under path.
+
+    Args:
+        path (str): File or directory to hash. A missing path hashes as empty.
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        file_paths = [path]
+    else:
+        file_paths = sorted(
+            os.path.join(root, file_name)
+            for root, _, file_names in os.walk(path)
+            for file_name in file_names
+        )
+    for file_path in file_paths:
+        digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(2**20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class StageManifest:
+    """Keys and artifacts of every stage of a component, persisted as
+    manifest.json inside the component persist dir.
+
+    A stage is fresh when its recorded key matches the current one, its
+    artifacts exist and every stage it depends on is fresh too.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.persist_dir = persist_dir
+        self.path = os.path.join(persist_dir, "manifest.json")
+        self.exists = os.path.exists(self.path)
+        self.stages = {}
+        if self.exists:
+            with open(self.path, "r") as file:
+                self.stages = json.load(file)
+
+    def _artifacts_exist(self, artifacts: List[str]) -> bool:
+        return all(
+            os.path.exists(os.path.join(self.persist_dir, artifact))
+            for artifact in artifacts
+        )
+
+    def is_fresh(self, stage: str, key: str) -> bool:
+        entry = self.stages.get(stage)
+        return (
+            entry is not None
+            and entry["key"] == key
+            and self._artifacts_exist(entry["artifacts"])
+        )
+
+    def stale_stages(self, keys: Dict[str, str]) -> Set[str]:
+        """Stages that have to be regenerated, including every stage that
+        depends on a stale one."""
+        stale = set()
+        for stage, dependencies in STAGE_DEPENDENCIES.items():
+            if stage not in keys:
+                continue
+            if not self.is_fresh(stage, keys[stage]) or stale.intersection(
+                dependencies
+            ):
+                stale.add(stage)
+        return stale
+
+    def adopt(self, keys: Dict[str, str], artifacts: Dict[str, List[str]]):
+        """Record the current keys for artifacts generated before manifests
+        existed, so they are reused instead of regenerated.
+
+        Stages without artifacts, e.g. load, are adopted when a stage
+        consuming them is, so walk the stages from the end of the pipeline.
+        """
+        adopted = set()
+        for stage in reversed(list(STAGE_DEPENDENCIES)):
+            if stage not in artifacts:
+                continue
+            stage_artifacts = artifacts[stage]
+            if stage_artifacts:
+                adopt = self._artifacts_exist(stage_artifacts)
+            else:
+                adopt = any(
+                    stage in STAGE_DEPENDENCIES[consumer]
+                    for consumer in adopted
+                )
+            if adopt:
+                adopted.add(stage)
+                self.stages[stage] = {
+                    "key": keys[stage],
+                    "artifacts": stage_artifacts,
+                    "updated_at": time.time(),
+                }
+        self.save()
+
+    def invalidate_downstream(self, stage: str) -> Set[str]:
+        """Forget every stage depending on stage, directly or not, so they
+        are regenerated even though their keys didn't change, e.g. after
+        regenerating the stage outside of its key.
+
+        Returns:
+            Set[str]: Stages forgotten.
+        """
+        downstream = set()
+        for consumer, dependencies in STAGE_DEPENDENCIES.items():
+            if downstream.union([stage]).intersection(dependencies):
+                downstream.add(consumer)
+        for consumer in downstream:
+            self.stages.pop(consumer, None)
+        self.save()
+        return downstream
+
+    def config_key(self, stage: str) -> Optional[str]:
+        """Hash of the stage's own config when it was last generated."""
+        return self.stages.get(stage, {}).get("config_key")
+
+    def update(
+        self,
+        stage: str,
+        key: str,
+        artifacts: Optional[List[str]] = None,
+        config_key: Optional[str] = None,
+    ):
+        self.stages[stage] = {
+            "key": key,
+            "artifacts": artifacts or [],
+            "config_key": config_key,
+            "updated_at": time.time(),
+        }
+        self.save()
+
+    def save(self):
+        os.makedirs(self.persist_dir, exist_ok=True)
+        self.exists = True
+        with open(self.path, "w") as file:
+            json.dump(self.stages, file, indent=2)
@@ -0,0 +1,133 @@
+from llama_index.core.schema import BaseNode
+from itertools import product
+from typing import Any, Dict, List, Union
+import numpy as np
+
+Grid = Union[Dict[str, List[Any]], List[Dict[str, Any]]]
+
+# Indexes a sweep builds at the same time, each one holding its nodes and
+# embeddings in memory and sending its own embedding requests
+SWEEP_MAX_WORKERS = 4
+
+# Stages a sweep scores, with the options changing retrieval, None for all
+SWEEP_OPTIONS = {
+    "gen_nodes": None,
+    "gen_index": None,
+    "gen_retriever": None,
+    "gen_query_engine": ["similarity_top_k", "filters"],
+}
+
+
+def expand_grid(grid: Grid) -> List[Dict[str, Any]]:
+    """Overrides of every combination of a grid.
+
+    Args:
+        grid (Grid): Values of every "stage.option", e.g.
+            {"gen_nodes.chunk_size": [256, 512],
+            "gen_query_engine.similarity_top_k": [3, 5]}, or the list of
+            overrides itself.
+
+    Returns:
+        List[Dict[str, Any]]: One {"stage.option": value} dict per
+            combination.
+    """
+    if isinstance(grid, list):
+        return [dict(overrides) for overrides in grid]
+    options = list(grid)
+    return [
+        dict(zip(options, values))
+        for values in product(*(grid[option] for option in options))
+    ]
+
+
+def apply_overrides(
+    component_cfg: Dict[str, Any], overrides: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Copy of component_cfg with the "stage.option" overrides set."""
+    cfg = dict(component_cfg)
+    for path, value in overrides.items():
+        stage, option = path.split(".", 1)
+        cfg[stage] = {**cfg.get(stage, {}), option: value}
+    return cfg
+
+
+def check_overrides(cfg: Dict[str, Any], overrides: Dict[str, Any]):
+    """Raise for overrides that don't change the retrieval of cfg, the
+    component config they are applied to."""
+    for path in overrides:
+        stage, option = path.split(".", 1)
+        if stage not in SWEEP_OPTIONS:
+            raise ValueError(
+                f"Can't sweep {path}, stages are {list(SWEEP_OPTIONS)}"
+            )
+        options = SWEEP_OPTIONS[stage]
+        if options is not None and option not in options:
+            raise ValueError(f"Can't sweep {path}, it doesn't change retrieval")
+        if stage == "gen_query_engine" and "gen_retriever" in cfg:
+            # The query engine uses the retriever of gen_retriever
+            raise ValueError(
+                f"{path} has no effect with gen_retriever, "
+                f"sweep gen_retriever.{option} instead"
+            )
+
+
+def span_relevant_ids(
+    reference_nodes: List[BaseNode],
+    nodes: List[BaseNode],
+    min_overlap: float = 0.5,
+) -> Dict[str, List[str]]:
+    """Ids of the nodes covering each reference node, to score retrieval over
+    nodes chunked differently from the ones qa_pairs were generated from.
+
+    A node covers a reference node when both come from the same document and
+    their character spans overlap by at least min_overlap of the shorter one.
+    Nodes without spans cover the reference nodes with the same text.
+
+    Args:
+        reference_nodes (List[BaseNode]): Nodes the relevant ids refer to.
+        nodes (List[BaseNode]): Nodes retrieved from.
+        min_overlap (float, optional): Share of the shorter span to overlap.
+            Defaults to 0.5.
+
+    Returns:
+        Dict[str, List[str]]: Ids of nodes by reference node id.
+    """
+    spans, ids_by_text = {}, {}
+    for node in nodes:
+        ids_by_text.setdefault(node.get_content(), []).append(node.node_id)
+        if node.source_node is None or node.start_char_idx is None:
+            continue
+        spans.setdefault(node.source_node.hash, []).append(
+            (node.start_char_idx, node.end_char_idx, node.node_id)
+        )
+    spans = {
+        doc_hash: (
+            np.array([start for start, _, _ in doc_spans]),
+            np.array([end for _, end, _ in doc_spans]),
+            [node_id for _, _, node_id in doc_spans],
+        )
+        for doc_hash, doc_spans in spans.items()
+    }
+
+    relevant_ids = {}
+    for reference in reference_nodes:
+        doc_spans = (
+            spans.get(reference.source_node.hash)
+            if reference.source_node is not None
+            and reference.start_char_idx is not None
+            else None
+        )
+        if doc_spans is None:
+            relevant_ids[reference.node_id] = ids_by_text.get(
+                reference.get_content(), []
+            )
+            continue
+        starts, ends, node_ids = doc_spans
+        start, end = reference.start_char_idx, reference.end_char_idx
+        overlap = np.minimum(ends, end) - np.maximum(starts, start)
+        shorter = np.minimum(ends - starts, end - start)
+        covering = (overlap > 0) & (overlap >= min_overlap * shorter)
+        relevant_ids[reference.node_id] = [
+            node_ids[i] for i in np.flatnonzero(covering)
+        ]
+    return relevant_ids
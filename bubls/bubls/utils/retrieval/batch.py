@@ -0,0 +1,189 @@
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.indices.vector_store.retrievers import (
+    VectorIndexRetriever,
+)
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import (
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from bubls.utils.concurrency import amap_bounded
+from bubls.utils.embeddings.cache import CachedEmbedding
+from bubls.utils.vector_stores import filter_node_ids
+from bubls.utils.vector_stores.numpy_store import (
+    NumpyVectorStore,
+    normalize_rows,
+)
+from typing import Any, List, Optional
+import numpy as np
+import asyncio
+import nest_asyncio
+
+nest_asyncio.apply()
+
+
+def _embeds_queries_as_texts(embed_model: Any) -> bool:
+    """Whether the query embeddings of embed_model are its text embeddings,
+    e.g. for an OpenAIEmbedding with the same query and text engine."""
+    query_engine = getattr(embed_model, "_query_engine", None)
+    return query_engine is not None and query_engine == getattr(
+        embed_model, "_text_engine", None
+    )
+
+
+async def aembed_queries(
+    embed_model: Any, queries: List[str], max_concurrency: int = 8
+) -> List[List[float]]:
+    """Query embeddings of queries.
+
+    A CachedEmbedding looks all queries up at once and only embeds the
+    misses. Models embedding queries as texts embed embed_batch_size queries
+    per request with aget_text_embedding_batch. Other models are sent one
+    request per query, with up to max_concurrency in flight.
+
+    Args:
+        embed_model (Any): Embedding model, e.g. Settings.embed_model.
+        queries (List[str]): Query strings.
+        max_concurrency (int, optional): Requests in flight. Defaults to 8.
+
+    Returns:
+        List[List[float]]: Embedding of every query.
+    """
+    if isinstance(embed_model, CachedEmbedding):
+        return await embed_model.aget_query_embedding_batch(
+            queries,
+            lambda misses: aembed_queries(
+                embed_model.embed_model, misses, max_concurrency
+            ),
+        )
+    if _embeds_queries_as_texts(embed_model):
+        return await embed_model.aget_text_embedding_batch(queries)
+    embeddings, _ = await amap_bounded(
+        embed_model.aget_query_embedding,
+        queries,
+        max_concurrency=max_concurrency,
+        desc="Embedding queries",
+    )
+    return embeddings
+
+
+def _batch_store(
+    retriever: VectorIndexRetriever,
+) -> Optional[NumpyVectorStore]:
+    """NumpyVectorStore answering the queries of retriever with query_batch,
+    or None when retriever needs its own search, e.g. for hybrid modes."""
+    if (
+        retriever._doc_ids is not None
+        or retriever._vector_store_query_mode != VectorStoreQueryMode.DEFAULT
+    ):
+        return None
+    vector_store = retriever._vector_store
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store
+    if isinstance(vector_store, SimpleVectorStore):
+        # Same cosine similarities as SimpleVectorStore in default mode
+        embedding_dict = vector_store.data.embedding_dict
+        node_ids = retriever._node_ids
+        ids = list(embedding_dict) if node_ids is None else node_ids
+        ids = [node_id for node_id in ids if node_id in embedding_dict]
+        if retriever._filters is not None:
+            allowed = set(filter_node_ids(vector_store, retriever._filters))
+            ids = [node_id for node_id in ids if node_id in allowed]
+        if not ids:
+            return None
+        return NumpyVectorStore(
+            embeddings=normalize_rows([embedding_dict[i] for i in ids]),
+            ids=np.array(ids),
+        )
+    return None
+
+
+def _nodes_with_scores(
+    retriever: VectorIndexRetriever, results: List[VectorStoreQueryResult]
+) -> List[List[NodeWithScore]]:
+    """Nodes of the results of query_batch, reading every distinct node from
+    the docstore once for the whole batch."""
+    if retriever._vector_store.stores_text:
+        nodes = [result.nodes for result in results]
+    else:
+        nodes_dict = retriever._index.index_struct.nodes_dict
+        node_ids = list(
+            {nodes_dict[i]: None for result in results for i in result.ids}
+        )
+        nodes_by_id = dict(
+            zip(node_ids, retriever._docstore.get_nodes(node_ids))
+        )
+        nodes = [
+            [nodes_by_id[nodes_dict[i]] for i in result.ids]
+            for result in results
+        ]
+    return [
+        [
+            NodeWithScore(node=node, score=score)
+            for node, score in zip(result_nodes, result.similarities)
+        ]
+        for result_nodes, result in zip(nodes, results)
+    ]
+
+
+async def aretrieve_batch(
+    retriever: BaseRetriever, queries: List[str], max_concurrency: int = 8
+) -> List[List[NodeWithScore]]:
+    """Retrieve the nodes of many queries at once.
+
+    Queries of a vector retriever over a NumpyVectorStore or a
+    SimpleVectorStore are embedded with aembed_queries, then scored together
+    with the matrix products of NumpyVectorStore.query_batch, and nodes
+    returned by several queries are shared. Retrievers with their own
+    aretrieve_batch, e.g. HybridRetriever, use it. Other retrievers run
+    aretrieve with up to max_concurrency queries in flight.
+
+    Args:
+        retriever (BaseRetriever): Retriever, e.g. index.as_retriever().
+        queries (List[str]): Query strings.
+        max_concurrency (int, optional): Embedding or retrieval requests in
+            flight. Defaults to 8.
+
+    Returns:
+        List[List[NodeWithScore]]: Retrieved nodes of every query, as
+            retriever.retrieve returns them.
+    """
+    if hasattr(retriever, "aretrieve_batch"):
+        return await retriever.aretrieve_batch(queries, max_concurrency)
+    store = (
+        _batch_store(retriever)
+        if isinstance(retriever, VectorIndexRetriever)
+        else None
+    )
+    if store is None:
+        results, _ = await amap_bounded(
+            retriever.aretrieve,
+            queries,
+            max_concurrency=max_concurrency,
+            desc="Retrieving",
+        )
+        return results
+
+    embeddings = await aembed_queries(
+        retriever._embed_model, queries, max_concurrency
+    )
+    if store is retriever._vector_store:
+        node_ids, filters = retriever._node_ids, retriever._filters
+    else:
+        # Already restricted to node_ids and filters
+        node_ids, filters = None, None
+    results = store.query_batch(
+        embeddings,
+        retriever.similarity_top_k,
+        node_ids=node_ids,
+        filters=filters,
+    )
+    return _nodes_with_scores(retriever, results)
+
+
+def retrieve_batch(
+    retriever: BaseRetriever, queries: List[str], max_concurrency: int = 8
+) -> List[List[NodeWithScore]]:
+    """Synchronous aretrieve_batch."""
+    return asyncio.run(aretrieve_batch(retriever, queries, max_concurrency))
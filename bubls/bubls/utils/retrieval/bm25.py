@@ -0,0 +1,204 @@
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import BaseNode, MetadataMode
+from bubls.utils.indexing import indexed_node_ids, indexed_nodes
+from bubls.utils.vector_stores.numpy_store import top_k
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import json
+import os
+import re
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower case words and numbers of text."""
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """Inverted index scoring nodes with Okapi BM25.
+
+    Postings are stored as CSR arrays: the postings of term t are the rows
+    indptr[t]:indptr[t + 1] of doc_rows and weights. Weights are the BM25
+    contributions of the term to each node, computed once from the IDF and
+    the document lengths, so a query is a gather of its terms' postings and a
+    bincount.
+
+    Args:
+        terms (List[str]): Vocabulary, term ids are positions.
+        indptr (np.ndarray): Start of the postings of every term.
+        doc_rows (np.ndarray): Node row of every posting.
+        weights (np.ndarray): BM25 weight of every posting.
+        idf (np.ndarray): IDF of every term.
+        doc_lengths (np.ndarray): Tokens in every node.
+        ids (List[str]): Node id of every row.
+        k1 (float, optional): Term frequency saturation. Defaults to 1.5.
+        b (float, optional): Length normalization. Defaults to 0.75.
+    """
+
+    dir_name = "bm25"
+
+    def __init__(
+        self,
+        terms: List[str],
+        indptr: np.ndarray,
+        doc_rows: np.ndarray,
+        weights: np.ndarray,
+        idf: np.ndarray,
+        doc_lengths: np.ndarray,
+        ids: List[str],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_rows = doc_rows
+        self.weights = weights
+        self.idf = idf
+        self.doc_lengths = doc_lengths
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def from_nodes(
+        cls, nodes: List[BaseNode], k1: float = 1.5, b: float = 0.75
+    ) -> "BM25Index":
+        """Build the index over the text of nodes, without their metadata."""
+        term_ids: Dict[str, int] = {}
+        posting_terms, posting_rows, posting_tfs = [], [], []
+        doc_lengths = np.zeros(len(nodes), dtype=np.int32)
+        for row, node in enumerate(nodes):
+            tokens = tokenize(node.get_content(metadata_mode=MetadataMode.NONE))
+            doc_lengths[row] = len(tokens)
+            token_ids = [term_ids.setdefault(t, len(term_ids)) for t in tokens]
+            doc_terms, tfs = np.unique(token_ids, return_counts=True)
+            posting_terms.append(doc_terms)
+            posting_rows.append(np.full(len(doc_terms), row, dtype=np.int32))
+            posting_tfs.append(tfs)
+
+        posting_terms = np.concatenate(posting_terms or [[]]).astype(np.int64)
+        posting_rows = np.concatenate(posting_rows or [[]]).astype(np.int32)
+        posting_tfs = np.concatenate(posting_tfs or [[]]).astype(np.float32)
+        order = np.argsort(posting_terms, kind="stable")
+        posting_terms = posting_terms[order]
+        posting_rows = posting_rows[order]
+        posting_tfs = posting_tfs[order]
+
+        n_docs = len(nodes)
+        df = np.bincount(posting_terms, minlength=len(term_ids))
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_length = doc_lengths.mean() if n_docs else 0.0
+        norm = k1 * (
+            1 - b + b * doc_lengths[posting_rows] / max(avg_length, 1e-9)
+        )
+        weights = (
+            idf[posting_terms] * posting_tfs * (k1 + 1) / (posting_tfs + norm)
+        ).astype(np.float32)
+        indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        return cls(
+            terms=list(term_ids),
+            indptr=indptr,
+            doc_rows=posting_rows,
+            weights=weights,
+            idf=idf,
+            doc_lengths=doc_lengths,
+            ids=[node.node_id for node in nodes],
+            k1=k1,
+            b=b,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every node for query."""
+        query_terms = {
+            self.term_ids[t] for t in tokenize(query) if t in self.term_ids
+        }
+        if not query_terms:
+            return np.zeros(len(self.ids), dtype=np.float32)
+        postings = np.concatenate(
+            [np.arange(self.indptr[t], self.indptr[t + 1]) for t in query_terms]
+        )
+        return np.bincount(
+            self.doc_rows[postings],
+            weights=self.weights[postings],
+            minlength=len(self.ids),
+        ).astype(np.float32)
+
+    def query(
+        self, query: str, k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[List[str], np.ndarray]:
+        """Ids and scores of the k best matching nodes, skipping nodes sharing
+        no term with query and, when mask is given, the rows outside it."""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        rows = top_k(scores, k)
+        rows = rows[scores[rows] > 0]
+        return [self.ids[row] for row in rows], scores[rows]
+
+    def persist(self, persist_dir: str):
+        os.makedirs(persist_dir, exist_ok=True)
+        arrays = {
+            "indptr": self.indptr,
+            "doc_rows": self.doc_rows,
+            "weights": self.weights,
+            "idf": self.idf,
+            "doc_lengths": self.doc_lengths,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(persist_dir, f"{name}.npy"), array)
+        with open(os.path.join(persist_dir, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "terms": self.terms,
+                    "ids": self.ids,
+                },
+                f,
+            )
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "BM25Index":
+        with open(os.path.join(persist_dir, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(persist_dir, f"{name}.npy"))
+            for name in ["indptr", "doc_rows", "weights", "idf", "doc_lengths"]
+        }
+        return cls(**arrays, **meta)
+
+    @classmethod
+    def load_or_build(
+        cls,
+        persist_dir: str,
+        index: VectorStoreIndex,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        """Load the BM25 index persisted in persist_dir, or build it over the
+        nodes of index and persist it when it is missing or was built over
+        other nodes or parameters.
+
+        Args:
+            persist_dir (str): Where the BM25 index is persisted.
+            index (VectorStoreIndex): Index whose nodes are searched.
+            k1 (float, optional): Term frequency saturation. Defaults to 1.5.
+            b (float, optional): Length normalization. Defaults to 0.75.
+        """
+        bm25: Optional[BM25Index] = None
+        if os.path.exists(os.path.join(persist_dir, "meta.json")):
+            bm25 = cls.from_persist_dir(persist_dir)
+            if (
+                (bm25.k1, bm25.b) != (k1, b)
+                or set(bm25.ids) != set(indexed_node_ids(index))
+            ):
+                bm25 = None
+        if bm25 is None:
+            print(f"Building BM25 index in {persist_dir}")
+            bm25 = cls.from_nodes(indexed_nodes(index), k1=k1, b=b)
+            bm25.persist(persist_dir)
+        return bm25
@@ -0,0 +1,189 @@
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+from bubls.utils.retrieval.batch import aretrieve_batch
+from bubls.utils.retrieval.bm25 import BM25Index
+from bubls.utils.vector_stores import filter_node_ids
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+FUSIONS = ["alpha", "rrf"]
+
+
+def _min_max(scores: Dict[str, float]) -> Dict[str, float]:
+    if not scores:
+        return {}
+    values = np.array(list(scores.values()))
+    low, span = values.min(), values.max() - values.min()
+    if span == 0:
+        return {node_id: 1.0 for node_id in scores}
+    return {
+        node_id: float((score - low) / span)
+        for node_id, score in scores.items()
+    }
+
+
+def fuse_weighted_scores(
+    weighted_scores: List[Tuple[float, Dict[str, float]]],
+    fusion: str = "alpha",
+    rrf_k: int = 60,
+) -> Dict[str, float]:
+    """Fuse the scores of the candidates of several retrievers, best first.
+
+    Args:
+        weighted_scores (List[Tuple[float, Dict[str, float]]]): Weight of
+            every retriever and the scores of its candidates, by node id.
+        fusion (str, optional): "alpha" for the weighted sum of the min-max
+            normalized scores of every retriever, "rrf" for reciprocal rank
+            fusion, which ignores the weights. Defaults to "alpha".
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion.
+            Defaults to 60.
+    """
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSIONS}")
+    fused = {}
+    for weight, scores in weighted_scores:
+        if fusion == "alpha":
+            for node_id, score in _min_max(scores).items():
+                fused[node_id] = fused.get(node_id, 0.0) + weight * score
+        else:
+            ranked = sorted(scores, key=scores.get, reverse=True)
+            for rank, node_id in enumerate(ranked, start=1):
+                fused[node_id] = fused.get(node_id, 0.0) + 1 / (rrf_k + rank)
+    return dict(sorted(fused.items(), key=lambda item: -item[1]))
+
+
+def fuse_scores(
+    vector_scores: Dict[str, float],
+    bm25_scores: Dict[str, float],
+    fusion: str = "alpha",
+    alpha: float = 0.5,
+    rrf_k: int = 60,
+) -> Dict[str, float]:
+    """Fuse the scores of the candidates of both retrievers, best first.
+
+    Args:
+        vector_scores (Dict[str, float]): Similarity of the vector candidates,
+            by node id.
+        bm25_scores (Dict[str, float]): BM25 score of the keyword candidates,
+            by node id.
+        fusion (str, optional): "alpha" for alpha * vector + (1 - alpha) * bm25
+            on min-max normalized scores, "rrf" for reciprocal rank fusion.
+            Defaults to "alpha".
+        alpha (float, optional): Weight of the vector scores, 1 is vector
+            search only and 0 keyword search only. Defaults to 0.5.
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion.
+            Defaults to 60.
+    """
+    return fuse_weighted_scores(
+        [(alpha, vector_scores), (1 - alpha, bm25_scores)], fusion, rrf_k
+    )
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing the candidates of a vector retriever with the best
+    BM25 matches of a keyword index over the same nodes.
+
+    Keyword scoring runs locally on the precomputed postings of the BM25
+    index, so it adds no embedding or LLM call to the vector retrieval.
+
+    Args:
+        vector_retriever (BaseRetriever): Retriever of index, returning the
+            vector candidates, e.g. index.as_retriever(similarity_top_k=12).
+        bm25 (BM25Index): Keyword index over the nodes of index.
+        index (VectorStoreIndex): Index the nodes only found by BM25 are read
+            from.
+        similarity_top_k (int, optional): Nodes returned. Defaults to 3.
+        candidate_k (int, optional): BM25 candidates fused. Defaults to 12.
+        fusion (str, optional): "alpha" or "rrf", see fuse_scores.
+            Defaults to "alpha".
+        alpha (float, optional): Weight of the vector scores. Defaults to 0.5.
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion.
+            Defaults to 60.
+        filters (Optional[MetadataFilters], optional): Metadata filters of
+            vector_retriever, also applied to the BM25 candidates.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        vector_retriever: BaseRetriever,
+        bm25: BM25Index,
+        index: VectorStoreIndex,
+        similarity_top_k: int = 3,
+        candidate_k: int = 12,
+        fusion: str = "alpha",
+        alpha: float = 0.5,
+        rrf_k: int = 60,
+        filters: Optional[MetadataFilters] = None,
+    ):
+        super().__init__(callback_manager=vector_retriever.callback_manager)
+        self.vector_retriever = vector_retriever
+        self.bm25 = bm25
+        self.index = index
+        self.similarity_top_k = similarity_top_k
+        self.candidate_k = candidate_k
+        self.fusion = fusion
+        self.alpha = alpha
+        self.rrf_k = rrf_k
+        self._bm25_mask = None
+        if filters is not None:
+            self._bm25_mask = np.isin(
+                bm25.ids, filter_node_ids(index.vector_store, filters)
+            )
+
+    def _get_nodes(self, node_ids: List[str]):
+        if self.index.vector_store.stores_text:
+            return self.index.vector_store.get_nodes(node_ids)
+        return self.index.docstore.get_nodes(node_ids)
+
+    def _fuse(
+        self, query_bundle: QueryBundle, vector_nodes: List[NodeWithScore]
+    ) -> List[NodeWithScore]:
+        bm25_ids, bm25_scores = self.bm25.query(
+            query_bundle.query_str, self.candidate_k, self._bm25_mask
+        )
+        nodes = {n.node.node_id: n.node for n in vector_nodes}
+        fused = fuse_scores(
+            {n.node.node_id: n.score or 0.0 for n in vector_nodes},
+            dict(zip(bm25_ids, bm25_scores.tolist())),
+            fusion=self.fusion,
+            alpha=self.alpha,
+            rrf_k=self.rrf_k,
+        )
+        best_ids = list(fused)[: self.similarity_top_k]
+        missing_ids = [node_id for node_id in best_ids if node_id not in nodes]
+        if missing_ids:
+            nodes.update(
+                (node.node_id, node) for node in self._get_nodes(missing_ids)
+            )
+        return [
+            NodeWithScore(node=nodes[node_id], score=fused[node_id])
+            for node_id in best_ids
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._fuse(
+            query_bundle, self.vector_retriever.retrieve(query_bundle)
+        )
+
+    async def _aretrieve(
+        self, query_bundle: QueryBundle
+    ) -> List[NodeWithScore]:
+        return self._fuse(
+            query_bundle, await self.vector_retriever.aretrieve(query_bundle)
+        )
+
+    async def aretrieve_batch(
+        self, queries: List[str], max_concurrency: int = 8
+    ) -> List[List[NodeWithScore]]:
+        """Fused nodes of every query, retrieving the vector candidates of
+        all queries with aretrieve_batch."""
+        vector_nodes = await aretrieve_batch(
+            self.vector_retriever, queries, max_concurrency
+        )
+        return [
+            self._fuse(QueryBundle(query), nodes)
+            for query, nodes in zip(queries, vector_nodes)
+        ]
@@ -0,0 +1,56 @@
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+
+def latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    """Summarize latencies given in seconds.
+
+    Returns:
+        Dict[str, float]: count, mean, p50, p90, p99 and max latency.
+    """
+    if len(latencies) == 0:
+        return {"count": 0}
+    latencies = np.asarray(latencies, dtype=float)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "count": len(latencies),
+        "mean": float(latencies.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": float(latencies.max()),
+    }
+
+
+def format_latency_summary(summary: Dict[str, float]) -> str:
+    return ", ".join(
+        f"{k}={v * 1000:.0f}ms" if k != "count" else f"{k}={v}"
+        for k, v in summary.items()
+    )
+
+
+def latency_histogram(
+    latencies: Sequence[float], n_bins: int = 10
+) -> List[Tuple[float, float, int]]:
+    """Histogram of latencies with log spaced bins, as (low, high, count)."""
+    latencies = np.asarray(latencies, dtype=float)
+    if len(latencies) == 0:
+        return []
+    low, high = max(latencies.min(), 1e-6), max(latencies.max(), 1e-6)
+    edges = np.geomspace(low, high * (1 + 1e-9), n_bins + 1)
+    counts, _ = np.histogram(np.clip(latencies, low, None), bins=edges)
+    return [
+        (float(edges[i]), float(edges[i + 1]), int(count))
+        for i, count in enumerate(counts)
+    ]
+
+
+def format_latency_histogram(
+    histogram: List[Tuple[float, float, int]], width: int = 40
+) -> str:
+    max_count = max((count for _, _, count in histogram), default=0) or 1
+    return "\n".join(
+        f"{low * 1000:8.1f}-{high * 1000:8.1f}ms "
+        f"{'#' * round(width * count / max_count):<{width}} {count}"
+        for low, high, count in histogram
+    )
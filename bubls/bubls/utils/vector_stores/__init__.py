@@ -0,0 +1,90 @@
+from llama_index.core.vector_stores.simple import (
+    SimpleVectorStore,
+    _build_metadata_filter_fn,
+)
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+)
+from bubls.utils.vector_stores.numpy_store import NumpyVectorStore
+from bubls.utils.vector_stores.quantized import Int8VectorStore, PQVectorStore
+from bubls.utils.vector_stores.ann import HNSWVectorStore, IVFVectorStore
+from bubls.utils.vector_stores.snapshot import SnapshotVectorStore
+from typing import Any, Dict, List, Optional, Union
+import json
+import os
+
+# Vector stores that can be selected with the vector_store option of gen_index
+VECTOR_STORES = {
+    "numpy": NumpyVectorStore,
+    "int8": Int8VectorStore,
+    "pq": PQVectorStore,
+    "ivf": IVFVectorStore,
+    "hnsw": HNSWVectorStore,
+    "snapshot": SnapshotVectorStore,
+}
+
+
+def make_vector_store(
+    spec: Optional[Union[str, Dict[str, Any]]]
+) -> Optional[BasePydanticVectorStore]:
+    """Create an empty vector store from a config value.
+
+    Args:
+        spec (Optional[Union[str, Dict[str, Any]]]): Name of the store in
+            VECTOR_STORES, or a dict with its name under "type" and the
+            constructor arguments. None keeps llama_index's default store.
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        spec = {"type": spec}
+    kwargs = {k: v for k, v in spec.items() if k != "type"}
+    if spec["type"] not in VECTOR_STORES:
+        raise ValueError(
+            f"Unknown vector store {spec['type']}, "
+            f"expected one of {list(VECTOR_STORES)}"
+        )
+    return VECTOR_STORES[spec["type"]](**kwargs)
+
+
+def load_vector_store(
+    persist_dir: str,
+) -> Optional[BasePydanticVectorStore]:
+    """Load the vector store persisted in the index persist_dir, or None when
+    the index uses llama_index's default store."""
+    meta_path = os.path.join(
+        NumpyVectorStore.store_dir(persist_dir), "meta.json"
+    )
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        class_name = json.load(f)["class_name"]
+    for store_cls in VECTOR_STORES.values():
+        if store_cls.class_name() == class_name:
+            return store_cls.from_persist_dir(persist_dir)
+    raise ValueError(f"Unknown vector store {class_name} in {persist_dir}")
+
+
+def filter_node_ids(
+    vector_store: BasePydanticVectorStore, filters: MetadataFilters
+) -> List[str]:
+    """Ids of the nodes of vector_store whose metadata matches filters, from
+    the metadata index of a NumpyVectorStore or by checking every node of a
+    SimpleVectorStore."""
+    if isinstance(vector_store, NumpyVectorStore):
+        rows = vector_store.filter_rows(filters)
+        return [str(node_id) for node_id in vector_store.ids[rows]]
+    if isinstance(vector_store, SimpleVectorStore):
+        metadata_dict = vector_store.data.metadata_dict
+        filter_fn = _build_metadata_filter_fn(
+            lambda node_id: metadata_dict.get(node_id, {}), filters
+        )
+        return [
+            node_id
+            for node_id in vector_store.data.embedding_dict
+            if filter_fn(node_id)
+        ]
+    raise NotImplementedError(
+        f"Can't filter the nodes of {vector_store.class_name()}"
+    )
@@ -0,0 +1,313 @@
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from bubls.utils.vector_stores.numpy_store import NumpyVectorStore, top_k
+from bubls.utils.vector_stores.quantized import assign, kmeans
+from typing import Any, ClassVar, Dict, Optional
+import numpy as np
+import fsspec
+import os
+
+
+class IVFVectorStore(NumpyVectorStore):
+    """NumpyVectorStore with an inverted file index: rows are grouped by their
+    nearest k-means centroid and a query only scores the rows of the nprobe
+    lists whose centroids are the most similar to it.
+
+    Centroids are learnt on up to train_size rows the first time rows are
+    added, and learnt again while the store grows to 4x the rows they were
+    learnt on, so an index filled in small batches still gets enough lists.
+
+    Args:
+        n_lists (Optional[int], optional): Number of lists. Defaults to None
+            (4 * sqrt(rows) when the centroids are learnt).
+        nprobe (int, optional): Lists scored per query. Can be overridden per
+            query through the vector_store_kwargs of gen_retriever.
+            Defaults to 8.
+        train_size (int, optional): Rows used to learn the centroids.
+            Defaults to 10_000.
+    """
+
+    n_lists: Optional[int] = Field(default=None, description="Number of lists.")
+    nprobe: int = Field(default=8, description="Lists scored per query.")
+    train_size: int = Field(
+        default=10_000, description="Rows used to learn the centroids."
+    )
+
+    exact: ClassVar[bool] = False
+
+    _centroids: Optional[np.ndarray] = PrivateAttr(default=None)
+    _trained_on: int = PrivateAttr(default=0)
+    _lists: Optional[np.ndarray] = PrivateAttr(default=None)
+    _postings: Optional[Any] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "IVFVectorStore"
+
+    def _train(self):
+        rng = np.random.default_rng(0)
+        n_rows = len(self._embeddings)
+        sample = np.sort(rng.permutation(n_rows)[: self.train_size])
+        n_lists = self.n_lists or int(4 * np.sqrt(n_rows))
+        self._centroids = kmeans(
+            np.asarray(self._embeddings[sample]), max(n_lists, 1), n_iter=10
+        )
+        self._trained_on = len(sample)
+        self._lists = None
+
+    def _assign(self, start: int):
+        """Assign the rows from start on to their list."""
+        new_lists = assign(
+            np.asarray(self._embeddings[start:]), self._centroids
+        ).astype(np.int32)
+        self._lists = (
+            np.concatenate([self._lists[:start], new_lists])
+            if start
+            else new_lists
+        )
+        self._postings = None
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        n_assigned = len(self._ids)
+        super()._consolidate()
+        if self._centroids is None or (
+            self._trained_on < self.train_size
+            and len(self._ids) > 4 * self._trained_on
+        ):
+            self._train()
+            n_assigned = 0
+        self._assign(n_assigned)
+
+    def _compact(self):
+        alive = self.alive
+        if self._lists is not None and not alive.all():
+            self._lists = self._lists[alive]
+            self._postings = None
+        super()._compact()
+
+    def clear(self) -> None:
+        super().clear()
+        self._centroids = None
+        self._trained_on = 0
+        self._lists = None
+        self._postings = None
+
+    def _list_rows(self):
+        """Rows of every list as (rows sorted by list, offsets of the lists)."""
+        if self._postings is None:
+            order = np.argsort(self._lists, kind="stable")
+            counts = np.bincount(self._lists, minlength=len(self._centroids))
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            self._postings = (order, offsets)
+        return self._postings
+
+    def _score(
+        self,
+        query_embedding: np.ndarray,
+        mask: Optional[np.ndarray],
+        k: int,
+        nprobe: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        order, offsets = self._list_rows()
+        probed = top_k(self._centroids @ query_embedding, nprobe or self.nprobe)
+        rows = np.sort(
+            np.concatenate(
+                [order[offsets[l] : offsets[l + 1]] for l in probed]
+            )
+        )
+        if mask is not None:
+            # Restrictions to few rows, e.g. filters, are searched exactly
+            candidates = np.flatnonzero(mask)
+            if len(candidates) <= len(rows):
+                rows = candidates
+            else:
+                rows = rows[mask[rows]]
+        return self._score_rows(query_embedding, rows, k)
+
+    def _config(self) -> Dict[str, Any]:
+        return {
+            **super()._config(),
+            "n_lists": self.n_lists,
+            "nprobe": self.nprobe,
+            "train_size": self.train_size,
+        }
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        empty = self._centroids is None
+        arrays["centroids"] = (
+            np.empty((0, 0), dtype=np.float32) if empty else self._centroids
+        )
+        arrays["lists"] = (
+            np.empty(0, dtype=np.int32) if empty else self._lists
+        )
+        arrays["trained_on"] = np.array(self._trained_on)
+        return arrays
+
+    def _load_arrays(self, store_dir: str):
+        self._centroids = np.load(os.path.join(store_dir, "centroids.npy"))
+        self._lists = np.load(os.path.join(store_dir, "lists.npy"))
+        self._trained_on = int(
+            np.load(os.path.join(store_dir, "trained_on.npy"))
+        )
+        if not self._centroids.size:
+            self._centroids, self._lists = None, None
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError:
+        raise ImportError(
+            "hnswlib is required by HNSWVectorStore: pip install hnswlib"
+        )
+    return hnswlib
+
+
+class HNSWVectorStore(NumpyVectorStore):
+    """NumpyVectorStore searched through an HNSW graph built with hnswlib.
+
+    Graph labels are row positions: deleted rows are marked as deleted in the
+    graph and the graph is built again when persist drops them.
+
+    Args:
+        M (int, optional): Links per node of the graph. Defaults to 16.
+        ef_construction (int, optional): Candidates explored while inserting.
+            Defaults to 200.
+        ef_search (int, optional): Candidates explored per query, at least k.
+            Can be overridden per query through the vector_store_kwargs of
+            gen_retriever. Defaults to 64.
+    """
+
+    M: int = Field(default=16, description="Links per node of the graph.")
+    ef_construction: int = Field(
+        default=200, description="Candidates explored while inserting."
+    )
+    ef_search: int = Field(
+        default=64, description="Candidates explored per query."
+    )
+
+    graph_file_name: ClassVar[str] = "hnsw.bin"
+    exact: ClassVar[bool] = False
+
+    _graph: Optional[Any] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HNSWVectorStore"
+
+    def _new_graph(self, dim: int, max_elements: int):
+        graph = _import_hnswlib().Index(space="ip", dim=dim)
+        graph.init_index(
+            max_elements=max_elements,
+            M=self.M,
+            ef_construction=self.ef_construction,
+        )
+        return graph
+
+    def _add_to_graph(self, start: int):
+        n_rows, dim = self._embeddings.shape
+        if self._graph is None:
+            self._graph = self._new_graph(dim, max(2 * n_rows, 1024))
+        elif n_rows > self._graph.get_max_elements():
+            self._graph.resize_index(2 * n_rows)
+        self._graph.add_items(
+            np.asarray(self._embeddings[start:]), np.arange(start, n_rows)
+        )
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        n_added = len(self._ids)
+        super()._consolidate()
+        self._add_to_graph(n_added)
+
+    def _delete_rows(self, rows):
+        alive = self.alive
+        for row in np.asarray(rows, dtype=np.int64):
+            if alive[row] and self._graph is not None:
+                self._graph.mark_deleted(int(row))
+        super()._delete_rows(rows)
+
+    def _compact(self):
+        rebuild = not self.alive.all()
+        super()._compact()
+        if rebuild:
+            self._graph = None
+            if len(self._ids):
+                self._add_to_graph(0)
+
+    def clear(self) -> None:
+        super().clear()
+        self._graph = None
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the graph, which holds its own vectors."""
+        self._consolidate()
+        if self._graph is None:
+            return 0
+        n_rows, dim = self._embeddings.shape
+        return n_rows * (4 * dim + 2 * 4 * self.M)
+
+    def _score(
+        self,
+        query_embedding: np.ndarray,
+        mask: Optional[np.ndarray],
+        k: int,
+        ef_search: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        n_candidates = int(self.alive.sum() if mask is None else mask.sum())
+        k = min(k, n_candidates)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ef = max(ef_search or self.ef_search, k)
+        if mask is not None and n_candidates <= ef:
+            # Fewer rows than the graph would explore, e.g. filters
+            return self._score_rows(query_embedding, np.flatnonzero(mask), k)
+        # Deleted rows are already skipped by the graph
+        row_filter = None
+        if mask is not None and n_candidates < self.alive.sum():
+
+            def row_filter(row: int) -> bool:
+                return bool(mask[row])
+
+        self._graph.set_ef(ef)
+        rows, distances = self._graph.knn_query(
+            query_embedding, k=k, filter=row_filter
+        )
+        return rows[0].astype(np.int64), 1 - distances[0]
+
+    def _config(self) -> Dict[str, Any]:
+        return {
+            **super()._config(),
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+        }
+
+    def _load_arrays(self, store_dir: str):
+        graph_path = os.path.join(store_dir, self.graph_file_name)
+        if not os.path.exists(graph_path):
+            return
+        n_rows, dim = self._embeddings.shape
+        self._graph = _import_hnswlib().Index(space="ip", dim=dim)
+        self._graph.load_index(graph_path, max_elements=max(2 * n_rows, 1024))
+
+    def persist(
+        self,
+        persist_path: str,
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        self._consolidate()
+        dirty = self._dirty
+        super().persist(persist_path, fs)
+        if dirty and self._graph is not None:
+            self._graph.save_index(
+                os.path.join(
+                    self.store_dir(os.path.dirname(persist_path)),
+                    self.graph_file_name,
+                )
+            )
@@ -0,0 +1,223 @@
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
+
+# Metadata of SimpleDirectoryReader documents worth filtering on
+DEFAULT_METADATA_FIELDS = ["file_name", "page_label"]
+
+
+def make_metadata_filters(
+    spec: Optional[Union[MetadataFilters, Dict[str, Any]]]
+) -> Optional[MetadataFilters]:
+    """MetadataFilters from a config value.
+
+    Args:
+        spec (Optional[Union[MetadataFilters, Dict[str, Any]]]): Filters, or a
+            dict of required values by field, where a list means any of its
+            values, e.g. {"file_name": ["a.pdf", "b.pdf"], "page_label": "3"}.
+    """
+    if spec is None or isinstance(spec, MetadataFilters):
+        return spec
+    return MetadataFilters(
+        filters=[
+            MetadataFilter(
+                key=key,
+                value=value,
+                operator=FilterOperator.IN
+                if isinstance(value, list)
+                else FilterOperator.EQ,
+            )
+            for key, value in spec.items()
+        ]
+    )
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compare(value: str, target: Any, operator: FilterOperator) -> bool:
+    """Order of metadata value and filter target, as numbers when both are."""
+    a, b = _number(value), _number(target)
+    if a is None or b is None:
+        a, b = value, str(target)
+    if operator == FilterOperator.GT:
+        return a > b
+    if operator == FilterOperator.GTE:
+        return a >= b
+    if operator == FilterOperator.LT:
+        return a < b
+    return a <= b
+
+
+def _matches(value: str, metadata_filter: MetadataFilter) -> bool:
+    operator, target = metadata_filter.operator, metadata_filter.value
+    if operator == FilterOperator.EQ:
+        return value == str(target)
+    if operator == FilterOperator.NE:
+        return value != str(target)
+    if operator == FilterOperator.IN:
+        return value in {str(t) for t in target}
+    if operator == FilterOperator.NIN:
+        return value not in {str(t) for t in target}
+    if operator == FilterOperator.TEXT_MATCH:
+        return str(target) in value
+    if operator in [
+        FilterOperator.GT,
+        FilterOperator.GTE,
+        FilterOperator.LT,
+        FilterOperator.LTE,
+    ]:
+        return _compare(value, target, operator)
+    raise ValueError(f"Unsupported filter operator {operator}")
+
+
+class MetadataIndex:
+    """Posting lists of the values of some metadata fields, by row.
+
+    Every field keeps the code of the value of each row (-1 when missing) and
+    its rows sorted by code, with the offsets of every code, so the rows
+    matching a filter are gathered without scanning the metadata. They are
+    sorted by the first filter on the field after rows change, so adding rows
+    in many small batches doesn't sort them every time. Values are compared
+    as strings, or as numbers for range operators. Rows missing a field never
+    match a filter on it.
+
+    Args:
+        fields (List[str]): Metadata keys indexed.
+        n_rows (int, optional): Rows already in the store, which have no
+            values. Defaults to 0.
+    """
+
+    def __init__(self, fields: List[str], n_rows: int = 0):
+        self.fields = list(fields)
+        self.n_rows = n_rows
+        self.values = {field: [] for field in self.fields}
+        self.codes = {
+            field: np.full(n_rows, -1, dtype=np.int32) for field in self.fields
+        }
+        self._code_by_value = {field: {} for field in self.fields}
+        self._postings = {}
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def _posting_lists(self, field: str):
+        """Rows sorted by their code of field and the offsets of every code."""
+        if field not in self._postings:
+            codes = self.codes[field]
+            order = np.argsort(codes, kind="stable")
+            # Bucket 0 holds the rows missing the field
+            counts = np.bincount(
+                codes + 1, minlength=len(self.values[field]) + 1
+            )
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            self._postings[field] = (order, offsets)
+        return self._postings[field]
+
+    def add(self, metadatas: List[Dict[str, Any]]):
+        """Append rows with metadatas."""
+        self.n_rows += len(metadatas)
+        for field in self.fields:
+            code_by_value = self._code_by_value[field]
+            new_codes = np.full(len(metadatas), -1, dtype=np.int32)
+            for i, metadata in enumerate(metadatas):
+                if metadata.get(field) is None:
+                    continue
+                value = str(metadata[field])
+                if value not in code_by_value:
+                    code_by_value[value] = len(self.values[field])
+                    self.values[field].append(value)
+                new_codes[i] = code_by_value[value]
+            self.codes[field] = np.concatenate([self.codes[field], new_codes])
+        self._postings = {}
+
+    def keep(self, rows_mask: np.ndarray):
+        """Drop the rows outside rows_mask."""
+        self.n_rows = int(rows_mask.sum())
+        for field in self.fields:
+            self.codes[field] = self.codes[field][rows_mask]
+        self._postings = {}
+
+    def _filter_rows(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        field = metadata_filter.key
+        if field not in self.codes:
+            raise ValueError(
+                f"Metadata field {field} is not indexed, add it to the "
+                f"metadata_fields of the vector store: {self.fields}"
+            )
+        order, offsets = self._posting_lists(field)
+        matching = [
+            code
+            for code, value in enumerate(self.values[field])
+            if _matches(value, metadata_filter)
+        ]
+        if not matching:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(
+            np.concatenate(
+                [
+                    order[offsets[code + 1] : offsets[code + 2]]
+                    for code in matching
+                ]
+            )
+        )
+
+    def rows(self, filters: MetadataFilters) -> np.ndarray:
+        """Sorted rows matching filters."""
+        row_sets = [
+            self.rows(f)
+            if isinstance(f, MetadataFilters)
+            else self._filter_rows(f)
+            for f in filters.filters
+        ]
+        if not row_sets:
+            return np.arange(len(self))
+        rows = row_sets[0]
+        for other in row_sets[1:]:
+            if filters.condition == FilterCondition.OR:
+                rows = np.union1d(rows, other)
+            else:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    def mask(self, filters: MetadataFilters) -> np.ndarray:
+        """Rows matching filters as a boolean mask."""
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.rows(filters)] = True
+        return mask
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays to persist, see from_arrays."""
+        arrays = {}
+        for i, field in enumerate(self.fields):
+            arrays[f"metadata_{i}_codes"] = self.codes[field]
+            arrays[f"metadata_{i}_values"] = np.array(
+                self.values[field], dtype=str
+            )
+        return arrays
+
+    @classmethod
+    def from_arrays(
+        cls, fields: List[str], arrays: Dict[str, np.ndarray], n_rows: int
+    ) -> "MetadataIndex":
+        """Index persisted with arrays, fields without arrays are empty."""
+        metadata_index = cls(fields, n_rows)
+        for i, field in enumerate(fields):
+            if f"metadata_{i}_codes" not in arrays:
+                continue
+            values = [str(v) for v in arrays[f"metadata_{i}_values"]]
+            metadata_index.values[field] = values
+            metadata_index._code_by_value[field] = {
+                value: code for code, value in enumerate(values)
+            }
+            metadata_index.codes[field] = arrays[f"metadata_{i}_codes"]
+        return metadata_index
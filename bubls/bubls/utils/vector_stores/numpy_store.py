@@ -0,0 +1,523 @@
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from bubls.utils.vector_stores.metadata_index import (
+    DEFAULT_METADATA_FIELDS,
+    MetadataIndex,
+)
+from typing import Any, ClassVar, Dict, List, Optional
+import numpy as np
+import fsspec
+import json
+import os
+
+# Scores held in memory per block of queries in query_batch
+_BATCH_BLOCK_VALUES = 1 << 24
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2 normalize the rows of matrix as float32, leaving zero rows as is."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, highest first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def batch_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores of every row, highest first."""
+    n_rows, n_columns = scores.shape
+    k = min(k, n_columns)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    if k < n_columns:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n_columns), scores.shape)
+    order = np.argsort(
+        -np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable"
+    )
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def _and(mask: Optional[np.ndarray], other: np.ndarray) -> np.ndarray:
+    return other if mask is None else mask & other
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """Local vector store keeping L2 normalized embeddings in a contiguous
+    float32 matrix, with node ids and document ids in side arrays.
+
+    A persisted store is memory-mapped when loaded, so loading doesn't depend
+    on the number of vectors. A query is one matrix-vector product followed by
+    argpartition and scores are cosine similarities, as in the default mode of
+    SimpleVectorStore. Deleted rows are masked and dropped on the next persist.
+
+    Queries can be filtered on the metadata_fields of the nodes, which are
+    indexed as posting lists when nodes are added. Filtered queries only
+    score the rows matching the filters.
+
+    Args:
+        embeddings (Optional[np.ndarray], optional): Normalized (n, dim) matrix.
+        ids (Optional[np.ndarray], optional): Node id of every row.
+        ref_doc_ids (Optional[np.ndarray], optional): Document id of every row.
+        metadata_fields (List[str], optional): Metadata keys that can be
+            filtered on. Defaults to DEFAULT_METADATA_FIELDS.
+    """
+
+    stores_text: bool = False
+    metadata_fields: List[str] = Field(
+        default_factory=lambda: list(DEFAULT_METADATA_FIELDS),
+        description="Metadata keys that can be filtered on.",
+    )
+
+    dir_name: ClassVar[str] = "numpy_vector_store"
+    # Whether _score is exact search, so query_batch can score many queries
+    # with one matrix product
+    exact: ClassVar[bool] = True
+
+    _embeddings: Optional[np.ndarray] = PrivateAttr(default=None)
+    _ids: np.ndarray = PrivateAttr()
+    _ref_doc_ids: np.ndarray = PrivateAttr()
+    _alive: Optional[np.ndarray] = PrivateAttr(default=None)
+    _pending: List[Any] = PrivateAttr(default_factory=list)
+    _row_by_id: Optional[Dict[str, int]] = PrivateAttr(default=None)
+    _dirty: bool = PrivateAttr(default=True)
+    _metadata: Optional[MetadataIndex] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        embeddings: Optional[np.ndarray] = None,
+        ids: Optional[np.ndarray] = None,
+        ref_doc_ids: Optional[np.ndarray] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self._embeddings = embeddings
+        self._ids = ids if ids is not None else np.empty(0, dtype=str)
+        self._ref_doc_ids = (
+            ref_doc_ids if ref_doc_ids is not None else np.empty(0, dtype=str)
+        )
+        self._alive = None
+        self._pending = []
+        self._row_by_id = None
+        self._dirty = True
+        self._metadata = MetadataIndex(self.metadata_fields, len(self._ids))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @classmethod
+    def store_dir(cls, persist_dir: str) -> str:
+        return os.path.join(persist_dir, cls.dir_name)
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(
+            os.path.join(cls.store_dir(persist_dir), "meta.json")
+        )
+
+    @classmethod
+    def from_persist_dir(
+        cls, persist_dir: str, mmap: bool = True
+    ) -> "NumpyVectorStore":
+        """Load a store persisted in persist_dir.
+
+        Args:
+            persist_dir (str): Persist dir of the index.
+            mmap (bool, optional): Memory-map the embeddings instead of reading
+                them in memory. Defaults to True.
+        """
+        store_dir = cls.store_dir(persist_dir)
+        with open(os.path.join(store_dir, "meta.json")) as f:
+            meta = json.load(f)
+        store = cls(
+            embeddings=np.load(
+                os.path.join(store_dir, "embeddings.npy"),
+                mmap_mode="r" if mmap else None,
+            ),
+            ids=np.load(os.path.join(store_dir, "ids.npy")),
+            ref_doc_ids=np.load(os.path.join(store_dir, "ref_doc_ids.npy")),
+            **meta.get("config", {}),
+        )
+        store._metadata = MetadataIndex.from_arrays(
+            store.metadata_fields,
+            {
+                name: np.load(os.path.join(store_dir, f"{name}.npy"))
+                for name in MetadataIndex(store.metadata_fields).arrays()
+                if os.path.exists(os.path.join(store_dir, f"{name}.npy"))
+            },
+            len(store._ids),
+        )
+        store._load_arrays(store_dir)
+        store._dirty = False
+        return store
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Normalized embeddings, deleted rows included."""
+        self._consolidate()
+        return self._embeddings
+
+    @property
+    def ids(self) -> np.ndarray:
+        self._consolidate()
+        return self._ids
+
+    @property
+    def alive(self) -> np.ndarray:
+        """Mask of the rows that weren't deleted."""
+        self._consolidate()
+        if self._alive is None:
+            self._alive = np.ones(len(self._ids), dtype=bool)
+        return self._alive
+
+    def memory_bytes(self) -> int:
+        """Bytes of vectors scanned by every query, which stay in RAM when the
+        store is queried often."""
+        self._consolidate()
+        return 0 if self._embeddings is None else self._embeddings.nbytes
+
+    def _consolidate(self):
+        """Append the rows added since the last query to the matrix."""
+        if not self._pending:
+            return
+        blocks = [matrix for matrix, _, _, _ in self._pending]
+        if self._embeddings is not None and len(self._embeddings):
+            blocks.insert(0, self._embeddings)
+        self._embeddings = np.concatenate(blocks)
+        n_new = sum(len(ids) for _, ids, _, _ in self._pending)
+        self._ids = np.concatenate(
+            [self._ids]
+            + [np.asarray(ids, dtype=str) for _, ids, _, _ in self._pending]
+        )
+        self._ref_doc_ids = np.concatenate(
+            [self._ref_doc_ids]
+            + [np.asarray(ref, dtype=str) for _, _, ref, _ in self._pending]
+        )
+        self._metadata.add(
+            [
+                metadata
+                for *_, metadatas in self._pending
+                for metadata in metadatas
+            ]
+        )
+        if self._alive is not None:
+            self._alive = np.concatenate(
+                [self._alive, np.ones(n_new, dtype=bool)]
+            )
+        self._pending = []
+        self._row_by_id = None
+
+    def _rows(self, node_ids: List[str]) -> List[int]:
+        self._consolidate()
+        if self._row_by_id is None:
+            self._row_by_id = {
+                str(node_id): row for row, node_id in enumerate(self._ids)
+            }
+        alive = self.alive
+        return [
+            self._row_by_id[node_id]
+            for node_id in node_ids
+            if node_id in self._row_by_id and alive[self._row_by_id[node_id]]
+        ]
+
+    def _n_alive(self) -> int:
+        if self._alive is None:
+            return len(self._ids)
+        return int(np.count_nonzero(self._alive))
+
+    def _rows_mask(self, node_ids: List[str]) -> np.ndarray:
+        """Whether every row is one of the live rows of node_ids."""
+        mask = np.zeros(len(self._ids), dtype=bool)
+        mask[self._rows(node_ids)] = True
+        return mask
+
+    def _delete_rows(self, rows):
+        alive = self.alive
+        alive[rows] = False
+        self._dirty = True
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        ids = [node.node_id for node in nodes]
+        self._pending.append(
+            (
+                normalize_rows([node.get_embedding() for node in nodes]),
+                ids,
+                [node.ref_doc_id or "" for node in nodes],
+                [
+                    {
+                        field: node.metadata.get(field)
+                        for field in self.metadata_fields
+                    }
+                    for node in nodes
+                ],
+            )
+        )
+        self._dirty = True
+        return ids
+
+    def get(self, text_id: str) -> List[float]:
+        rows = self._rows([text_id])
+        if not rows:
+            raise KeyError(text_id)
+        return self._embeddings[rows[0]].tolist()
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._consolidate()
+        self._delete_rows(np.flatnonzero(self._ref_doc_ids == ref_doc_id))
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[Any] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        if filters is None:
+            self._delete_rows(self._rows(node_ids or []))
+            return
+        rows = self.filter_rows(filters)
+        if node_ids is not None:
+            rows = np.intersect1d(rows, self._rows(node_ids))
+        self._delete_rows(rows)
+
+    def clear(self) -> None:
+        self._embeddings = None
+        self._ids = np.empty(0, dtype=str)
+        self._ref_doc_ids = np.empty(0, dtype=str)
+        self._alive = None
+        self._pending = []
+        self._row_by_id = None
+        self._dirty = True
+        self._metadata = MetadataIndex(self.metadata_fields)
+
+    def filter_rows(self, filters: MetadataFilters) -> np.ndarray:
+        """Rows not deleted whose metadata matches filters."""
+        self._consolidate()
+        rows = self._metadata.rows(filters)
+        return rows[self.alive[rows]]
+
+    def _candidate_mask(self, query: VectorStoreQuery) -> Optional[np.ndarray]:
+        """Rows a query may return: not deleted and matching the query ids.
+        None when every row may be returned."""
+        mask = None if self._alive is None else self._alive.copy()
+        if query.filters is not None:
+            mask = _and(mask, self._metadata.mask(query.filters))
+        if query.node_ids is not None and len(query.node_ids) < self._n_alive():
+            # Retrievers pass every node id of their index, so ids covering
+            # every live row don't restrict the query
+            mask = _and(mask, self._rows_mask(query.node_ids))
+        if query.doc_ids is not None:
+            mask = _and(mask, np.isin(self._ref_doc_ids, query.doc_ids))
+        return mask
+
+    def _score(
+        self,
+        query_embedding: np.ndarray,
+        mask: Optional[np.ndarray],
+        k: int,
+        **kwargs: Any,
+    ):
+        """Rows of the top k scores and the scores, highest first."""
+        if mask is not None:
+            candidates = np.flatnonzero(mask)
+            if len(candidates) < len(mask) // 2:
+                return self._score_rows(query_embedding, candidates, k)
+        scores = self._embeddings @ query_embedding
+        if mask is not None:
+            scores[~mask] = -np.inf
+            k = min(k, len(candidates))
+        rows = top_k(scores, k)
+        return rows, scores[rows]
+
+    def _score_rows(
+        self, query_embedding: np.ndarray, rows: np.ndarray, k: int
+    ):
+        """Exact _score restricted to rows, e.g. the few rows matching a
+        filter."""
+        scores = self._embeddings[rows] @ query_embedding
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def query(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        self._consolidate()
+        if self._embeddings is None or not len(self._ids):
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+        query_embedding = normalize_rows(query.query_embedding)
+        rows, scores = self._score(
+            query_embedding,
+            self._candidate_mask(query),
+            query.similarity_top_k,
+            **kwargs,
+        )
+        return self._result(rows, scores)
+
+    def query_batch(
+        self,
+        query_embeddings: List[List[float]],
+        similarity_top_k: int,
+        node_ids: Optional[List[str]] = None,
+        doc_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **kwargs: Any,
+    ) -> List[VectorStoreQueryResult]:
+        """Answer several queries at once.
+
+        Exact stores score a block of queries against every row with one
+        matrix-matrix product and keep the top k of every row, other stores
+        run their search once per query.
+
+        Args:
+            query_embeddings (List[List[float]]): Embedding of every query.
+            similarity_top_k (int): Rows returned per query.
+            node_ids (Optional[List[str]], optional): Restrict every query to
+                these nodes. Defaults to None.
+            doc_ids (Optional[List[str]], optional): Restrict every query to
+                these documents. Defaults to None.
+            filters (Optional[MetadataFilters], optional): Restrict every
+                query to the nodes matching these filters. Defaults to None.
+
+        Returns:
+            List[VectorStoreQueryResult]: One result per query, as query.
+        """
+        self._consolidate()
+        if self._embeddings is None or not len(self._ids):
+            return [
+                VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+                for _ in query_embeddings
+            ]
+        query_matrix = normalize_rows(query_embeddings)
+        mask = self._candidate_mask(
+            VectorStoreQuery(
+                node_ids=node_ids, doc_ids=doc_ids, filters=filters
+            )
+        )
+        if not self.exact:
+            return [
+                self._result(*self._score(q, mask, similarity_top_k, **kwargs))
+                for q in query_matrix
+            ]
+
+        k, matrix, candidates = similarity_top_k, self._embeddings, None
+        if mask is not None:
+            candidates = np.flatnonzero(mask)
+            k = min(k, len(candidates))
+            if len(candidates) < len(mask) // 2:
+                # Few allowed rows, e.g. filters: only score these
+                matrix, mask = self._embeddings[candidates], None
+            else:
+                candidates = None
+        block = max(1, _BATCH_BLOCK_VALUES // max(len(matrix), 1))
+        results = []
+        for start in range(0, len(query_matrix), block):
+            scores = query_matrix[start : start + block] @ matrix.T
+            if mask is not None:
+                scores[:, ~mask] = -np.inf
+            best = batch_top_k(scores, k)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            rows = best if candidates is None else candidates[best]
+            results.extend(
+                self._result(query_rows, query_scores)
+                for query_rows, query_scores in zip(rows, best_scores)
+            )
+        return results
+
+    def _result(self, rows: np.ndarray, scores: np.ndarray):
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=[float(s) for s in scores],
+            ids=[str(self._ids[row]) for row in rows],
+        )
+
+    def _config(self) -> Dict[str, Any]:
+        """Constructor arguments saved with the store."""
+        return {"metadata_fields": self.metadata_fields}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays saved by persist, one .npy file each."""
+        embeddings = self._embeddings
+        if embeddings is None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        return {
+            "embeddings": embeddings,
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            **self._metadata.arrays(),
+        }
+
+    def _load_arrays(self, store_dir: str):
+        """Load the arrays a subclass adds to _arrays."""
+
+    def _compact(self):
+        alive = self.alive
+        if not alive.all():
+            self._embeddings = np.ascontiguousarray(self._embeddings[alive])
+            self._ids = self._ids[alive]
+            self._ref_doc_ids = self._ref_doc_ids[alive]
+            self._metadata.keep(alive)
+            self._alive = None
+            self._row_by_id = None
+
+    def persist(
+        self,
+        persist_path: str,
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        """Save the store in a directory next to persist_path, which is the
+        path StorageContext.persist gives to the default vector store."""
+        store_dir = self.store_dir(os.path.dirname(persist_path))
+        self._consolidate()
+        if not self._dirty and os.path.exists(store_dir):
+            return
+        self._compact()
+        os.makedirs(store_dir, exist_ok=True)
+        arrays = self._arrays()
+
+        # Write then rename, arrays memory-mapped from the old files stay valid
+        for name, array in arrays.items():
+            tmp_path = os.path.join(store_dir, f"{name}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(store_dir, f"{name}.npy"))
+        embeddings = arrays["embeddings"]
+        dim = int(embeddings.shape[1]) if embeddings.ndim == 2 else 0
+        with open(os.path.join(store_dir, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "class_name": self.class_name(),
+                    "count": len(self._ids),
+                    "dim": dim,
+                    "config": self._config(),
+                },
+                f,
+            )
+        self._dirty = False
+
+        # Like a loaded store, only keep the pages of the matrix in use
+        if self._embeddings is not None and len(self._embeddings):
+            self._embeddings = np.load(
+                os.path.join(store_dir, "embeddings.npy"), mmap_mode="r"
+            )
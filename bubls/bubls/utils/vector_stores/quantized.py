@@ -0,0 +1,306 @@
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from bubls.utils.vector_stores.numpy_store import NumpyVectorStore, top_k
+from typing import Any, ClassVar, Dict, Optional
+import numpy as np
+import os
+
+# Values of the float32 temporary arrays decoded at once while scanning codes
+_SCAN_BLOCK_VALUES = 1 << 22
+
+
+def kmeans(
+    vectors: np.ndarray, k: int, n_iter: int = 20, seed: int = 0
+) -> np.ndarray:
+    """Centroids of k clusters of vectors, by Lloyd's algorithm."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = assign(vectors, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.stack(
+            [
+                np.bincount(assignments, weights=vectors[:, d], minlength=k)
+                for d in range(vectors.shape[1])
+            ],
+            axis=1,
+        )
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid of every vector, by euclidean distance."""
+    distances = (
+        -2 * vectors @ centroids.T + (centroids**2).sum(axis=1)[None, :]
+    )
+    return distances.argmin(axis=1)
+
+
+class QuantizedVectorStore(NumpyVectorStore):
+    """NumpyVectorStore that scans compressed codes instead of float vectors.
+
+    Queries score every row on the codes, which are the only vectors kept in
+    RAM, then re-rank the rerank_factor * k best candidates with the exact
+    float vectors. These are memory-mapped from disk, so only the rows of the
+    candidates are read. Subclasses define the codes.
+
+    Args:
+        rerank_factor (int, optional): Candidates re-ranked per result; 0 keeps
+            the approximate scores. Can be overridden per query through the
+            vector_store_kwargs of gen_retriever. Defaults to 4.
+    """
+
+    rerank_factor: int = Field(
+        default=4, description="Candidates re-ranked per result."
+    )
+
+    exact: ClassVar[bool] = False
+
+    _codes: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Codes of normalized vectors, training the quantizer if needed."""
+        raise NotImplementedError
+
+    def _approximate_scores(
+        self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Approximate scores of rows, every row by default."""
+        raise NotImplementedError
+
+    def _reset_quantizer(self):
+        raise NotImplementedError
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        n_encoded = len(self._ids)
+        super()._consolidate()
+        new_codes = self._encode(self._embeddings[n_encoded:])
+        self._codes = (
+            np.concatenate([self._codes, new_codes])
+            if self._codes is not None and len(self._codes)
+            else new_codes
+        )
+
+    def _compact(self):
+        alive = self.alive
+        if self._codes is not None and not alive.all():
+            self._codes = self._codes[alive]
+        super()._compact()
+
+    def clear(self) -> None:
+        super().clear()
+        self._codes = None
+        self._reset_quantizer()
+
+    def memory_bytes(self) -> int:
+        self._consolidate()
+        return 0 if self._codes is None else self._codes.nbytes
+
+    def _score(
+        self,
+        query_embedding: np.ndarray,
+        mask: Optional[np.ndarray],
+        k: int,
+        rerank_factor: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        if rerank_factor is None:
+            rerank_factor = self.rerank_factor
+        if mask is None:
+            rows = None
+            scores = self._approximate_scores(query_embedding)
+        else:
+            # Only the codes of the allowed rows are scanned
+            rows = np.flatnonzero(mask)
+            scores = self._approximate_scores(query_embedding, rows)
+        best = top_k(scores, k * max(rerank_factor, 1))
+        candidates = best if rows is None else rows[best]
+        if rerank_factor <= 0:
+            return candidates, scores[best]
+
+        # Sorted rows read the memory-mapped file sequentially
+        candidates = np.sort(candidates)
+        exact = self._embeddings[candidates] @ query_embedding
+        best = top_k(exact, k)
+        return candidates[best], exact[best]
+
+    def _config(self) -> Dict[str, Any]:
+        return {**super()._config(), "rerank_factor": self.rerank_factor}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        arrays["codes"] = (
+            self._codes
+            if self._codes is not None
+            else np.empty((0, 0), dtype=np.uint8)
+        )
+        return arrays
+
+    def _load_arrays(self, store_dir: str):
+        self._codes = np.load(os.path.join(store_dir, "codes.npy"))
+
+
+class Int8VectorStore(QuantizedVectorStore):
+    """QuantizedVectorStore with int8 scalar quantization, 4x smaller than
+    float32. Every dimension is scaled by its largest absolute value among the
+    first rows added; later values beyond it are clipped."""
+
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "Int8VectorStore"
+
+    def _reset_quantizer(self):
+        self._scales = None
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self._scales is None:
+            max_abs = np.abs(vectors).max(axis=0)
+            self._scales = np.where(max_abs == 0, 1, max_abs) / 127
+        return np.clip(np.rint(vectors / self._scales), -127, 127).astype(
+            np.int8
+        )
+
+    def _approximate_scores(
+        self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        scaled_query = (query_embedding * self._scales).astype(np.float32)
+        codes = self._codes if rows is None else self._codes[rows]
+        block = max(1, _SCAN_BLOCK_VALUES // codes.shape[1])
+        return np.concatenate(
+            [
+                codes[i : i + block].astype(np.float32) @ scaled_query
+                for i in range(0, len(codes), block)
+            ]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        arrays["scales"] = (
+            self._scales if self._scales is not None else np.empty(0)
+        )
+        return arrays
+
+    def _load_arrays(self, store_dir: str):
+        super()._load_arrays(store_dir)
+        self._scales = np.load(os.path.join(store_dir, "scales.npy"))
+        if not len(self._scales):
+            self._scales = None
+
+
+class PQVectorStore(QuantizedVectorStore):
+    """QuantizedVectorStore with product quantization.
+
+    Vectors are cut into subvectors of subvector_dim dimensions, each one coded
+    by the byte of its nearest centroid among 256, learnt with k-means on up
+    to train_size vectors the first time rows are added. Codes of 1536
+    dimension vectors take 192 bytes with the default subvector_dim, 32x
+    smaller than float32. Queries are scored with one lookup table of inner
+    products per subvector.
+
+    Args:
+        subvector_dim (int, optional): Dimensions per byte of code.
+            Defaults to 8.
+        train_size (int, optional): Vectors used to learn the centroids.
+            Defaults to 20_000.
+        rerank_factor (int, optional): See QuantizedVectorStore.
+    """
+
+    subvector_dim: int = Field(
+        default=8, description="Dimensions per byte of code."
+    )
+    train_size: int = Field(
+        default=20_000, description="Vectors used to learn the centroids."
+    )
+
+    _codebooks: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "PQVectorStore"
+
+    def _reset_quantizer(self):
+        self._codebooks = None
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dim) vectors as (n, n_subvectors, subvector_dim), zero padded."""
+        vectors = np.atleast_2d(vectors)
+        padding = -vectors.shape[1] % self.subvector_dim
+        if padding:
+            vectors = np.pad(vectors, ((0, 0), (0, padding)))
+        return vectors.reshape(len(vectors), -1, self.subvector_dim)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        subvectors = self._split(np.asarray(vectors, dtype=np.float32))
+        if self._codebooks is None:
+            rng = np.random.default_rng(0)
+            sample = subvectors[
+                rng.permutation(len(subvectors))[: self.train_size]
+            ]
+            self._codebooks = np.stack(
+                [
+                    kmeans(sample[:, s], 256)
+                    for s in range(subvectors.shape[1])
+                ]
+            )
+        return np.stack(
+            [
+                assign(subvectors[:, s], self._codebooks[s])
+                for s in range(subvectors.shape[1])
+            ],
+            axis=1,
+        ).astype(np.uint8)
+
+    def _approximate_scores(
+        self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        # (n_subvectors, n_centroids) inner products of query and centroids
+        lookup = np.einsum(
+            "scd,sd->sc", self._codebooks, self._split(query_embedding)[0]
+        )
+        codes = self._codes if rows is None else self._codes[rows]
+        n_subvectors = codes.shape[1]
+        block = max(1, _SCAN_BLOCK_VALUES // n_subvectors)
+        subvector_index = np.arange(n_subvectors)
+        return np.concatenate(
+            [
+                lookup[subvector_index, codes[i : i + block]].sum(axis=1)
+                for i in range(0, len(codes), block)
+            ]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    def _config(self) -> Dict[str, Any]:
+        return {
+            **super()._config(),
+            "subvector_dim": self.subvector_dim,
+            "train_size": self.train_size,
+        }
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        arrays["codebooks"] = (
+            self._codebooks
+            if self._codebooks is not None
+            else np.empty((0, 0, 0), dtype=np.float32)
+        )
+        return arrays
+
+    def _load_arrays(self, store_dir: str):
+        super()._load_arrays(store_dir)
+        self._codebooks = np.load(os.path.join(store_dir, "codebooks.npy"))
+        if not self._codebooks.size:
+            self._codebooks = None
+
+    def memory_bytes(self) -> int:
+        codebook_bytes = (
+            0 if self._codebooks is None else self._codebooks.nbytes
+        )
+        return super().memory_bytes() + codebook_bytes
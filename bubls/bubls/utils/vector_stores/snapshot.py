@@ -0,0 +1,137 @@
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from bubls.utils.vector_stores.numpy_store import NumpyVectorStore
+from typing import Any, Dict, List, Optional
+import numpy as np
+import dataclasses
+import fsspec
+import json
+import os
+
+
+class SnapshotVectorStore(NumpyVectorStore):
+    """NumpyVectorStore that also stores the nodes, so an index can be served
+    without a docstore.
+
+    Nodes are saved as JSON, one after the other in a single binary blob, with
+    the offset of every row in a side array. Loading memory-maps the blob
+    next to the embeddings, so ids and vectors are ready immediately and a
+    node is only parsed the first time a query returns it.
+    """
+
+    stores_text: bool = True
+
+    _blob: Optional[np.ndarray] = PrivateAttr(default=None)
+    _offsets: Optional[np.ndarray] = PrivateAttr(default=None)
+    _new_json: List[bytes] = PrivateAttr(default_factory=list)
+    _nodes: Dict[str, BaseNode] = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SnapshotVectorStore"
+
+    def _n_blob_rows(self) -> int:
+        return 0 if self._offsets is None else len(self._offsets) - 1
+
+    def _row_json(self, row: int) -> bytes:
+        n_blob_rows = self._n_blob_rows()
+        if row < n_blob_rows:
+            start, end = self._offsets[row], self._offsets[row + 1]
+            return self._blob[start:end].tobytes()
+        return self._new_json[row - n_blob_rows]
+
+    def _node(self, row: int) -> BaseNode:
+        node_id = str(self._ids[row])
+        if node_id not in self._nodes:
+            self._nodes[node_id] = json_to_doc(
+                json.loads(self._row_json(row))
+            )
+        return self._nodes[node_id]
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        ids = super().add(nodes, **add_kwargs)
+        for node in nodes:
+            node_without_embedding = node.copy()
+            node_without_embedding.embedding = None
+            self._new_json.append(
+                json.dumps(doc_to_json(node_without_embedding)).encode("utf-8")
+            )
+        return ids
+
+    def get_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[Any] = None,
+    ) -> List[BaseNode]:
+        if filters is not None:
+            raise NotImplementedError(
+                "SnapshotVectorStore only gets nodes by id."
+            )
+        if node_ids is None:
+            rows = np.flatnonzero(self.alive)
+        else:
+            rows = self._rows(node_ids)
+        return [self._node(row) for row in rows]
+
+    def _candidate_mask(self, query: VectorStoreQuery) -> Optional[np.ndarray]:
+        # Nodes of this store are not in the index_struct of its index, so
+        # as_retriever restricts every query to an empty list of node_ids
+        if query.node_ids is not None and not len(query.node_ids):
+            query = dataclasses.replace(query, node_ids=None)
+        return super()._candidate_mask(query)
+
+    def _result(self, rows: np.ndarray, scores: np.ndarray):
+        return VectorStoreQueryResult(
+            nodes=[self._node(row) for row in rows],
+            similarities=[float(s) for s in scores],
+            ids=[str(self._ids[row]) for row in rows],
+        )
+
+    def _compact(self):
+        alive = self.alive
+        if not alive.all():
+            self._new_json = [
+                self._row_json(row) for row in np.flatnonzero(alive)
+            ]
+            self._blob, self._offsets = None, None
+            self._nodes = {}
+        super()._compact()
+
+    def clear(self) -> None:
+        super().clear()
+        self._blob, self._offsets = None, None
+        self._new_json = []
+        self._nodes = {}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        rows_json = [self._row_json(row) for row in range(len(self._ids))]
+        lengths = np.array([len(j) for j in rows_json], dtype=np.int64)
+        arrays["offsets"] = np.concatenate([[0], np.cumsum(lengths)])
+        arrays["nodes"] = np.frombuffer(b"".join(rows_json), dtype=np.uint8)
+        return arrays
+
+    def _load_arrays(self, store_dir: str):
+        self._offsets = np.load(os.path.join(store_dir, "offsets.npy"))
+        self._blob = np.load(
+            os.path.join(store_dir, "nodes.npy"),
+            mmap_mode="r" if self._offsets[-1] else None,
+        )
+        self._new_json = []
+
+    def persist(
+        self,
+        persist_path: str,
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        self._consolidate()
+        dirty = self._dirty
+        super().persist(persist_path, fs)
+        if dirty:
+            # Serve the nodes from the blob just written
+            self._load_arrays(self.store_dir(os.path.dirname(persist_path)))
@@ -32,12 +32,14 @@ lyft_10k = {
         "source": "local",
         # "file_extractor": {".pdf": LlamaParse(result_type="text")}
     },
-    "gen_llm_eval_data": {
+    "split_docs": {
         "docs_pct_split": [0.2, 0.1, 0.1],
+        "seed": 42,
+    },
+    "gen_llm_eval_data": {
         "num_questions_per_chunk": 2,
     },
     "gen_nodes": {
-        "docs_pct_split": [0.2, 0.1, 0.1],
         "transformations": [
             SentenceSplitter(
                 chunk_size=2**10,
@@ -53,7 +55,12 @@ lyft_10k = {
         "num_questions_per_chunk": 2,
     },
     "gen_index": {},
-    # "gen_retriever": {},
+    # Keyword search helps on exact financial terms and figures
+    "gen_retriever": {
+        "similarity_top_k": 3,
+        "mode": "hybrid",
+        "fusion": "rrf",
+    },
     "gen_query_engine": {
         "description": "Provides information about Lyft financials for year 2021.",
         "similarity_top_k": 3,
@@ -83,18 +90,22 @@ papers_ridesharing = {
     "load_data": {
         "source": "local",
     },
-    "gen_llm_eval_data": {
+    "split_docs": {
         "docs_pct_split": [0.2, 0.1, 0.1],
-        "num_questions_per_chunk": 1,
+        "seed": 42,
     },
-    "gen_nodes": {
-        "docs_pct_split": [0.2, 0.1, 0.1],
+    "gen_llm_eval_data": {
+        "num_questions_per_chunk": 1,
     },
+    "gen_nodes": {},
     "gen_qa_pairs": {
         "num_questions_per_chunk": 1,
     },
-    "gen_index": {},
-    # "gen_retriever": {},
+    # Indexes file_name and page_label to filter retrieval on them
+    "gen_index": {"vector_store": "numpy"},
+    # "gen_retriever": {
+    #     "filters": {"file_name": "price_cycles_ridesharing_platforms.pdf"},
+    # },
     "gen_query_engine": {
         "description": """
             Provides research information about rideshare companies such as
@@ -118,13 +129,14 @@ wiki_public_companies = {
             "Amazon Company",
         ],
     },
-    "gen_llm_eval_data": {
+    "split_docs": {
         "docs_pct_split": [0.5, 0.25, 0.25],
-        "num_questions_per_chunk": 2,
+        "seed": 42,
     },
-    "gen_nodes": {
-        "docs_pct_split": [0.5, 0.25, 0.25],
+    "gen_llm_eval_data": {
+        "num_questions_per_chunk": 2,
     },
+    "gen_nodes": {},
     "gen_qa_pairs": {
         "num_questions_per_chunk": 2,
     },